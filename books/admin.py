@@ -7,7 +7,7 @@ class BookAdmin(admin.ModelAdmin):
     list_filter = ('genre', 'language', 'is_featured', 'categories', 'publication_date')
     search_fields = ('title', 'author', 'isbn', 'publisher', 'summary')
     filter_horizontal = ('categories',)
-    readonly_fields = ('average_rating', 'total_ratings')
+    readonly_fields = ('average_rating', 'total_ratings', 'rating_sum')
     list_editable = ('price', 'stock', 'is_featured')
     list_per_page = 20
     fieldsets = (
@@ -24,7 +24,7 @@ class BookAdmin(admin.ModelAdmin):
             'fields': ('price', 'stock')
         }),
         ('Ratings and Features', {
-            'fields': ('average_rating', 'total_ratings', 'is_featured')
+            'fields': ('average_rating', 'total_ratings', 'rating_sum', 'is_featured')
         }),
     )
     ordering = ('title',)
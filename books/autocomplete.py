@@ -0,0 +1,236 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import heapq
+import re
+import sys
+import threading
+import time
+import unicodedata
+
+TOKEN_RE = re.compile(r'\w+')
+STOP_WORDS = frozenset({'a', 'an', 'and', 'of', 'the', 'to', 'in', 'on', 'for', 'by'})
+# Upper bound for the first character of any token, used to close prefix ranges
+PREFIX_END = '\U0010ffff'
+
+def normalize(text):
+    """Lowercase, strip accents and split text into index tokens"""
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return TOKEN_RE.findall(text)
+
+class PrefixIndex:
+    """Per-process autocomplete index over normalized title and author tokens
+
+    Tokens live in one sorted list with a parallel array of book ids, so a
+    prefix maps to a contiguous slice found with two bisections. Book
+    changes from the save/delete signals go to a small delta (new token
+    sets) plus a set of base books masked out, and are folded into new
+    sorted arrays once the delta reaches DELTA_LIMIT books. Changes made by
+    other processes (or bulk queryset updates) are picked up by a rebuild
+    in a background thread once the index is older than max_age seconds;
+    requests keep reading the current index meanwhile.
+    """
+    CACHE_SIZE = 10000
+    DELTA_LIMIT = 500
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._tokens = []
+        self._ids = array('q')
+        self._books = {}
+        self._masked = set()
+        self._delta = {}
+        self._cache = {}
+        self._built_at = None
+        self._rebuilding = False
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _book_tokens(self, title, author):
+        return tuple(sorted({
+            sys.intern(token)
+            for token in normalize(title) + normalize(author)
+            if token not in STOP_WORDS
+        }))
+
+    def build(self, rows=None):
+        """(Re)build the whole index from (id, title, author, average_rating, total_ratings) rows"""
+        if rows is None:
+            from .models import Book
+            rows = (Book.objects
+                    .values_list('id', 'title', 'author', 'average_rating', 'total_ratings')
+                    .order_by()
+                    .iterator(chunk_size=5000))
+
+        books = {}
+        for book_id, title, author, average_rating, total_ratings in rows:
+            tokens = self._book_tokens(title, author)
+            books[book_id] = (title, author, average_rating, total_ratings, tokens)
+        tokens, ids = self._sorted_entries(books)
+
+        with self._lock:
+            self._tokens, self._ids, self._books = tokens, ids, books
+            self._masked, self._delta = set(), {}
+            self._cache = {}
+            self._built_at = time.monotonic()
+
+    @staticmethod
+    def _sorted_entries(books):
+        entries = sorted(
+            (token, book_id) for book_id, book in books.items() for token in book[4]
+        )
+        return [token for token, _ in entries], array('q', (book_id for _, book_id in entries))
+
+    def ensure_fresh(self):
+        """Build on first use (once, however many requests arrive together), then
+        refresh in the background when stale"""
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self.build()
+            return
+        if time.monotonic() - self._built_at <= self.max_age:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        from django.db import connection
+        try:
+            with self._build_lock:
+                self.build()
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _invalidate(self, tokens):
+        for token in tokens:
+            for end in range(1, len(token) + 1):
+                self._cache.pop(token[:end], None)
+
+    def remove(self, book_id):
+        """Drop a book from the index"""
+        with self._lock:
+            book = self._books.pop(book_id, None)
+            if book is None:
+                return
+            if self._delta.pop(book_id, None) is None:
+                self._masked.add(book_id)
+            self._invalidate(book[4])
+
+    def update(self, book):
+        """Insert or refresh one Book instance"""
+        with self._lock:
+            self.remove(book.pk)
+            tokens = self._book_tokens(book.title, book.author)
+            self._books[book.pk] = (
+                book.title, book.author, book.average_rating, book.total_ratings, tokens
+            )
+            self._delta[book.pk] = tokens
+            self._invalidate(tokens)
+            if len(self._delta) + len(self._masked) >= self.DELTA_LIMIT:
+                self._compact()
+
+    def _compact(self):
+        """Fold the delta and masked books into new sorted arrays
+
+        The live base entries are already sorted and the delta entries are
+        sorted on their own, so the final sort is a linear merge of two runs.
+        """
+        entries = [(token, book_id) for token, book_id in zip(self._tokens, self._ids)
+                   if book_id not in self._masked]
+        entries.extend(sorted(
+            (token, book_id) for book_id, tokens in self._delta.items() for token in tokens
+        ))
+        entries.sort()
+        self._tokens = [token for token, _ in entries]
+        self._ids = array('q', (book_id for _, book_id in entries))
+        self._masked, self._delta = set(), {}
+
+    def _word_ids(self, word, prefix=False):
+        """Ids of live books with a token equal to word, or starting with it if prefix"""
+        lo = bisect_left(self._tokens, word)
+        hi = (bisect_left(self._tokens, word + PREFIX_END, lo) if prefix
+              else bisect_right(self._tokens, word, lo))
+        ids = set(self._ids[lo:hi])
+        if self._masked:
+            ids -= self._masked
+        for book_id, tokens in self._delta.items():
+            if any(token.startswith(word) if prefix else token == word for token in tokens):
+                ids.add(book_id)
+        return ids
+
+    def _rank_key(self, book_id):
+        book = self._books[book_id]
+        return (book[2], book[3], -book_id)
+
+    def _top_for_prefix(self, prefix, limit):
+        cached = self._cache.get(prefix)
+        if cached is not None and len(cached) >= limit:
+            return cached[:limit]
+        top = heapq.nlargest(limit, self._word_ids(prefix, prefix=True), key=self._rank_key)
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[prefix] = top
+        return top
+
+    def complete(self, query, limit=10):
+        """Best-rated books whose tokens contain every complete word of query
+        and a token starting with its last word"""
+        words = [word for word in normalize(query) if word not in STOP_WORDS] or normalize(query)
+        if not words:
+            return []
+        *complete_words, prefix = words
+
+        with self._lock:
+            if not complete_words:
+                book_ids = self._top_for_prefix(prefix, limit)
+            else:
+                candidates = None
+                for word in complete_words:
+                    matches = self._word_ids(word)
+                    candidates = matches if candidates is None else candidates & matches
+                    if not candidates:
+                        return []
+                candidates = [
+                    book_id for book_id in candidates
+                    if any(token.startswith(prefix) for token in self._books[book_id][4])
+                ]
+                book_ids = heapq.nlargest(limit, candidates, key=self._rank_key)
+
+            return [
+                {
+                    "id": book_id,
+                    "title": self._books[book_id][0],
+                    "author": self._books[book_id][1],
+                    "average_rating": self._books[book_id][2],
+                    "total_ratings": self._books[book_id][3],
+                }
+                for book_id in book_ids
+            ]
+
+    def memory_footprint(self):
+        """Approximate bytes held by the index structures"""
+        with self._lock:
+            unique_tokens = set(self._tokens)
+            size = sys.getsizeof(self._tokens) + sys.getsizeof(self._ids)
+            size += sum(sys.getsizeof(token) for token in unique_tokens)
+            size += sys.getsizeof(self._books)
+            for book in self._books.values():
+                size += sys.getsizeof(book) + sys.getsizeof(book[0]) + sys.getsizeof(book[1])
+                size += sys.getsizeof(book[4])
+            return {
+                "books": len(self._books),
+                "entries": len(self._tokens),
+                "distinct_tokens": len(unique_tokens),
+                "bytes": size,
+            }
+
+autocomplete_index = PrefixIndex()
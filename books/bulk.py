@@ -0,0 +1,213 @@
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Book
+from .serializers import BookWriteSerializer, StockChangeSerializer
+from .autocomplete import autocomplete_index
+from .cache import CATALOG, STOCK, bump_catalog_version
+from .search import get_search_backend
+
+def item_key(item):
+    """('id', pk) or ('isbn', isbn) naming the book an item targets, or None"""
+    if item.get('id') not in (None, ''):
+        try:
+            return 'id', int(item['id'])
+        except (TypeError, ValueError):
+            return None
+    if item.get('isbn'):
+        return 'isbn', str(item['isbn']).strip()
+    return None
+
+class BulkBookWriter:
+    """Validate and apply a batch of book creates, updates and stock changes
+
+    Items are validated in memory against the books they target and the
+    ISBNs they claim, both read with one query. The valid items are then
+    written in one transaction: one bulk_create, one bulk_update per set of
+    changed fields and one UPDATE ... FROM unnest for stock changes. Invalid items are reported
+    and skipped. Bulk writes bypass model signals, so the search indexes
+    and the catalog version are refreshed once after the commit.
+
+    Updates and stock changes are keyed by ``id`` or ``isbn``; an ISBN can
+    only be changed by an update keyed by id. Stock changes to the same
+    book are folded together and succeed or fail together, failing if the
+    stock would drop below zero.
+    """
+
+    def __init__(self, create=(), update=(), stock=()):
+        self.items = {'create': list(create), 'update': list(update), 'stock': list(stock)}
+        self.results = {name: [None] * len(items) for name, items in self.items.items()}
+
+    def run(self):
+        self.load_books()
+        created = self.validate_creates()
+        updated, update_fields = self.validate_updates()
+        stock_changes = self.validate_stock()
+
+        with transaction.atomic():
+            if created:
+                Book.objects.bulk_create([book for _, book in created], batch_size=1000)
+            if updated:
+                # Each book writes only the fields its own items changed, so
+                # columns read unlocked by load_books (e.g. stock, which orders
+                # decrement concurrently) are never written back stale
+                now = timezone.now()
+                groups = defaultdict(list)
+                for book in updated.values():
+                    book.updated_at = now
+                    groups[tuple(sorted(update_fields[book.pk] | {'updated_at'}))].append(book)
+                for fields, books in groups.items():
+                    Book.objects.bulk_update(books, fields, batch_size=1000)
+            new_stock = self.apply_stock(stock_changes)
+
+        for index, book in created:
+            self.results['create'][index] = {'index': index, 'status': 'created',
+                                             'id': book.pk, 'isbn': book.isbn}
+        for index, book in self.update_targets:
+            self.results['update'][index] = {'index': index, 'status': 'updated',
+                                             'id': book.pk, 'isbn': book.isbn}
+        for book_id, (_, _, indexes) in stock_changes.items():
+            for index in indexes:
+                if book_id in new_stock:
+                    result = {'status': 'updated', 'id': book_id, 'stock': new_stock[book_id]}
+                else:
+                    result = {'status': 'invalid', 'errors': {'stock': ["Not enough stock"]}}
+                self.results['stock'][index] = {'index': index, **result}
+
+        changed = [book for _, book in created] + list(updated.values())
+        if changed or new_stock:
+            transaction.on_commit(lambda: self.refresh_indexes(changed))
+            bump_catalog_version(CATALOG if changed else STOCK)
+        return self.summary()
+
+    def load_books(self):
+        """Read every book the batch targets or whose ISBN it claims, in one query"""
+        ids, isbns = set(), set()
+        for name in ('update', 'stock'):
+            for item in self.items[name]:
+                key = item_key(item)
+                if key:
+                    (ids if key[0] == 'id' else isbns).add(key[1])
+        for name in ('create', 'update'):
+            isbns.update(str(item['isbn']).strip() for item in self.items[name] if item.get('isbn'))
+
+        books = Book.objects.filter(Q(pk__in=ids) | Q(isbn__in=isbns)) if ids or isbns else []
+        self.by_id = {book.pk: book for book in books}
+        self.by_isbn = {book.isbn: book for book in self.by_id.values()}
+        self.claimed = set()
+
+    def resolve(self, item):
+        key = item_key(item)
+        if key is None:
+            return None
+        return (self.by_id if key[0] == 'id' else self.by_isbn).get(key[1])
+
+    def fail(self, name, index, status, errors):
+        self.results[name][index] = {'index': index, 'status': status, 'errors': errors}
+
+    def claim_isbn(self, isbn, book=None):
+        """Reserve an ISBN for a new book or a renamed one, unless another book has it"""
+        owner = self.by_isbn.get(isbn)
+        if (owner is not None and owner is not book) or isbn in self.claimed:
+            return False
+        self.claimed.add(isbn)
+        return True
+
+    def validate_creates(self):
+        created = []
+        for index, data in enumerate(self.items['create']):
+            serializer = BookWriteSerializer(data=data)
+            if not serializer.is_valid():
+                self.fail('create', index, 'invalid', serializer.errors)
+            elif not self.claim_isbn(serializer.validated_data['isbn']):
+                self.fail('create', index, 'invalid', {'isbn': ["book with this isbn already exists."]})
+            else:
+                created.append((index, Book(**serializer.validated_data)))
+        return created
+
+    def validate_updates(self):
+        """Apply valid update items to their books; returns ({id: book}, {id: changed fields})"""
+        updated, fields = {}, defaultdict(set)
+        self.update_targets = []
+        for index, data in enumerate(self.items['update']):
+            book = self.resolve(data)
+            if book is None:
+                self.fail('update', index, 'not_found', {'detail': "No book with this id or isbn"})
+                continue
+            # The key names the book; only id-keyed updates may change the ISBN
+            changes = {name: value for name, value in data.items()
+                       if name != 'id' and not (name == 'isbn' and 'id' not in data)}
+            serializer = BookWriteSerializer(book, data=changes, partial=True)
+            if not serializer.is_valid():
+                self.fail('update', index, 'invalid', serializer.errors)
+                continue
+            isbn = serializer.validated_data.get('isbn', book.isbn)
+            if isbn != book.isbn and not self.claim_isbn(isbn, book):
+                self.fail('update', index, 'invalid', {'isbn': ["book with this isbn already exists."]})
+                continue
+            for name, value in serializer.validated_data.items():
+                setattr(book, name, value)
+            fields[book.pk].update(serializer.validated_data)
+            updated[book.pk] = book
+            self.update_targets.append((index, book))
+        return updated, fields
+
+    def validate_stock(self):
+        """Fold stock items per book into (level or None, delta, item indexes)"""
+        changes = {}
+        for index, data in enumerate(self.items['stock']):
+            book = self.resolve(data)
+            if book is None:
+                self.fail('stock', index, 'not_found', {'detail': "No book with this id or isbn"})
+                continue
+            serializer = StockChangeSerializer(data=data)
+            if not serializer.is_valid():
+                self.fail('stock', index, 'invalid', serializer.errors)
+                continue
+            level, delta, indexes = changes.get(book.pk, (None, 0, []))
+            if 'stock' in serializer.validated_data:
+                level, delta = serializer.validated_data['stock'], 0
+            else:
+                delta += serializer.validated_data['delta']
+            changes[book.pk] = (level, delta, indexes + [index])
+        return changes
+
+    def apply_stock(self, changes):
+        """Apply stock changes relative to the stored levels; returns {book id: new stock}"""
+        if not changes:
+            return {}
+        book_ids = list(changes)
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE books SET
+                    stock = COALESCE(change.stock, books.stock) + change.delta,
+                    updated_at = now()
+                FROM unnest(%s::bigint[], %s::integer[], %s::integer[])
+                    AS change(book_id, stock, delta)
+                WHERE books.id = change.book_id
+                  AND COALESCE(change.stock, books.stock) + change.delta >= 0
+                RETURNING books.id, books.stock
+            """, [book_ids,
+                  [changes[book_id][0] for book_id in book_ids],
+                  [changes[book_id][1] for book_id in book_ids]])
+            return dict(cursor.fetchall())
+
+    @staticmethod
+    def refresh_indexes(books):
+        backend = get_search_backend()
+        for book in books:
+            if autocomplete_index.is_built:
+                autocomplete_index.update(book)
+            backend.update(book)
+
+    def summary(self):
+        results = self.results
+        return {
+            'created': sum(1 for result in results['create'] if result['status'] == 'created'),
+            'updated': sum(1 for result in results['update'] if result['status'] == 'updated'),
+            'stock_updated': sum(1 for result in results['stock'] if result['status'] == 'updated'),
+            'failed': sum(1 for items in results.values()
+                          for result in items if result['status'] not in ('created', 'updated')),
+            'results': results,
+        }
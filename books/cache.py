@@ -0,0 +1,132 @@
+from functools import partial, wraps
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+# Cached responses depend on one or more version scopes, each bumped by a
+# different kind of write: catalog content (books, categories), stock levels
+# (every borrow, purchase and return) and rating counters (every review).
+CATALOG, STOCK, RATINGS = 'catalog', 'stock', 'ratings'
+VERSION_SCOPES = (CATALOG, STOCK, RATINGS)
+
+def local_cache():
+    return caches['catalog']
+
+def shared_cache():
+    """The cross-process tier, or None when only the local tier is configured"""
+    return caches['catalog_shared'] if 'catalog_shared' in settings.CACHES else None
+
+def version_key(scope):
+    return f'catalog:version:{scope}'
+
+def version_sequence(scope):
+    return f'books_catalog_version_{scope}'
+
+def catalog_version(scopes=VERSION_SCOPES):
+    """Current versions of scopes, as a tuple; a write in a scope increments its version
+
+    The versions live in the shared cache tier when there is one. Without
+    it they are PostgreSQL sequences (see books migration 0010), read for
+    all scopes in one statement, so every process still sees every
+    invalidation; a per-process counter would only see its own.
+    """
+    shared = shared_cache()
+    if shared is None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT ' + ', '.join(
+                # last_value stays at the start value until the first nextval()
+                f'(SELECT CASE WHEN is_called THEN last_value ELSE 0 END '
+                f'FROM {version_sequence(scope)})'
+                for scope in scopes
+            ))
+            return tuple(cursor.fetchone())
+
+    keys = [version_key(scope) for scope in scopes]
+    versions = shared.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # add() so concurrent first readers agree on the starting version
+            shared.add(key, 1, timeout=None)
+            versions[key] = shared.get(key, 1)
+    return tuple(versions[key] for key in keys)
+
+def bump_catalog_version(scope=CATALOG):
+    """Invalidate the cached responses depending on scope once the current transaction commits
+
+    Bumping before commit would let a concurrent reader cache pre-commit rows
+    under the new version.
+    """
+    def bump():
+        shared = shared_cache()
+        if shared is None:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT nextval(%s)', [version_sequence(scope)])
+            return
+        try:
+            shared.incr(version_key(scope))
+        except ValueError:
+            shared.add(version_key(scope), 2, timeout=None)
+    transaction.on_commit(bump)
+
+def response_key(request, version):
+    """Cache key from the absolute path, sorted query parameters, format and version"""
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values if value != ''
+    )
+    raw = repr((request.build_absolute_uri(request.path), params,
+                request.accepted_renderer.format, version))
+    return f'catalog:response:{hashlib.md5(raw.encode()).hexdigest()}'
+
+def catalog_cached(view_method=None, *, scopes=VERSION_SCOPES):
+    """Serve a read-only catalog action from the versioned response cache
+
+    Responses are cached by data (before rendering) together with their ETag
+    under the versions of the scopes the action renders, so actions that
+    show no stock or ratings survive borrows and reviews. A hit, or a 304
+    for a client that already holds it, costs a version read and one or two
+    cache lookups. Only successful GET responses are stored.
+    """
+    if view_method is None:
+        return partial(catalog_cached, scopes=scopes)
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return view_method(self, request, *args, **kwargs)
+
+        key = response_key(request, catalog_version(scopes))
+        local, shared = local_cache(), shared_cache()
+        entry = local.get(key)
+        if entry is None and shared is not None:
+            entry = shared.get(key)
+            if entry is not None:
+                local.set(key, entry, settings.CATALOG_CACHE_LOCAL_TIMEOUT)
+        if entry is not None:
+            response = get_conditional_response(request, etag=entry['etag']) or Response(entry['data'])
+            response['ETag'] = entry['etag']
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            if not response.has_header('ETag'):
+                response['ETag'] = content_etag(response.data)
+            entry = {'data': response.data, 'etag': response['ETag']}
+            local.set(key, entry, settings.CATALOG_CACHE_LOCAL_TIMEOUT)
+            if shared is not None:
+                shared.set(key, entry, settings.CATALOG_CACHE_SHARED_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+def content_etag(data):
+    """Strong ETag hashed from response data, for actions without row validators"""
+    raw = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
@@ -0,0 +1,104 @@
+import hashlib
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, Case, CharField, Q, Value, When
+from .cache import catalog_version, local_cache, shared_cache
+
+# (label, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = [
+    ('0-10', 0, 10),
+    ('10-25', 10, 25),
+    ('25-50', 25, 50),
+    ('50+', 50, None),
+]
+RATING_BUCKETS = [
+    ('4+', 4, None),
+    ('3-4', 3, 4),
+    ('2-3', 2, 3),
+    ('1-2', 1, 2),
+    ('0-1', 0, 1),
+]
+FACETS = ['genre', 'language', 'price', 'rating', 'in_stock']
+# Query parameters that change the page but not the filtered set
+PAGE_PARAMS = {'cursor', 'page_size', 'ordering', 'fields', 'expand', 'facets'}
+
+def bucket(field, buckets):
+    whens = []
+    for label, low, high in buckets:
+        condition = Q(**{f'{field}__gte': low})
+        if high is not None:
+            condition &= Q(**{f'{field}__lt': high})
+        whens.append(When(condition, then=Value(label)))
+    return Case(*whens, default=Value(None), output_field=CharField())
+
+def facet_sql(queryset):
+    """One GROUPING SETS query counting every facet over the filtered queryset"""
+    rows = queryset.order_by().annotate(
+        price_bucket=bucket('price', PRICE_BUCKETS),
+        rating_bucket=bucket('average_rating', RATING_BUCKETS),
+        in_stock_flag=Case(When(stock__gt=0, then=Value(True)), default=Value(False),
+                           output_field=BooleanField()),
+    ).values('id', 'genre', 'language', 'price_bucket', 'rating_bucket', 'in_stock_flag')
+    inner, params = rows.query.sql_with_params()
+    sql = f"""
+        SELECT GROUPING(genre), GROUPING(language), GROUPING(price_bucket),
+               GROUPING(rating_bucket), GROUPING(in_stock_flag),
+               genre, language, price_bucket, rating_bucket, in_stock_flag, COUNT(*)
+        FROM ({inner}) AS filtered
+        GROUP BY GROUPING SETS (
+            (genre), (language), (price_bucket), (rating_bucket), (in_stock_flag)
+        )
+    """
+    return sql, params
+
+def compute_facets(queryset):
+    sql, params = facet_sql(queryset)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    counts = {facet: {} for facet in FACETS}
+    for row in rows:
+        grouping, values, count = row[:5], row[5:10], row[10]
+        # The one facet not rolled up in this grouping set
+        position = grouping.index(0)
+        if values[position] is not None:
+            counts[FACETS[position]][values[position]] = count
+
+    def ordered(facet, labels):
+        return [{'value': label, 'count': counts[facet][label]}
+                for label in labels if label in counts[facet]]
+
+    def by_count(facet):
+        return sorted(counts[facet], key=lambda value: (-counts[facet][value], value))
+
+    return {
+        'genre': ordered('genre', by_count('genre')),
+        'language': ordered('language', by_count('language')),
+        'price': ordered('price', [label for label, _, _ in PRICE_BUCKETS]),
+        'rating': ordered('rating', [label for label, _, _ in RATING_BUCKETS]),
+        'in_stock': ordered('in_stock', [True, False]),
+    }
+
+def facet_counts(request, queryset):
+    """Facet counts for the filters in request, cached under the catalog version"""
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values if value != '' and name not in PAGE_PARAMS
+    )
+    raw = repr((request.path, params, catalog_version()))
+    key = f'catalog:facets:{hashlib.md5(raw.encode()).hexdigest()}'
+
+    local, shared = local_cache(), shared_cache()
+    facets = local.get(key)
+    if facets is not None:
+        return facets
+    if shared is not None:
+        facets = shared.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        if shared is not None:
+            shared.set(key, facets, settings.CATALOG_CACHE_SHARED_TIMEOUT)
+    local.set(key, facets, settings.CATALOG_CACHE_LOCAL_TIMEOUT)
+    return facets
@@ -0,0 +1,281 @@
+from collections import Counter
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from .autocomplete import normalize, STOP_WORDS
+
+class BM25Index:
+    """In-process BM25 inverted index over the book catalog
+
+    The base segment stores postings in CSR form: for term row t, documents
+    postings[offsets[t]:offsets[t + 1]] with field-weighted term frequencies
+    in weights[...]. It is built in one pass, or memory-mapped from a saved
+    index (see save() for the on-disk layout). Changes from the Book signals go to a small in-memory
+    delta segment, and replaced or deleted base documents are masked out,
+    until compact() folds them back into a new base segment.
+    """
+    FIELD_WEIGHTS = {
+        'title': 3.0,
+        'author': 2.0,
+        'keywords': 1.5,
+        'summary': 1.0,
+        'publisher': 1.0,
+    }
+    K1 = 1.2
+    B = 0.75
+    FILES = ('offsets', 'postings', 'weights', 'doc_ids', 'doc_lengths')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._set_base({}, np.zeros(1, np.int64), np.zeros(0, np.int32),
+                       np.zeros(0, np.float32), np.zeros(0, np.int64), np.zeros(0, np.float32))
+        self.is_built = False
+
+    def _set_base(self, terms, offsets, postings, weights, doc_ids, doc_lengths):
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self._base_position = {int(book_id): i for i, book_id in enumerate(doc_ids)}
+        self._deleted = np.zeros(len(doc_ids), dtype=bool)
+        self._delta = {}
+        self._total_length = float(doc_lengths.sum())
+        self._live_count = len(doc_ids)
+
+    @classmethod
+    def analyze(cls, book):
+        """Field-weighted term frequencies and document length for a book dict"""
+        keywords = book.get('keywords') or []
+        if not isinstance(keywords, list):
+            keywords = []
+        frequencies = Counter()
+        for field, weight in cls.FIELD_WEIGHTS.items():
+            text = ' '.join(map(str, keywords)) if field == 'keywords' else book.get(field) or ''
+            for token in normalize(text):
+                if token not in STOP_WORDS:
+                    frequencies[token] += weight
+        return frequencies, float(sum(frequencies.values()))
+
+    @staticmethod
+    def book_rows():
+        from .models import Book
+        return (Book.objects
+                .values('id', 'title', 'author', 'keywords', 'summary', 'publisher')
+                .order_by('id')
+                .iterator(chunk_size=5000))
+
+    def build(self, rows=None):
+        """Build the base segment from book dicts (defaults to the whole catalog)"""
+        terms = {}
+        term_rows, docs, weights, doc_ids, doc_lengths = [], [], [], [], []
+        for position, book in enumerate(self.book_rows() if rows is None else rows):
+            frequencies, length = self.analyze(book)
+            doc_ids.append(book['id'])
+            doc_lengths.append(length)
+            for token, weight in frequencies.items():
+                term_rows.append(terms.setdefault(token, len(terms)))
+                docs.append(position)
+                weights.append(weight)
+
+        base = self._csr(
+            terms,
+            np.array(term_rows, dtype=np.int64),
+            np.array(docs, dtype=np.int32),
+            np.array(weights, dtype=np.float32),
+            np.array(doc_ids, dtype=np.int64),
+            np.array(doc_lengths, dtype=np.float32),
+        )
+        with self._lock:
+            self._set_base(*base)
+            self.is_built = True
+
+    @staticmethod
+    def _csr(terms, term_rows, docs, weights, doc_ids, doc_lengths):
+        order = np.argsort(term_rows, kind='stable')
+        counts = np.bincount(term_rows, minlength=len(terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return (terms, offsets, docs[order], weights[order], doc_ids, doc_lengths)
+
+    def update(self, book):
+        """Index a book dict (or Book instance), replacing any previous version"""
+        if not isinstance(book, dict):
+            book = {field: getattr(book, field) for field in ('id', *self.FIELD_WEIGHTS)}
+        frequencies, length = self.analyze(book)
+        with self._lock:
+            self.remove(book['id'])
+            self._delta[book['id']] = (frequencies, length)
+            self._total_length += length
+            self._live_count += 1
+
+    def remove(self, book_id):
+        with self._lock:
+            if book_id in self._delta:
+                _, length = self._delta.pop(book_id)
+            else:
+                position = self._base_position.get(book_id)
+                if position is None or self._deleted[position]:
+                    return
+                self._deleted[position] = True
+                length = float(self.doc_lengths[position])
+            self._total_length -= length
+            self._live_count -= 1
+
+    def search(self, query, limit=1000, book_ids=None):
+        """Return [(book_id, score)] for the best BM25 matches, best first
+
+        book_ids, a sorted int64 array, restricts the matches to those books
+        before the limit is applied.
+        """
+        tokens = [token for token in normalize(query) if token not in STOP_WORDS]
+        with self._lock:
+            if not tokens or not self._live_count:
+                return []
+            average_length = self._total_length / self._live_count
+            base_scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+            delta_scores = Counter()
+
+            for token in set(tokens):
+                row = self.terms.get(token)
+                if row is not None:
+                    start, end = self.offsets[row], self.offsets[row + 1]
+                    docs = self.postings[start:end]
+                    frequencies = self.weights[start:end]
+                    live = ~self._deleted[docs]
+                    docs, frequencies = docs[live], frequencies[live]
+                else:
+                    docs = frequencies = np.zeros(0, dtype=np.float32)
+                delta_hits = [
+                    (book_id, entry[0][token], entry[1])
+                    for book_id, entry in self._delta.items() if token in entry[0]
+                ]
+                document_frequency = len(docs) + len(delta_hits)
+                if not document_frequency:
+                    continue
+                idf = math.log(1 + (self._live_count - document_frequency + 0.5)
+                               / (document_frequency + 0.5))
+
+                if len(docs):
+                    norms = self.K1 * (1 - self.B + self.B * self.doc_lengths[docs] / average_length)
+                    base_scores[docs] += idf * frequencies * (self.K1 + 1) / (frequencies + norms)
+                for book_id, frequency, length in delta_hits:
+                    norm = self.K1 * (1 - self.B + self.B * length / average_length)
+                    delta_scores[book_id] += idf * frequency * (self.K1 + 1) / (frequency + norm)
+
+            matched = np.flatnonzero(base_scores)
+            if book_ids is not None:
+                matched = matched[np.isin(self.doc_ids[matched], book_ids)]
+                delta_scores = {
+                    book_id: score for book_id, score in delta_scores.items()
+                    if _contains(book_ids, book_id)
+                }
+            if len(matched) > limit:
+                matched = matched[np.argpartition(base_scores[matched], -limit)[-limit:]]
+            results = [(int(self.doc_ids[i]), float(base_scores[i])) for i in matched]
+            results.extend(delta_scores.items())
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
+
+    def compact(self):
+        """Fold the delta segment and deletions into a new base segment"""
+        with self._lock:
+            live = ~self._deleted
+            new_position = np.cumsum(live) - 1
+            term_of_posting = np.repeat(
+                np.arange(len(self.terms), dtype=np.int64), np.diff(self.offsets)
+            )
+            keep = live[self.postings]
+            terms = dict(self.terms)
+            term_rows = [term_of_posting[keep]]
+            docs = [new_position[self.postings[keep]].astype(np.int32)]
+            weights = [np.asarray(self.weights[keep], dtype=np.float32)]
+            doc_ids = [np.asarray(self.doc_ids[live])]
+            doc_lengths = [np.asarray(self.doc_lengths[live])]
+
+            position = int(live.sum())
+            delta_rows, delta_docs, delta_weights = [], [], []
+            for book_id, (frequencies, length) in self._delta.items():
+                for token, weight in frequencies.items():
+                    delta_rows.append(terms.setdefault(token, len(terms)))
+                    delta_docs.append(position)
+                    delta_weights.append(weight)
+                doc_ids.append(np.array([book_id], dtype=np.int64))
+                doc_lengths.append(np.array([length], dtype=np.float32))
+                position += 1
+            term_rows.append(np.array(delta_rows, dtype=np.int64))
+            docs.append(np.array(delta_docs, dtype=np.int32))
+            weights.append(np.array(delta_weights, dtype=np.float32))
+
+            self._set_base(*self._csr(
+                terms,
+                np.concatenate(term_rows),
+                np.concatenate(docs),
+                np.concatenate(weights),
+                np.concatenate(doc_ids),
+                np.concatenate(doc_lengths),
+            ))
+
+    def save(self, path):
+        """Write the index as .npy arrays plus a JSON vocabulary, and publish it at path
+
+        Each save goes to a fresh sibling directory ({path}.<timestamp>) and
+        path is a symlink swapped to it with os.replace, so processes that
+        have the previous version memory-mapped never see its files change,
+        and a load() never mixes files from two versions. Versions older than
+        the previous one are removed.
+        """
+        with self._lock:
+            if self._delta or self._deleted.any():
+                self.compact()
+            path = os.path.abspath(path)
+            version = f'{path}.{time.time_ns()}'
+            os.makedirs(version)
+            for name in self.FILES:
+                np.save(os.path.join(version, f'{name}.npy'), getattr(self, name))
+            with open(os.path.join(version, 'terms.json'), 'w') as file:
+                json.dump(self.terms, file)
+
+        previous = os.path.realpath(path) if os.path.lexists(path) else None
+        if os.path.isdir(path) and not os.path.islink(path):
+            # An index saved before versioning: move it aside so the symlink can take its place
+            previous = f'{path}.0'
+            os.rename(path, previous)
+        link = f'{path}.link-{os.getpid()}'
+        os.symlink(os.path.basename(version), link)
+        os.replace(link, path)
+
+        keep = {version, previous}
+        for entry in os.scandir(os.path.dirname(path)):
+            stamp = entry.name[len(os.path.basename(path)) + 1:]
+            if (entry.name.startswith(f'{os.path.basename(path)}.') and stamp.isdigit()
+                    and entry.is_dir(follow_symlinks=False) and entry.path not in keep):
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return version
+
+    def load(self, path):
+        """Memory-map a saved index; the arrays are paged in lazily by the OS
+
+        path is resolved once, so every file comes from the same version.
+        Returns the resolved directory.
+        """
+        version = os.path.realpath(path)
+        arrays = {
+            name: np.load(os.path.join(version, f'{name}.npy'), mmap_mode='r')
+            for name in self.FILES
+        }
+        with open(os.path.join(version, 'terms.json')) as file:
+            terms = json.load(file)
+        with self._lock:
+            self._set_base(terms, **arrays)
+            self.is_built = True
+        return version
+
+def _contains(sorted_ids, book_id):
+    position = np.searchsorted(sorted_ids, book_id)
+    return position < len(sorted_ids) and sorted_ids[position] == book_id
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from books.autocomplete import PrefixIndex, autocomplete_index
+import random
+import statistics
+import time
+
+class Command(BaseCommand):
+    help = 'Report autocomplete index build time, memory footprint and query latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Index this many synthetic books instead of the catalog')
+        parser.add_argument('--queries', type=int, default=10000,
+                            help='Number of timed lookups')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        index = autocomplete_index
+        start = time.perf_counter()
+        if options['synthetic']:
+            from books.management.commands.benchmark_search import WORDS, NAMES
+            index = PrefixIndex()
+            index.build(
+                (book_id,
+                 ' '.join(rng.sample(WORDS, 3)) + f' vol{book_id % 997}',
+                 ' '.join(rng.sample(NAMES, 2)),
+                 rng.uniform(0, 5),
+                 rng.randint(0, 10000))
+                for book_id in range(1, options['synthetic'] + 1)
+            )
+        else:
+            index.build()
+        build_seconds = time.perf_counter() - start
+
+        footprint = index.memory_footprint()
+        self.stdout.write(
+            f'Built in {build_seconds:.2f}s: {footprint["books"]} books, '
+            f'{footprint["entries"]} entries, {footprint["distinct_tokens"]} tokens, '
+            f'~{footprint["bytes"] / 1024 / 1024:.1f} MiB'
+        )
+
+        tokens = sorted(set(index._tokens))
+        if not tokens:
+            self.stdout.write(self.style.ERROR('Index is empty'))
+            return
+        queries = []
+        for _ in range(options['queries']):
+            token = rng.choice(tokens)
+            queries.append(token[:rng.randint(1, len(token))])
+
+        for label, run in (
+            ('cold', lambda q: index.complete(q)),
+            ('warm', lambda q: index.complete(q)),
+        ):
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                run(query)
+                timings.append((time.perf_counter() - start) * 1e6)
+            timings.sort()
+            self.stdout.write(
+                f'{label}: median {statistics.median(timings):.0f}us, '
+                f'p99 {timings[int(len(timings) * 0.99) - 1]:.0f}us'
+            )
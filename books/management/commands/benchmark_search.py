@@ -0,0 +1,108 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from books.models import Book
+from books.search import PostgresSearchBackend
+import statistics
+import time
+
+WORDS = [
+    'shadow', 'garden', 'river', 'empire', 'silent', 'winter', 'secret', 'history',
+    'stone', 'journey', 'ocean', 'dragon', 'city', 'light', 'memory', 'forest',
+    'war', 'love', 'night', 'kingdom', 'storm', 'island', 'mystery', 'science',
+    'crown', 'glass', 'desert', 'letters', 'machine', 'mountain', 'fire', 'dream',
+]
+NAMES = [
+    'Austen', 'Tolstoy', 'Mahfouz', 'Morrison', 'Hugo', 'Tagore', 'Woolf', 'Borges',
+    'Achebe', 'Murakami', 'Rowling', 'Orwell', 'Camus', 'Eco', 'Kafka', 'Dickens',
+]
+QUERIES = ['dragon', 'winter kingdom', 'Mahfouz', 'secret history', 'silent ocean storm']
+
+SYNTHETIC_BOOKS = """
+INSERT INTO books (title, author, genre, isbn, price, stock, summary, cover_image, language,
+                   publisher, edition, is_featured, keywords, average_rating, total_ratings,
+                   rating_sum, catalog_ratings, catalog_rating_sum, import_hash, updated_at)
+SELECT
+    initcap(w[1 + (g * 7) %% n] || ' ' || w[1 + (g * 13) %% n] || ' ' || w[1 + (g / 3) %% n]),
+    a[1 + g %% m] || ' ' || a[1 + (g / 7) %% m],
+    w[1 + (g / 11) %% n],
+    'bench-' || g,
+    10 + g %% 40,
+    g %% 5,
+    'A story of ' || w[1 + (g * 3) %% n] || ' and ' || w[1 + (g * 5) %% n] ||
+        ' told across ' || w[1 + (g * 17) %% n] || ' and ' || w[1 + (g * 19) %% n] || '.',
+    '',
+    'EN',
+    a[1 + (g / 13) %% m] || ' Press',
+    '',
+    false,
+    jsonb_build_array(w[1 + (g * 23) %% n], w[1 + (g * 29) %% n]),
+    (g %% 50) / 10.0,
+    g %% 1000,
+    (g %% 50) / 10.0 * (g %% 1000),
+    g %% 1000,
+    (g %% 50) / 10.0 * (g %% 1000),
+    '',
+    now()
+FROM generate_series(1, %s) AS g,
+     (SELECT %s::text[] AS w, %s AS n, %s::text[] AS a, %s AS m) AS vocab
+"""
+
+class Command(BaseCommand):
+    help = ('Benchmark legacy icontains search against ranked full-text search on a '
+            'synthetic catalog (rolled back afterwards)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Synthetic books to generate')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per query')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Results fetched per search (one page)')
+
+    def handle(self, *args, **options):
+        backend = PostgresSearchBackend()
+        with transaction.atomic():
+            self.stdout.write(f'Generating {options["rows"]} synthetic books...')
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute(SYNTHETIC_BOOKS, [
+                    options['rows'], WORDS, len(WORDS), NAMES, len(NAMES)
+                ])
+                cursor.execute('ANALYZE books')
+            self.stdout.write(f'Generated in {time.perf_counter() - start:.1f}s')
+
+            self.stdout.write(f'{"query":<24}{"icontains ms":>16}{"full-text ms":>16}')
+            for query in QUERIES:
+                legacy = self.time_query(
+                    self.legacy_search(query), options['repeat'], options['limit']
+                )
+                ranked = self.time_query(
+                    backend.search(Book.objects.all(), query), options['repeat'], options['limit']
+                )
+                self.stdout.write(f'{query:<24}{legacy:>16.1f}{ranked:>16.1f}')
+
+            transaction.set_rollback(True)
+
+    def legacy_search(self, query):
+        """The OR-of-icontains search BookViewSet.search used before full-text search"""
+        q_objects = Q()
+        for keyword in query.split():
+            q_objects |= (
+                Q(title__icontains=keyword) |
+                Q(author__icontains=keyword) |
+                Q(summary__icontains=keyword) |
+                Q(keywords__contains=[keyword.lower()]) |
+                Q(publisher__icontains=keyword)
+            )
+        return Book.objects.filter(q_objects).distinct()
+
+    def time_query(self, queryset, repeat, limit):
+        """Median milliseconds to count the matches and fetch the first page"""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset.count()
+            list(queryset[:limit])
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from books.inverted_index import BM25Index
+import time
+
+class Command(BaseCommand):
+    help = ('Build the in-process BM25 search index from the catalog and publish it for mmap '
+            'loading; running processes switch to it on their next search')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.BOOK_SEARCH_INDEX_PATH,
+                            help='Index directory (default: BOOK_SEARCH_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if not output:
+            raise CommandError('No output directory: pass --output or set BOOK_SEARCH_INDEX_PATH')
+
+        start = time.perf_counter()
+        index = BM25Index()
+        index.build()
+        version = index.save(output)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Indexed {len(index.doc_ids)} books, {len(index.terms)} terms, '
+                f'{len(index.postings)} postings in {time.perf_counter() - start:.1f}s -> {output} ({version})'
+            )
+        )
@@ -0,0 +1,10 @@
+from books.models import Book
+from books.views import BookViewSet
+from iqraa.export import ExportCommand
+
+class Command(ExportCommand):
+    help = 'Stream the book catalog as CSV or JSON lines'
+    fields = BookViewSet.export_fields
+
+    def get_queryset(self):
+        return Book.objects.all()
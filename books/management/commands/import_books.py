@@ -1,81 +1,179 @@
 from django.core.management.base import BaseCommand
-import csv
+from django.db import transaction
 from books.models import Book
+from books.cache import bump_catalog_version
+from datetime import date
 from decimal import Decimal
-from datetime import datetime
+import csv
+import hashlib
 import os
+import time
+
+LANGUAGES = {
+    'eng': 'EN', 'en': 'EN', 'en-US': 'EN', 'en-GB': 'EN', 'en-CA': 'EN',
+    'ara': 'AR', 'ar': 'AR',
+    'fre': 'FR', 'fr': 'FR',
+    'spa': 'ES', 'es': 'ES',
+    'ger': 'DE', 'de': 'DE',
+}
+
+def text(max_length):
+    def parse(value):
+        return value.strip()[:max_length]
+    return parse
+
+def number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def rating(value):
+    return number(value) or 0
+
+def integer(value):
+    value = number(value)
+    return int(value) if value is not None else 0
+
+def isbn(value):
+    # The export stored ISBN-10s as numbers, dropping leading zeros
+    value = value.strip()
+    return value.zfill(10) if value.isdigit() else value
+
+def year(value):
+    value = number(value)
+    if value is None or not 1 <= value <= 9999:
+        return None
+    return date(int(value), 1, 1)
+
+def language(value):
+    return LANGUAGES.get(value.strip(), 'EN')
+
+# Book field -> (CSV columns tried in order until one is non-empty, parser)
+COLUMNS = {
+    'isbn': (['isbn'], isbn),
+    'title': (['title', 'original_title'], text(1000)),
+    'author': (['authors'], text(1000)),
+    'publication_date': (['original_publication_year'], year),
+    'language': (['language_code'], language),
+    'average_rating': (['average_rating'], rating),
+    'total_ratings': (['ratings_count'], integer),
+    'cover_image': (['image_url'], text(200)),
+}
+# Store-managed fields, only set when a book is first imported
+CREATE_DEFAULTS = {
+    'genre': '',
+    'price': Decimal('19.99'),
+    'stock': 10,
+}
+# The rating counters also hold the book's reviews, so re-imports only replace the
+# catalog baseline and shift the counters by how much the baseline moved
+UPDATE_FIELDS = [
+    field for field in COLUMNS if field not in ('isbn', 'average_rating', 'total_ratings')
+] + ['catalog_ratings', 'catalog_rating_sum', 'import_hash', 'updated_at']
 
 class Command(BaseCommand):
-    help = 'Import books from CSV file'
+    help = 'Import or refresh books from the goodreads CSV export, in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default='bookstore_data.csv',
+                            help='CSV file to import')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows parsed and upserted per batch')
 
-    def handle(self, *args, **kwargs):
-        csv_path = 'bookstore_data.csv'
+    def handle(self, *args, **options):
+        csv_path = options['file']
         if not os.path.exists(csv_path):
             self.stdout.write(self.style.ERROR(f'CSV file not found at {csv_path}'))
             return
 
-        books_created = 0
-        books_updated = 0
-
-        with open(csv_path, 'r', encoding='utf-8') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                try:
-                    if not row.get('Id'):  # Changed from isbn to Id
-                        continue
-
-                    # Convert price to decimal if exists, otherwise use default
-                    try:
-                        price = Decimal(str(row['Price'])) if row.get('Price') else Decimal('19.99')
-                    except (ValueError, TypeError):
-                        price = Decimal('19.99')
-
-                    # Convert published date
-                    try:
-                        published_date = datetime.strptime(row['publishedDate'], '%Y-%m-%d').date() if row.get('publishedDate') else None
-                    except (ValueError, TypeError):
-                        published_date = None
-
-                    # Convert ratings count
-                    try:
-                        ratings_count = int(float(row['ratingsCount'])) if row.get('ratingsCount') else 0
-                    except (ValueError, TypeError):
-                        ratings_count = 0
-
-                    # Create or update book
-                    book, created = Book.objects.update_or_create(
-                        isbn=row['Id'],  # Using Id as ISBN
-                        defaults={
-                            'title': row['Title'].strip() if row.get('Title') else '',
-                            'description': row['description'].strip() if row.get('description') else '',
-                            'authors': row['authors'].strip() if row.get('authors') else '',
-                            'image': row['image'] if row.get('image') else '',
-                            'preview_link': row['previewLink'] if row.get('previewLink') else '',
-                            'info_link': row['infoLink'] if row.get('infoLink') else '',
-                            'publisher': row['publisher'].strip() if row.get('publisher') else '',
-                            'published_date': published_date,
-                            'price': price,
-                            'stock': 10,  # Default stock
-                            'language': 'EN',  # Default language
-                            'ratings_count': ratings_count,
-                            'average_rating': 0  # Will be calculated from reviews
-                        }
-                    )
-
-                    if created:
-                        books_created += 1
-                    else:
-                        books_updated += 1
-
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'Error importing book: {row.get("Title", "Unknown")} - {str(e)}'
-                        )
-                    )
-
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'Successfully imported books. Created: {books_created}, Updated: {books_updated}'
+        self.created = self.updated = self.unchanged = self.skipped = 0
+        # The export repeats some books, sometimes with different numbers; the first
+        # occurrence wins so that re-imports of the same file change nothing
+        seen = set()
+        start = time.perf_counter()
+        with open(csv_path, 'r', encoding='utf-8', newline='') as file:
+            batch = {}
+            for row in csv.DictReader(file):
+                book = self.parse_row(row)
+                if book is None or book['isbn'] in seen:
+                    self.skipped += 1
+                    continue
+                seen.add(book['isbn'])
+                batch[book['isbn']] = book
+                if len(batch) >= options['batch_size']:
+                    self.upsert(batch)
+                    batch = {}
+            self.upsert(batch)
+
+        if self.created or self.updated:
+            bump_catalog_version()
+        elapsed = time.perf_counter() - start
+        total = self.created + self.updated + self.unchanged
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported books. Created: {self.created}, Updated: {self.updated}, '
+            f'Unchanged: {self.unchanged}, Skipped: {self.skipped} '
+            f'({total / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+
+    def parse_row(self, row):
+        """Map a CSV row to Book field values, or None if it has no usable key"""
+        book = {}
+        for field, (columns, parse) in COLUMNS.items():
+            value = next((row[column] for column in columns if row.get(column)), '')
+            book[field] = parse(value)
+        if not book['isbn']:
+            # Books without an ISBN are keyed by their goodreads id
+            goodreads_id = integer(row.get('goodreads_book_id') or '')
+            if not goodreads_id:
+                return None
+            book['isbn'] = f'gr-{goodreads_id}'
+        if not book['title']:
+            return None
+        book['rating_sum'] = book['average_rating'] * book['total_ratings']
+        book['catalog_ratings'] = book['total_ratings']
+        book['catalog_rating_sum'] = book['rating_sum']
+        book['import_hash'] = hashlib.md5(
+            repr(sorted(book.items())).encode()
+        ).hexdigest()
+        return book
+
+    def upsert(self, batch):
+        """Insert new books and update changed ones with one INSERT ... ON CONFLICT"""
+        if not batch:
+            return
+        existing = {
+            isbn: (book_id, import_hash, catalog_ratings, catalog_rating_sum)
+            for isbn, book_id, import_hash, catalog_ratings, catalog_rating_sum in
+            Book.objects.filter(isbn__in=list(batch)).values_list(
+                'isbn', 'id', 'import_hash', 'catalog_ratings', 'catalog_rating_sum'
             )
-        )
\ No newline at end of file
+        }
+        changed = [
+            Book(**CREATE_DEFAULTS, **book)
+            for isbn, book in batch.items()
+            if existing.get(isbn, (None, None))[1] != book['import_hash']
+        ]
+        rating_deltas = {}
+        for book in changed:
+            if book.isbn in existing:
+                book_id, _, catalog_ratings, catalog_rating_sum = existing[book.isbn]
+                delta = (book.catalog_ratings - catalog_ratings,
+                         book.catalog_rating_sum - catalog_rating_sum)
+                if delta != (0, 0):
+                    rating_deltas[book_id] = delta
+        with transaction.atomic():
+            Book.objects.bulk_create(
+                changed,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['isbn'],
+                update_fields=UPDATE_FIELDS,
+            )
+            Book.add_ratings_bulk(rating_deltas)
+
+        updated = sum(1 for book in changed if book.isbn in existing)
+        self.updated += updated
+        self.created += len(changed) - updated
+        self.unchanged += len(batch) - len(changed)
+        self.stdout.write(f'Processed {self.created + self.updated + self.unchanged} books')
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:42
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE OR REPLACE FUNCTION books_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.author, '')), 'B') ||
+        setweight(to_tsvector('english', CASE
+            WHEN jsonb_typeof(NEW.keywords) = 'array'
+            THEN array_to_string(ARRAY(SELECT jsonb_array_elements_text(NEW.keywords)), ' ')
+            ELSE '' END), 'C') ||
+        setweight(to_tsvector('english',
+            coalesce(NEW.summary, '') || ' ' || coalesce(NEW.publisher, '')), 'D');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER books_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, author, keywords, summary, publisher ON books
+    FOR EACH ROW EXECUTE FUNCTION books_search_vector_update();
+
+UPDATE books SET title = title;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER IF EXISTS books_search_vector_trigger ON books;
+DROP FUNCTION IF EXISTS books_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_alter_book_author_alter_book_title'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='books_search_vector_gin'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
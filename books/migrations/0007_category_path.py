@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunSQL(
+            sql="""
+                WITH RECURSIVE tree AS (
+                    SELECT id, id::text || '/' AS path
+                    FROM categories WHERE parent_id IS NULL
+                    UNION ALL
+                    SELECT child.id, tree.path || child.id::text || '/'
+                    FROM categories child JOIN tree ON child.parent_id = tree.id
+                )
+                UPDATE categories SET path = tree.path
+                FROM tree WHERE categories.id = tree.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='categories_path_like', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
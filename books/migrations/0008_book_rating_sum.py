@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql="UPDATE books SET rating_sum = average_rating * total_ratings;",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
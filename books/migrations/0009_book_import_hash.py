@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_book_rating_sum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+# books.cache.version_sequence() of each scope in VERSION_SCOPES
+SEQUENCES = ['books_catalog_version_catalog', 'books_catalog_version_stock',
+             'books_catalog_version_ratings']
+
+
+class Migration(migrations.Migration):
+    """Sequences holding the catalog cache versions when no shared cache is configured"""
+
+    dependencies = [
+        ('books', '0009_book_import_hash'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            [f'CREATE SEQUENCE {name}' for name in SEQUENCES],
+            [f'DROP SEQUENCE {name}' for name in SEQUENCES],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_catalog_version_sequences'),
+        ('reviews', '0003_book_review_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='catalog_rating_sum',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='catalog_ratings',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        # Whatever the counters hold beyond the book's reviews came from the catalog
+        migrations.RunSQL(
+            sql="""
+                UPDATE books SET
+                    catalog_ratings = GREATEST(books.total_ratings - reviewed.review_count, 0),
+                    catalog_rating_sum = CASE WHEN books.total_ratings > reviewed.review_count
+                                              THEN GREATEST(books.rating_sum - reviewed.rating_sum, 0)
+                                              ELSE 0 END
+                FROM (
+                    SELECT book.id AS book_id,
+                           COUNT(review.id) AS review_count,
+                           COALESCE(SUM(review.rating), 0) AS rating_sum
+                    FROM books book
+                    LEFT JOIN reviews review ON review.book_id = book.id
+                    GROUP BY book.id
+                ) AS reviewed
+                WHERE books.id = reviewed.book_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
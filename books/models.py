@@ -1,19 +1,60 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Concat, Now, Substr
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL)
+    # Materialized path of ancestor ids including this one, e.g. "3/17/42/"
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'categories'
         verbose_name_plural = 'categories'
         ordering = ['name']
+        indexes = [
+            # Serves path__startswith subtree lookups
+            models.Index(fields=['path'], name='categories_path_like',
+                         opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Save and keep the materialized paths of this category and its subtree current"""
+        with transaction.atomic():
+            old_path = self.path
+            parent_path = ''
+            if self.parent_id:
+                parent_path = Category.objects.values_list('path', flat=True).get(pk=self.parent_id)
+                if old_path and parent_path.startswith(old_path):
+                    raise ValueError('A category cannot be moved under its own subtree')
+            super().save(*args, **kwargs)
+
+            new_path = f'{parent_path}{self.pk}/'
+            if new_path != old_path:
+                Category.objects.filter(pk=self.pk).update(path=new_path)
+                if old_path:
+                    self.move_subtree(old_path, new_path)
+                self.path = new_path
+
+    @classmethod
+    def move_subtree(cls, old_path, new_path):
+        """Rewrite the path prefix of every descendant of old_path"""
+        cls.objects.filter(path__startswith=old_path).exclude(path=old_path).update(
+            path=Concat(Value(new_path), Substr('path', len(old_path) + 1))
+        )
+
+    def subtree(self):
+        """This category and all of its descendants"""
+        return Category.objects.filter(path__startswith=self.path)
+
 class Book(models.Model):
     LANGUAGE_CHOICES = [
         ('EN', 'English'),
@@ -41,28 +82,107 @@ class Book(models.Model):
     keywords = models.JSONField(default=list, blank=True)
     average_rating = models.FloatField(default=0, validators=[MinValueValidator(0), MaxValueValidator(5)])
     total_ratings = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Sum of all ratings; average_rating is always rating_sum / total_ratings
+    rating_sum = models.FloatField(default=0, editable=False)
+    # The part of the counters that came with the imported catalog rather than from
+    # reviews on this site: total_ratings = catalog_ratings + the book's reviews
+    catalog_ratings = models.IntegerField(default=0, editable=False)
+    catalog_rating_sum = models.FloatField(default=0, editable=False)
+    # Hash of the imported source row, so re-imports skip unchanged books
+    import_hash = models.CharField(max_length=32, blank=True, editable=False)
+    # Also touched when the book's categories change, so it dates the whole representation
+    updated_at = models.DateTimeField(auto_now=True)
+    # Weighted full-text document, maintained by the books_search_vector_update trigger
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'books'
         ordering = ['title']
         indexes = [
             models.Index(fields=['title']),
+            models.Index(fields=['title', 'id']),
             models.Index(fields=['author']),
             models.Index(fields=['isbn']),
             models.Index(fields=['genre']),
             models.Index(fields=['language']),
             models.Index(fields=['is_featured']),
+            GinIndex(fields=['search_vector'], name='books_search_vector_gin'),
+            GinIndex(fields=['title'], name='books_title_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['author'], name='books_author_trgm', opclasses=['gin_trgm_ops']),
         ]
 
     def __str__(self):
         return self.title
 
-    def update_rating(self, new_rating):
-        """Update book's average rating when a new review is added"""
-        if self.total_ratings == 0:
-            self.average_rating = float(new_rating)
-        else:
-            total = self.average_rating * self.total_ratings
-            self.average_rating = (total + float(new_rating)) / (self.total_ratings + 1)
-        self.total_ratings += 1
-        self.save()
+    @classmethod
+    def take_stock(cls, book_id, quantity=1):
+        """Atomically take quantity copies if that many are in stock; False if not
+
+        The check and the decrement are one conditional UPDATE, so concurrent
+        orders for the last copies cannot oversell, and only the stock column
+        is written.
+        """
+        from .cache import STOCK, bump_catalog_version
+
+        taken = cls.objects.filter(pk=book_id, stock__gte=quantity).update(
+            stock=F('stock') - quantity,
+            updated_at=Now(),
+        )
+        if taken:
+            bump_catalog_version(STOCK)
+        return bool(taken)
+
+    @classmethod
+    def return_stock(cls, book_id, quantity=1):
+        """Atomically put quantity copies back in stock"""
+        from .cache import STOCK, bump_catalog_version
+
+        cls.objects.filter(pk=book_id).update(stock=F('stock') + quantity, updated_at=Now())
+        bump_catalog_version(STOCK)
+
+    @classmethod
+    def add_ratings(cls, book_id, count, total):
+        """Atomically fold count ratings summing to total into a book (negative to remove)
+
+        One UPDATE computes the new average from the row's current counters,
+        so concurrent reviews cannot lose each other's contributions.
+        """
+        from .cache import RATINGS, bump_catalog_version
+
+        new_count = F('total_ratings') + count
+        new_sum = F('rating_sum') + total
+        cls.objects.filter(pk=book_id).update(
+            total_ratings=new_count,
+            rating_sum=new_sum,
+            average_rating=Case(
+                When(Q(total_ratings__gt=-count), then=new_sum / new_count),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+            updated_at=Now(),
+        )
+        bump_catalog_version(RATINGS)
+
+    @classmethod
+    def add_ratings_bulk(cls, totals):
+        """add_ratings for many books in one statement; totals maps book id -> (count, total)"""
+        from .cache import RATINGS, bump_catalog_version
+
+        if not totals:
+            return
+        book_ids, counts, sums = zip(*((book_id, count, total)
+                                       for book_id, (count, total) in totals.items()))
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE books SET
+                    total_ratings = total_ratings + delta.count,
+                    rating_sum = rating_sum + delta.total,
+                    average_rating = CASE WHEN total_ratings + delta.count > 0
+                        THEN (rating_sum + delta.total) / (total_ratings + delta.count)
+                        ELSE 0 END,
+                    updated_at = now()
+                FROM unnest(%s::bigint[], %s::integer[], %s::float8[])
+                    AS delta(book_id, count, total)
+                WHERE books.id = delta.book_id
+            """, [list(book_ids), list(counts), list(sums)])
+        bump_catalog_version(RATINGS)
@@ -0,0 +1,201 @@
+from functools import lru_cache, reduce
+from operator import or_
+import os
+import threading
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Greatest
+from django.utils.module_loading import import_string
+import numpy as np
+
+from .models import Book
+from .inverted_index import BM25Index
+
+SEARCH_CONFIG = 'english'
+# pg_trgm's default word similarity threshold (0.6) misses most single-typo words
+SIMILARITY_THRESHOLD = 0.45
+
+class SearchBackend:
+    """Interface for book search backends, selected with settings.BOOK_SEARCH_BACKEND
+
+    search() and fuzzy_search() take a Book queryset (already carrying the
+    list filters) and return it narrowed to matches, best first, with a
+    search_rank annotation. update() and remove() are called from the Book
+    save/delete signals for backends that keep their own index.
+    """
+    supports_fuzzy = False
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def fuzzy_search(self, queryset, query):
+        """Typo-tolerant search; backends without one fall back to search()"""
+        return self.search(queryset, query)
+
+    def suggest(self, query, limit=5):
+        return []
+
+    def update(self, book):
+        pass
+
+    def remove(self, book_id):
+        pass
+
+class PostgresSearchBackend(SearchBackend):
+    """Ranked full-text search over the trigger-maintained Book.search_vector column
+
+    Title matches weigh most, then author, keywords and finally summary and
+    publisher (see the books_search_vector_update trigger).
+    """
+    supports_fuzzy = True
+
+    def build_query(self, query):
+        """OR the words of the query together, like the old icontains search did"""
+        terms = query.split()
+        if not terms:
+            return None
+        return reduce(or_, (SearchQuery(term, config=SEARCH_CONFIG) for term in terms))
+
+    @staticmethod
+    def rank(search_query):
+        """ts_rank as double precision
+
+        ts_rank and similarity() return real, which does not survive the
+        round trip through a pagination cursor as a Python float: the seek
+        comparison would then miss (or repeat) the row it stopped at.
+        """
+        return Cast(SearchRank(F('search_vector'), search_query), FloatField())
+
+    def search(self, queryset, query):
+        """Filter queryset to books matching query, best matches first"""
+        search_query = self.build_query(query)
+        if search_query is None:
+            return queryset.none()
+        return (queryset
+                .filter(search_vector=search_query)
+                .annotate(search_rank=self.rank(search_query))
+                .order_by('-search_rank', 'id'))
+
+    def set_similarity_threshold(self):
+        """Set the threshold the "<%" operator uses on this connection"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)",
+                [str(SIMILARITY_THRESHOLD)]
+            )
+
+    def fuzzy_search(self, queryset, query):
+        """Typo-tolerant search: full-text matches plus trigram matches on title and author
+
+        The trigram conditions use the "<%" word-similarity operator so the
+        books_title_trgm and books_author_trgm GIN indexes bound the scan.
+        """
+        search_query = self.build_query(query)
+        if search_query is None:
+            return queryset.none()
+        self.set_similarity_threshold()
+        return (queryset
+                .filter(
+                    Q(search_vector=search_query) |
+                    Q(title__trigram_word_similar=query) |
+                    Q(author__trigram_word_similar=query)
+                )
+                .annotate(
+                    search_rank=self.rank(search_query),
+                    similarity=Cast(Greatest(
+                        TrigramWordSimilarity(query, 'title'),
+                        TrigramWordSimilarity(query, 'author')
+                    ), FloatField())
+                )
+                .order_by('-search_rank', '-similarity', 'id'))
+
+    def suggest(self, query, limit=5):
+        """"Did you mean" candidates: titles and authors most similar to the query"""
+        self.set_similarity_threshold()
+        suggestions = []
+        for field in ('title', 'author'):
+            matches = (Book.objects
+                       .filter(**{f'{field}__trigram_word_similar': query})
+                       .annotate(similarity=TrigramWordSimilarity(query, field))
+                       .order_by('-similarity')
+                       .values_list(field, 'similarity')[:limit])
+            suggestions.extend(
+                {"text": text, "field": field, "similarity": round(similarity, 3)}
+                for text, similarity in matches
+            )
+
+        seen = set()
+        unique = []
+        for suggestion in sorted(suggestions, key=lambda s: s['similarity'], reverse=True):
+            if suggestion['text'] not in seen:
+                seen.add(suggestion['text'])
+                unique.append(suggestion)
+        return unique[:limit]
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """BM25 search from an in-process inverted index, for databases without full-text search
+
+    The index is memory-mapped from settings.BOOK_SEARCH_INDEX_PATH when set
+    and reloaded when the build_search_index command publishes a new
+    version there; otherwise it is built from the catalog on first use.
+    Either way the Book signals keep it current with this process's
+    changes, and changes made elsewhere arrive with the next published
+    index, so no request ever pays for a rebuild after the first.
+    """
+    MAX_RESULTS = 1000
+
+    def __init__(self, index_path=None):
+        self.index = BM25Index()
+        self.index_path = index_path if index_path is not None else getattr(
+            settings, 'BOOK_SEARCH_INDEX_PATH', ''
+        )
+        self._loaded_version = None
+        self._lock = threading.Lock()
+
+    def ensure_fresh(self):
+        if self.index_path and os.path.exists(os.path.join(self.index_path, 'terms.json')):
+            if os.path.realpath(self.index_path) != self._loaded_version:
+                with self._lock:
+                    if os.path.realpath(self.index_path) != self._loaded_version:
+                        self._loaded_version = self.index.load(self.index_path)
+        elif not self.index.is_built:
+            with self._lock:
+                if not self.index.is_built:
+                    self.index.build()
+
+    def search(self, queryset, query):
+        """Rank query against the index, restricted to the books queryset would
+        return, and keep the MAX_RESULTS best"""
+        self.ensure_fresh()
+        book_ids = None
+        if queryset.query.has_filters():
+            book_ids = np.fromiter(
+                queryset.order_by().values_list('id', flat=True).iterator(chunk_size=10000),
+                dtype=np.int64
+            )
+            book_ids.sort()
+        results = self.index.search(query, limit=self.MAX_RESULTS, book_ids=book_ids)
+        if not results:
+            return queryset.none()
+        return (queryset
+                .filter(id__in=[book_id for book_id, _ in results])
+                .annotate(search_rank=Case(
+                    *[When(id=book_id, then=Value(score)) for book_id, score in results],
+                    output_field=FloatField()
+                ))
+                .order_by('-search_rank', 'id'))
+
+    def update(self, book):
+        if self.index.is_built:
+            self.index.update(book)
+
+    def remove(self, book_id):
+        if self.index.is_built:
+            self.index.remove(book_id)
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """The configured search backend, shared by the whole process"""
+    return import_string(settings.BOOK_SEARCH_BACKEND)()
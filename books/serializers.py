@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from iqraa.serializers import DynamicFieldsMixin
 from .models import Book, Category
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -6,9 +7,56 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', 'description', 'parent']
 
-class BookSerializer(serializers.ModelSerializer):
+    def validate_parent(self, parent):
+        if parent and self.instance and self.instance.path and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError("A category cannot be moved under its own subtree")
+        return parent
+
+class BookSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     categories = CategorySerializer(many=True, read_only=True)
-    
+
+    class Meta:
+        model = Book
+        exclude = ['search_vector', 'import_hash', 'catalog_ratings', 'catalog_rating_sum']
+        # List payloads: no summaries, keywords or publishing details
+        compact_fields = ['id', 'title', 'author', 'genre', 'categories', 'price', 'stock',
+                          'cover_image', 'publication_date', 'language', 'is_featured',
+                          'average_rating', 'total_ratings']
+
+class BookWriteSerializer(serializers.ModelSerializer):
+    """Per-item field validation for bulk writes
+
+    ISBN uniqueness is checked for the whole batch at once by BulkBookWriter
+    rather than with a query per item, and rating counters are left to reviews.
+    """
     class Meta:
         model = Book
-        fields = '__all__'
\ No newline at end of file
+        exclude = ['search_vector', 'import_hash', 'catalog_ratings', 'catalog_rating_sum',
+                   'categories']
+        read_only_fields = ['average_rating', 'total_ratings']
+        extra_kwargs = {'isbn': {'validators': []}}
+
+class StockChangeSerializer(serializers.Serializer):
+    """A stock item sets the level (stock) or adjusts it (delta)"""
+    stock = serializers.IntegerField(min_value=0, required=False)
+    delta = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if ('stock' in data) == ('delta' in data):
+            raise serializers.ValidationError("Give exactly one of stock or delta")
+        return data
+
+class BookBulkSerializer(serializers.Serializer):
+    """Shape of a bulk write request; items are validated by BulkBookWriter"""
+    MAX_ITEMS = 5000
+
+    create = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    update = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    stock = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+
+    def validate(self, data):
+        if not any(data.values()):
+            raise serializers.ValidationError("Provide at least one create, update or stock item")
+        if sum(len(items) for items in data.values()) > self.MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {self.MAX_ITEMS} items per request")
+        return data
@@ -0,0 +1,51 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Book, Category
+from .autocomplete import autocomplete_index
+from .cache import bump_catalog_version
+from .search import get_search_backend
+
+@receiver(post_save, sender=Book)
+def update_search_indexes(sender, instance, **kwargs):
+    if autocomplete_index.is_built:
+        autocomplete_index.update(instance)
+    get_search_backend().update(instance)
+
+@receiver(post_delete, sender=Book)
+def remove_from_search_indexes(sender, instance, **kwargs):
+    if autocomplete_index.is_built:
+        autocomplete_index.remove(instance.pk)
+    get_search_backend().remove(instance.pk)
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Book.categories.through)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def touch_category_books(sender, instance, **kwargs):
+    """Books embed their categories, so a category change modifies them too"""
+    Book.objects.filter(categories=instance).update(updated_at=timezone.now())
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def touch_books_on_category_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        books = Book.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        books = Book.objects.filter(categories=instance)
+    else:
+        books = Book.objects.filter(pk__in=pk_set)
+    books.update(updated_at=timezone.now())
+
+@receiver(pre_delete, sender=Category)
+def reroot_category_subtree(sender, instance, **kwargs):
+    """Children of a deleted category become roots (parent is SET_NULL)"""
+    if instance.path:
+        Category.move_subtree(instance.path, '')
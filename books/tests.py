@@ -1,3 +1,709 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import date
+from decimal import Decimal
+import gzip
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from iqraa.export import export_stream
+from reviews.models import Review
+from users.models import CustomUser
+from .autocomplete import PrefixIndex, autocomplete_index
+from .bulk import BulkBookWriter
+from .inverted_index import BM25Index
+from .models import Book, Category
+from .search import InvertedIndexSearchBackend
+from .serializers import BookSerializer
+from .views import BookViewSet
 
-# Create your tests here.
+def make_book(number, **fields):
+    fields = {
+        'title': f'Book {number}', 'author': f'Author {number}', 'genre': 'Fiction',
+        'isbn': f'{number:010d}', 'price': Decimal('10.00'), 'stock': 5, **fields,
+    }
+    return Book.objects.create(**fields)
+
+class BookSuggestTest(TestCase):
+    """Did-you-mean suggestions for misspelled queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        for number, title in enumerate(['Dragon Tales', 'Dragon Rider', 'The Dragonfly'], 1):
+            make_book(number, title=title)
+
+    def suggest(self, **params):
+        return self.client.get('/api/books/suggest/', {'q': 'dragn', **params}, secure=True)
+
+    def test_suggestions(self):
+        response = self.suggest()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Dragon Tales', [suggestion['text'] for suggestion in response.data['suggestions']])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(len(self.suggest(limit=-1).data['suggestions']), 1)
+        self.assertEqual(len(self.suggest(limit=0).data['suggestions']), 1)
+        self.assertLessEqual(len(self.suggest(limit=1000).data['suggestions']), 20)
+
+    def test_invalid_limit(self):
+        self.assertEqual(self.suggest(limit='abc').status_code, 400)
+
+class BookSearchTest(TestCase):
+    """Ranked search keeps relevance order and pages through every match"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def search(self, **params):
+        return self.client.get('/api/books/search/', params, secure=True)
+
+    def walk(self, **params):
+        """Ids of every result, following next links to the end"""
+        ids = []
+        response = self.search(page_size=3, **params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(book['id'] for book in response.data['results'])
+            if not response.data['next']:
+                return ids
+            self.assertLess(len(ids), 100, 'pagination does not terminate')
+            response = self.client.get(response.data['next'], secure=True)
+
+    def test_relevance_order(self):
+        weak = make_book(1, title='Aardvarks', summary='A dragon appears once.')
+        strong = make_book(2, title='Zebra Dragon', keywords=['dragon'])
+        ids = [book['id'] for book in self.search(q='dragon').data['results']]
+        self.assertEqual(ids, [strong.pk, weak.pk])
+
+        ids = [book['id'] for book in self.search(q='dragon', ordering='title').data['results']]
+        self.assertEqual(ids, [weak.pk, strong.pk])
+
+    def test_pages_to_completion(self):
+        books = [
+            make_book(number, title=f'{"Dragon " * (number % 3 + 1)}Saga {number}',
+                      author=f'Writer {number}', summary='dragon ' * (number % 4))
+            for number in range(1, 15)
+        ]
+        ids = self.walk(q='dragon')
+        self.assertEqual(sorted(ids), sorted(book.pk for book in books))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_fuzzy_pages_to_completion(self):
+        books = [make_book(number, title=f'Dragon Saga {number}', author=f'Writer {number}')
+                 for number in range(1, 9)]
+        ids = self.walk(q='dragn')
+        self.assertEqual(sorted(ids), sorted(book.pk for book in books))
+
+    def test_fuzzy_results_are_capped(self):
+        for number in range(1, 8):
+            make_book(number, title=f'Dragon Saga {number}')
+        with patch('books.views.MAX_FUZZY_RESULTS', 4):
+            self.assertEqual(len(self.walk(q='dragn')), 4)
+
+class CatalogCacheTest(TestCase):
+    """Versioned response cache and conditional GETs"""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['catalog'].clear()
+        self.book = make_book(1, title='Dragon Tales')
+
+    def get(self, path, **headers):
+        return self.client.get(path, secure=True, headers=headers)
+
+    def test_hit_and_not_modified(self):
+        first = self.get('/api/books/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.get('/api/books/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.get('/api/books/', if_none_match=first['ETag']).status_code, 304)
+
+    def test_book_write_invalidates(self):
+        etag = self.get('/api/books/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'Dragon Tales, Revised'
+            self.book.save()
+        response = self.get('/api/books/', if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['title'], 'Dragon Tales, Revised')
+
+    def test_stock_change_invalidates_only_what_renders_stock(self):
+        self.get('/api/books/')
+        self.get('/api/books/genres/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(Book.take_stock(self.book.pk))
+        response = self.get('/api/books/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['stock'], 4)
+        self.assertEqual(self.get('/api/books/genres/')['X-Cache'], 'HIT')
+
+class ImportBooksTest(TestCase):
+    """import_books upserts idempotently and keeps review contributions"""
+    HEADER = ('goodreads_book_id,isbn,authors,original_publication_year,title,language_code,'
+              'average_rating,ratings_count,image_url\n')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'books.csv')
+
+    def run_import(self, *rows):
+        with open(self.path, 'w') as file:
+            file.write(self.HEADER + ''.join(f'{row}\n' for row in rows))
+        output = StringIO()
+        call_command('import_books', file=self.path, stdout=output)
+        return output.getvalue()
+
+    def test_reimport_is_idempotent(self):
+        rows = ['1,439023483,Suzanne Collins,2008,The Hunger Games,eng,4.0,10,',
+                '2,,J.K. Rowling,1997,Harry Potter,en-US,4.5,20,']
+        self.assertIn('Created: 2, Updated: 0, Unchanged: 0', self.run_import(*rows))
+        before = list(Book.objects.order_by('isbn').values())
+        self.assertIn('Created: 0, Updated: 0, Unchanged: 2', self.run_import(*rows))
+        self.assertEqual(list(Book.objects.order_by('isbn').values()), before)
+        self.assertEqual(Book.objects.get(isbn='gr-2').total_ratings, 20)
+
+    def test_update_keeps_review_ratings(self):
+        self.run_import('1,439023483,Suzanne Collins,2008,The Hunger Games,eng,4.0,10,')
+        book = Book.objects.get(isbn='0439023483')
+        user = CustomUser.objects.create_user(username='reader', password='secret')
+        Review.objects.create(user=user, book=book, rating=5, comment='')
+
+        self.assertIn('Updated: 1', self.run_import(
+            '1,439023483,Suzanne Collins,2008,The Hunger Games,eng,4.0,20,'
+        ))
+        book.refresh_from_db()
+        self.assertEqual((book.catalog_ratings, book.catalog_rating_sum), (20, 80.0))
+        self.assertEqual((book.total_ratings, book.rating_sum), (21, 85.0))
+        self.assertAlmostEqual(book.average_rating, 85 / 21)
+
+class BookExportTest(TestCase):
+    """Staff exports stream every row in each format"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create_user(username='staff', password='secret', is_staff=True)
+        )
+        self.books = [make_book(number, title=f'Book, "{number}"') for number in range(1, 6)]
+
+    def export(self, **params):
+        response = self.client.get('/api/books/export/', params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        rows = list(csv.reader(self.export().decode().splitlines()))
+        self.assertEqual(rows[0], BookViewSet.export_fields)
+        self.assertEqual([row[0] for row in rows[1:]], [str(book.pk) for book in self.books])
+        self.assertEqual(rows[1][2], 'Book, "1"')
+
+    def test_jsonl_gzip_and_filters(self):
+        content = gzip.decompress(self.export(output='jsonl', gzip='1', search='"3"'))
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([(row['id'], row['title']) for row in rows], [(self.books[2].pk, 'Book, "3"')])
+
+    def test_chunks_cover_every_row(self):
+        fields = ['id', 'isbn']
+        for chunk_size in (1, 2, 5, 6):
+            lines = b''.join(export_stream(Book.objects.all(), fields, chunk_size=chunk_size))
+            self.assertEqual(len(lines.decode().splitlines()), 6, chunk_size)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get('/api/books/export/', secure=True).status_code, (401, 403))
+
+class BookBulkTest(TestCase):
+    """Bulk creates, updates and stock changes with per-item results"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create_user(username='staff', password='secret', is_staff=True)
+        )
+        self.book = make_book(1, title='Dragon Tales')
+        self.other = make_book(2, title='Garden Notes')
+
+    def bulk(self, **items):
+        response = self.client.post('/api/books/bulk/', items, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def new_book(self, isbn, **fields):
+        return {'title': f'New {isbn}', 'author': 'Author', 'genre': 'Fiction', 'isbn': isbn,
+                'price': '12.50', 'stock': 3, **fields}
+
+    def test_create_update_and_stock(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.bulk(
+                create=[self.new_book('1111111111')],
+                update=[{'id': self.book.pk, 'price': '15.00'},
+                        {'isbn': self.other.isbn, 'title': 'Garden Notes, Revised'}],
+                stock=[{'isbn': self.book.isbn, 'stock': 2}],
+            )
+        self.assertEqual((result['created'], result['updated'], result['stock_updated'],
+                          result['failed']), (1, 2, 1, 0))
+        self.assertTrue(Book.objects.filter(isbn='1111111111', stock=3).exists())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.price, self.book.stock), (Decimal('15.00'), 2))
+        self.assertEqual(Book.objects.get(pk=self.other.pk).title, 'Garden Notes, Revised')
+
+    def test_updates_write_only_their_own_fields(self):
+        load_books = BulkBookWriter.load_books
+
+        def load_then_order(writer):
+            load_books(writer)
+            # An order takes a copy after the batch has read the books
+            self.assertTrue(Book.take_stock(self.other.pk))
+
+        with patch.object(BulkBookWriter, 'load_books', load_then_order):
+            result = self.bulk(update=[{'id': self.book.pk, 'stock': 9},
+                                       {'id': self.other.pk, 'price': '15.00'}])
+        self.assertEqual(result['updated'], 2)
+        self.other.refresh_from_db()
+        self.assertEqual((self.other.price, self.other.stock), (Decimal('15.00'), 4))
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 9)
+
+    def test_stock_items_fold_per_book(self):
+        result = self.bulk(stock=[
+            {'id': self.book.pk, 'delta': -2},
+            {'isbn': self.book.isbn, 'delta': 4},
+            {'id': self.other.pk, 'stock': 1},
+            {'id': self.other.pk, 'delta': -1},
+        ])
+        self.assertEqual([item['stock'] for item in result['results']['stock']], [7, 7, 0, 0])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 7)
+
+        # All items for a book fail together when the total would go negative
+        result = self.bulk(stock=[{'id': self.book.pk, 'delta': -5},
+                                  {'id': self.book.pk, 'delta': -5}])
+        self.assertEqual([item['status'] for item in result['results']['stock']],
+                         ['invalid', 'invalid'])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 7)
+
+    def test_duplicate_isbns_are_rejected(self):
+        result = self.bulk(
+            create=[self.new_book('1111111111'), self.new_book('1111111111'),
+                    self.new_book(self.book.isbn)],
+            update=[{'id': self.other.pk, 'isbn': self.book.isbn}],
+        )
+        self.assertEqual([item['status'] for item in result['results']['create']],
+                         ['created', 'invalid', 'invalid'])
+        self.assertIn('isbn', result['results']['create'][1]['errors'])
+        self.assertEqual(result['results']['update'][0]['status'], 'invalid')
+        self.assertEqual(Book.objects.filter(isbn='1111111111').count(), 1)
+        self.assertEqual(Book.objects.get(pk=self.other.pk).isbn, self.other.isbn)
+
+    def test_invalid_and_missing_items(self):
+        result = self.bulk(
+            create=[self.new_book('2222222222', price='-1')],
+            update=[{'id': 999999, 'price': '1.00'}],
+            stock=[{'id': self.book.pk, 'stock': 1, 'delta': 1}],
+        )
+        self.assertEqual(result['failed'], 3)
+        self.assertEqual([result['results'][name][0]['status'] for name in ('create', 'update', 'stock')],
+                         ['invalid', 'not_found', 'invalid'])
+        self.assertEqual(self.client.post('/api/books/bulk/', {}, format='json', secure=True).status_code, 400)
+
+class BookSparseFieldsTest(TestCase):
+    """Lists render the compact projection; ?fields= and ?expand= reshape payloads"""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['catalog'].clear()
+        self.book = make_book(1, summary='A long summary', publisher='Publisher', keywords=['dragons'])
+        self.book.categories.add(Category.objects.create(name='Fantasy'))
+
+    def first(self, url):
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]
+
+    def test_list_is_compact(self):
+        with CaptureQueriesContext(connection) as queries:
+            book = self.first('/api/books/')
+        self.assertEqual(set(book), set(BookSerializer.Meta.compact_fields))
+        self.assertEqual(book['categories'][0]['name'], 'Fantasy')
+        # Columns the list does not render are not read either
+        self.assertFalse(any('"summary"' in query['sql'] for query in queries.captured_queries))
+
+    def test_detail_is_full(self):
+        response = self.client.get(f'/api/books/{self.book.pk}/', secure=True)
+        self.assertEqual(response.data['summary'], 'A long summary')
+        self.assertEqual(response.data['keywords'], ['dragons'])
+
+    def test_fields(self):
+        self.assertEqual(set(self.first('/api/books/?fields=id,title,summary')), {'id', 'title', 'summary'})
+        response = self.client.get(f'/api/books/{self.book.pk}/?fields=id,publisher', secure=True)
+        self.assertEqual(response.data, {'id': self.book.pk, 'publisher': 'Publisher'})
+
+    def test_expand(self):
+        book = self.first('/api/books/?expand=summary')
+        self.assertEqual(set(book), set(BookSerializer.Meta.compact_fields) | {'summary'})
+        self.assertEqual(book['summary'], 'A long summary')
+        book = self.first('/api/books/?expand=*')
+        self.assertEqual(set(book), set(BookSerializer().fields))
+
+class BookFacetTest(TestCase):
+    """?facets=true counts every facet over the whole filtered set"""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['catalog'].clear()
+        for number, (genre, language, price, stock, rating) in enumerate([
+            ('Fiction', 'EN', 5, 0, 4.5),
+            ('Fiction', 'AR', 20, 3, 3.2),
+            ('History', 'EN', 30, 1, 0),
+            ('Fiction', 'EN', 60, 2, 4.0),
+        ], 1):
+            make_book(number, title=f'Dragon {number}', genre=genre, language=language,
+                      price=Decimal(price), stock=stock, average_rating=rating)
+
+    def facets(self, url):
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return {facet: {row['value']: row['count'] for row in rows}
+                for facet, rows in response.data['facets'].items()}
+
+    def test_counts(self):
+        self.assertEqual(self.facets('/api/books/?facets=true&page_size=1'), {
+            'genre': {'Fiction': 3, 'History': 1},
+            'language': {'EN': 3, 'AR': 1},
+            'price': {'0-10': 1, '10-25': 1, '25-50': 1, '50+': 1},
+            'rating': {'4+': 2, '3-4': 1, '0-1': 1},
+            'in_stock': {True: 3, False: 1},
+        })
+
+    def test_counts_follow_filters(self):
+        facets = self.facets('/api/books/?facets=true&genre=Fiction&in_stock=true')
+        self.assertEqual(facets['genre'], {'Fiction': 2})
+        self.assertEqual(facets['price'], {'10-25': 1, '50+': 1})
+        self.assertEqual(facets['in_stock'], {True: 2})
+
+    def test_search_counts_matches(self):
+        facets = self.facets('/api/books/search/?q=dragon&facets=true&language=EN')
+        self.assertEqual(facets['genre'], {'Fiction': 2, 'History': 1})
+
+    def test_off_by_default(self):
+        response = self.client.get('/api/books/', secure=True)
+        self.assertNotIn('facets', response.data)
+        # Counts span rows outside the page, so the page validator does not describe them
+        facetted = self.client.get('/api/books/?facets=true', secure=True)
+        self.assertNotEqual(facetted['ETag'], response['ETag'])
+
+    def test_counts_follow_catalog_changes(self):
+        self.facets('/api/books/?facets=true')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_book(5, genre='History')
+        self.assertEqual(self.facets('/api/books/?facets=true')['genre'], {'Fiction': 3, 'History': 2})
+
+class KeysetPaginationTest(TestCase):
+    """Cursor pages cover every row once, in both directions, with ties and NULLs"""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['catalog'].clear()
+        dates = [date(2001, 1, 1), None, date(1999, 5, 1), None, date(2001, 1, 1), date(2010, 2, 3)]
+        self.books = [
+            make_book(number, title=f'Book {number % 3}', price=Decimal(number % 2 + 10),
+                      publication_date=dates[number % len(dates)])
+            for number in range(1, 17)
+        ]
+
+    def walk(self, url, link='next'):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 200)
+            page = [book['id'] for book in response.data['results']]
+            pages.append(page)
+            ids.extend(page)
+            self.assertLess(len(pages), 50, 'pagination does not terminate')
+            url = response.data[link]
+        return ids, pages
+
+    def test_every_ordering_pages_to_completion(self):
+        for ordering in ('', 'publication_date', '-publication_date', 'price,-title', '-average_rating'):
+            with self.subTest(ordering=ordering):
+                ids, _ = self.walk(f'/api/books/?page_size=5&ordering={ordering}')
+                self.assertEqual(sorted(ids), sorted(book.pk for book in self.books))
+                self.assertEqual(len(ids), len(set(ids)))
+
+    def test_order_matches_offset_free_query(self):
+        ids, _ = self.walk('/api/books/?page_size=4&ordering=-publication_date')
+        expected = list(Book.objects.order_by(F('publication_date').desc(nulls_first=True), 'id')
+                        .values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_links_walk_back(self):
+        ids, pages = self.walk('/api/books/?page_size=5&ordering=publication_date')
+        response = self.client.get('/api/books/?page_size=5&ordering=publication_date', secure=True)
+        while response.data['next']:
+            response = self.client.get(response.data['next'], secure=True)
+        _, back = self.walk(response.data['previous'], link='previous')
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/books/?cursor=garbage', secure=True).status_code, 404)
+
+class BookConditionalGetTest(TestCase):
+    """Book detail ETag and Last-Modified validators"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Fantasy')
+        self.book = make_book(1, title='Dragon Tales')
+        self.book.categories.add(self.category)
+        self.url = f'/api/books/{self.book.pk}/'
+
+    def get(self, **headers):
+        return self.client.get(self.url, secure=True, headers=headers)
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(if_none_match=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.get(if_none_match='"stale"').status_code, 200)
+
+    def test_changes_update_the_validator(self):
+        etag = self.get()['ETag']
+        self.book.title = 'Dragon Tales, Revised'
+        self.book.save()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Dragon Tales, Revised')
+
+        # The book embeds its categories, so renaming one modifies the book too
+        etag = response['ETag']
+        self.category.name = 'High Fantasy'
+        self.category.save()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([category['name'] for category in response.data['categories']],
+                         ['High Fantasy'])
+
+        etag = response['ETag']
+        Book.take_stock(self.book.pk)
+        self.assertEqual(self.get(if_none_match=etag).status_code, 200)
+
+class CategoryHierarchyTest(TestCase):
+    """Materialized category paths: subtree filters, moves and cycle rejection"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create_user(username='staff', password='secret', is_staff=True)
+        )
+        caches['catalog'].clear()
+        self.fiction = Category.objects.create(name='Fiction')
+        self.fantasy = Category.objects.create(name='Fantasy', parent=self.fiction)
+        self.dragons = Category.objects.create(name='Dragons', parent=self.fantasy)
+        self.science = Category.objects.create(name='Science')
+        self.books = {}
+        for number, category in enumerate([self.fiction, self.fantasy, self.dragons, self.science], 1):
+            self.books[category.name] = make_book(number)
+            self.books[category.name].categories.add(category)
+
+    def in_category(self, category):
+        response = self.client.get('/api/books/', {'category': category.pk}, secure=True)
+        return {book['id'] for book in response.data['results']}
+
+    def expected(self, *names):
+        return {self.books[name].pk for name in names}
+
+    def test_subtree_filter(self):
+        self.assertEqual(self.in_category(self.fiction), self.expected('Fiction', 'Fantasy', 'Dragons'))
+        self.assertEqual(self.in_category(self.fantasy), self.expected('Fantasy', 'Dragons'))
+        self.assertEqual(self.in_category(self.science), self.expected('Science'))
+
+    def test_moving_a_subtree(self):
+        response = self.client.patch(f'/api/categories/{self.fantasy.pk}/',
+                                     {'parent': self.science.pk}, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.dragons.refresh_from_db()
+        self.assertEqual(self.dragons.path, f'{self.science.pk}/{self.fantasy.pk}/{self.dragons.pk}/')
+        self.assertEqual(self.in_category(self.fiction), self.expected('Fiction'))
+        self.assertEqual(self.in_category(self.science), self.expected('Science', 'Fantasy', 'Dragons'))
+
+    def test_cycles_are_rejected(self):
+        for parent in (self.dragons, self.fiction):
+            response = self.client.patch(f'/api/categories/{self.fiction.pk}/',
+                                         {'parent': parent.pk}, format='json', secure=True)
+            self.assertEqual(response.status_code, 400)
+        self.fantasy.parent = self.dragons
+        with self.assertRaises(ValueError):
+            self.fantasy.save()
+        self.assertEqual(Category.objects.get(pk=self.fantasy.pk).parent_id, self.fiction.pk)
+
+    def test_tree_counts(self):
+        (fiction, science) = self.client.get('/api/categories/tree/', secure=True).data
+        self.assertEqual((fiction['name'], fiction['book_count'], fiction['total_book_count']),
+                         ('Fiction', 1, 3))
+        fantasy = fiction['children'][0]
+        self.assertEqual((fantasy['total_book_count'], fantasy['children'][0]['name']), (2, 'Dragons'))
+        self.assertEqual(science['total_book_count'], 1)
+
+    def test_deleting_a_category_reroots_its_children(self):
+        self.fantasy.delete()
+        self.dragons.refresh_from_db()
+        self.assertEqual((self.dragons.parent_id, self.dragons.path), (None, f'{self.dragons.pk}/'))
+        self.assertEqual(self.in_category(self.fiction), self.expected('Fiction'))
+
+class PrefixIndexTest(SimpleTestCase):
+    """Autocomplete index updates in place and rebuilds once"""
+
+    ROWS = [
+        (1, 'Dragon Tales', 'Ann Smith', 4.5, 10),
+        (2, 'Dragonfly Summer', 'Bo Jones', 3.0, 5),
+        (3, 'Garden Notes', 'Cy Dragoman', 4.0, 7),
+    ]
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.build(self.ROWS)
+
+    def ids(self, query):
+        return [book['id'] for book in self.index.complete(query)]
+
+    def test_prefix_ranked_by_rating(self):
+        self.assertEqual(self.ids('drag'), [1, 3, 2])
+        self.assertEqual(self.ids('dragon t'), [1])
+
+    def test_update_and_remove(self):
+        self.assertEqual(self.ids('drag'), [1, 3, 2])
+        self.index.update(Book(pk=2, title='Summer Light', author='Bo Jones',
+                               average_rating=3.0, total_ratings=5))
+        self.index.update(Book(pk=4, title='Dragon Eggs', author='Di Lee',
+                               average_rating=5.0, total_ratings=1))
+        self.index.remove(1)
+        self.assertEqual(self.ids('drag'), [4, 3])
+        self.assertEqual(self.ids('summer'), [2])
+        self.assertEqual(self.ids('dragon e'), [4])
+
+        # Folding the delta in changes nothing visible
+        self.index._compact()
+        self.assertFalse(self.index._delta or self.index._masked)
+        self.assertEqual(self.ids('drag'), [4, 3])
+        self.assertEqual(self.ids('summer'), [2])
+
+    def test_compacts_at_delta_limit(self):
+        self.index.DELTA_LIMIT = 2
+        self.index.update(Book(pk=5, title='Dragon Five', author='E', average_rating=1.0,
+                               total_ratings=1))
+        self.assertEqual(len(self.index._delta), 1)
+        self.index.update(Book(pk=6, title='Dragon Six', author='F', average_rating=2.0,
+                               total_ratings=1))
+        self.assertFalse(self.index._delta)
+        self.assertEqual(self.ids('dragon'), [1, 2, 6, 5])
+
+    def test_concurrent_first_use_builds_once(self):
+        index = PrefixIndex()
+        builds = []
+        def build(rows=None):
+            builds.append(1)
+            time.sleep(0.05)
+            PrefixIndex.build(index, self.ROWS)
+        index.build = build
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda _: index.ensure_fresh(), range(8)))
+        self.assertEqual(len(builds), 1)
+
+    def test_stale_index_rebuilds_in_background(self):
+        self.index.max_age = 0
+        release, rebuilt = threading.Event(), threading.Event()
+        def build(rows=None):
+            release.wait(5)
+            PrefixIndex.build(self.index, self.ROWS[:1])
+            rebuilt.set()
+        self.index.build = build
+
+        # The request returns straight away, still answering from the old index
+        self.index.ensure_fresh()
+        self.index.ensure_fresh()
+        self.assertEqual(self.ids('drag'), [1, 3, 2])
+        release.set()
+        self.assertTrue(rebuilt.wait(5))
+        self.assertEqual(self.ids('drag'), [1])
+
+class BookAutocompleteTest(TestCase):
+    """Autocomplete endpoint parameters"""
+
+    def setUp(self):
+        self.client = APIClient()
+        make_book(1, title='Dragon Tales')
+        make_book(2, title='Dragon Rider')
+        autocomplete_index.build()
+
+    def complete(self, **params):
+        return self.client.get('/api/books/autocomplete/', {'q': 'drag', **params}, secure=True)
+
+    def test_limit(self):
+        self.assertEqual(len(self.complete().data), 2)
+        self.assertEqual(len(self.complete(limit=-5).data), 1)
+        self.assertEqual(self.complete(limit='many').status_code, 400)
+
+class InvertedIndexTest(TestCase):
+    """BM25 index publishing and filtered search"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'index')
+        self.dragons = [make_book(number, title=f'Dragon {number}', genre=genre)
+                        for number, genre in enumerate(['Fiction', 'Poetry'] * 3, 1)]
+
+    def test_save_publishes_new_version_atomically(self):
+        index = BM25Index()
+        index.build()
+        first = index.save(self.path)
+        self.assertEqual(os.path.realpath(self.path), first)
+
+        reader = BM25Index()
+        self.assertEqual(reader.load(self.path), first)
+        before = reader.search('dragon')
+
+        index.update(make_book(7, title='Dragon 7'))
+        second = index.save(self.path)
+        third = index.save(self.path)
+        self.assertEqual(os.path.realpath(self.path), third)
+        # The previous version stays for readers still mapping it; older ones go
+        self.assertTrue(os.path.isdir(second))
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(reader.search('dragon'), before)
+
+        reader.load(self.path)
+        self.assertEqual(len(reader.search('dragon')), 7)
+
+    def test_backend_reloads_published_index(self):
+        index = BM25Index()
+        index.build()
+        index.save(self.path)
+        backend = InvertedIndexSearchBackend(index_path=self.path)
+        self.assertEqual(backend.search(Book.objects.all(), 'dragon').count(), 6)
+
+        index.update(make_book(7, title='Dragon 7'))
+        index.save(self.path)
+        self.assertEqual(backend.search(Book.objects.all(), 'dragon').count(), 7)
+
+    def test_filters_apply_before_the_limit(self):
+        backend = InvertedIndexSearchBackend(index_path='')
+        backend.MAX_RESULTS = 2
+        poetry = backend.search(Book.objects.filter(genre='Poetry'), 'dragon')
+        self.assertEqual(set(poetry.values_list('genre', flat=True)), {'Poetry'})
+        self.assertEqual(poetry.count(), 2)
+        self.assertEqual(backend.search(Book.objects.all(), 'dragon').count(), 2)
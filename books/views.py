@@ -1,11 +1,36 @@
 from rest_framework import viewsets, filters, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import Q
+from django.db import connection
+from django.db.models import Count, Q
 from .models import Book, Category
-from .serializers import BookSerializer, CategorySerializer
+from .serializers import BookSerializer, BookBulkSerializer, CategorySerializer
+from .bulk import BulkBookWriter
+from .search import get_search_backend
+from .autocomplete import autocomplete_index
+from .cache import CATALOG, catalog_cached
+from .facets import facet_counts
+from iqraa.conditional import ConditionalGetMixin
+from iqraa.export import ExportMixin
+from iqraa.pagination import PaginatedActionMixin
+from iqraa.serializers import only_serialized_fields
 
-class CategoryViewSet(viewsets.ModelViewSet):
+MIN_EXACT_RESULTS = 5
+MAX_FUZZY_RESULTS = 50
+SIMILAR_COUNT = 5
+# Actions that return lists of books and default to the compact projection
+LIST_ACTIONS = {'list', 'featured', 'search', 'similar', 'latest', 'top_rated'}
+
+def limit_param(request, default, maximum):
+    """The ?limit= query parameter clamped to [1, maximum]; 400 if it is not an integer"""
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        raise ValidationError({"limit": "A whole number is required."})
+    return max(1, min(limit, maximum))
+
+class CategoryViewSet(ConditionalGetMixin, PaginatedActionMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAdminUser]
@@ -14,24 +39,66 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def books(self, request, pk=None):
         """Get all books in this category"""
         category = self.get_object()
-        books = category.books.all()
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data)
+        serializer = BookSerializer(compact=True, context=self.get_serializer_context())
+        books = only_serialized_fields(
+            category.books.prefetch_related('categories'), serializer
+        ).order_by('title', 'id')
+        return self.paginated_response(books, BookSerializer, compact=True)
 
-class BookViewSet(viewsets.ModelViewSet):
+    @action(detail=False, permission_classes=[permissions.AllowAny])
+    @catalog_cached(scopes=[CATALOG])
+    def tree(self, request):
+        """The whole category hierarchy with direct and subtree book counts"""
+        categories = list(
+            Category.objects.annotate(book_count=Count('books')).order_by('name')
+        )
+        through = Book.categories.through._meta.db_table
+        with connection.cursor() as cursor:
+            # Distinct books anywhere under each category (a book can sit in several)
+            cursor.execute(f"""
+                SELECT ancestor.id, COUNT(DISTINCT link.book_id)
+                FROM categories ancestor
+                JOIN categories descendant ON descendant.path LIKE ancestor.path || '%%'
+                JOIN {through} link ON link.category_id = descendant.id
+                GROUP BY ancestor.id
+            """, [])
+            subtree_counts = dict(cursor.fetchall())
+
+        nodes = {
+            category.id: {
+                "id": category.id,
+                "name": category.name,
+                "description": category.description,
+                "book_count": category.book_count,
+                "total_book_count": subtree_counts.get(category.id, 0),
+                "children": [],
+            }
+            for category in categories
+        }
+        roots = []
+        for category in categories:
+            parent = nodes.get(category.parent_id)
+            (parent["children"] if parent else roots).append(nodes[category.id])
+        return Response(roots)
+
+class BookViewSet(ConditionalGetMixin, PaginatedActionMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'author', 'isbn', 'publisher', 'keywords']
     ordering_fields = ['title', 'author', 'price', 'publication_date', 'average_rating']
+    ordering = ['title', 'id']
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    export_fields = ['id', 'isbn', 'title', 'author', 'genre', 'price', 'stock',
+                     'publication_date', 'language', 'publisher', 'page_count', 'edition',
+                     'is_featured', 'average_rating', 'total_ratings', 'updated_at']
 
     def get_queryset(self):
         """
         Optionally restricts the returned books by filtering against
         query parameters in the URL.
         """
-        queryset = Book.objects.all()
+        queryset = self.list_queryset(Book.objects.all())
         
         # Basic filters
         genre = self.request.query_params.get('genre', None)
@@ -57,7 +124,13 @@ class BookViewSet(viewsets.ModelViewSet):
         if genre:
             queryset = queryset.filter(genre=genre)
         if category:
-            queryset = queryset.filter(categories__id=category)
+            # The category and all of its descendants, as one semi-join on the path index
+            path = Category.objects.filter(pk=category).values_list('path', flat=True).first()
+            if path is None:
+                return queryset.none()
+            queryset = queryset.filter(id__in=Book.categories.through.objects.filter(
+                category__path__startswith=path
+            ).values('book_id'))
         if language:
             queryset = queryset.filter(language=language.upper())
         if price_min:
@@ -77,18 +150,73 @@ class BookViewSet(viewsets.ModelViewSet):
             
         return queryset
 
+    @catalog_cached
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        return self.with_facets(response, self.filter_queryset(self.get_queryset()))
+
+    def wants_facets(self):
+        return self.request.query_params.get('facets', '').lower() in ('1', 'true', 'yes')
+
+    def use_validators(self, request):
+        # Facet counts cover the whole filtered set, not just the page rows
+        return not self.wants_facets()
+
+    def with_facets(self, response, queryset):
+        """Add ?facets=true counts for the filtered set to a paginated response"""
+        if self.wants_facets() and response.status_code == 200 and isinstance(response.data, dict):
+            response.data['facets'] = facet_counts(self.request, queryset)
+        return response
+
+    def filter_queryset_unordered(self, queryset):
+        """filter_queryset without the ordering backend, for querysets ranked afterwards"""
+        for backend in self.filter_backends:
+            if not issubclass(backend, filters.OrderingFilter):
+                queryset = backend().filter_queryset(self.request, queryset, self)
+        return queryset
+
+    def order_ranked(self, queryset):
+        """Keep a ranked queryset in relevance order unless ?ordering= asks otherwise"""
+        for backend in self.filter_backends:
+            if not issubclass(backend, filters.OrderingFilter):
+                continue
+            ordering_filter = backend()
+            params = self.request.query_params.get(ordering_filter.ordering_param, '')
+            fields = [param.strip() for param in params.split(',') if param.strip()]
+            if ordering_filter.remove_invalid_fields(queryset, fields, self, self.request):
+                queryset = ordering_filter.filter_queryset(self.request, queryset, self)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in LIST_ACTIONS:
+            kwargs.setdefault('compact', True)
+        return super().get_serializer(*args, **kwargs)
+
+    def list_queryset(self, queryset):
+        """Load only the columns list serializers render, with categories prefetched"""
+        if self.action not in LIST_ACTIONS:
+            return queryset
+        serializer = self.get_serializer()
+        queryset = only_serialized_fields(queryset, serializer)
+        if 'categories' in serializer.fields:
+            queryset = queryset.prefetch_related('categories')
+        return queryset
+
     @action(detail=False)
+    @catalog_cached(scopes=[CATALOG])
     def genres(self, request):
         """List all unique genres"""
         genres = Book.objects.values_list('genre', flat=True).distinct()
         return Response(sorted(genres))
 
     @action(detail=False)
+    @catalog_cached
     def featured(self, request):
         """Get featured books"""
-        featured_books = Book.objects.filter(is_featured=True)
-        serializer = self.get_serializer(featured_books, many=True)
-        return Response(serializer.data)
+        featured_books = self.list_queryset(
+            Book.objects.filter(is_featured=True)
+        ).order_by('title', 'id')
+        return self.paginated_response(featured_books)
 
     @action(detail=False)
     def search(self, request):
@@ -98,60 +226,89 @@ class BookViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Search query is required"}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
-        # Split the query into keywords
-        keywords = query.split()
-        
-        # Build complex Q objects for searching multiple fields
-        q_objects = Q()
-        for keyword in keywords:
-            q_objects |= (
-                Q(title__icontains=keyword) |
-                Q(author__icontains=keyword) |
-                Q(summary__icontains=keyword) |
-                Q(keywords__contains=[keyword.lower()]) |
-                Q(publisher__icontains=keyword)
-            )
-            
-        books = Book.objects.filter(q_objects).distinct()
-        
-        # Apply additional filters from get_queryset
-        books = self.filter_queryset(books)
-        
-        # Get page from the default pagination class
-        page = self.paginate_queryset(books)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-            
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        # Ranked search over the filtered catalog, so a backend with its own
+        # index can restrict its matches to the filtered books before capping
+        backend = get_search_backend()
+        queryset = self.filter_queryset_unordered(self.get_queryset())
+        books = backend.search(queryset, query)
+
+        # Too few exact hits, probably a misspelling: fall back to fuzzy matching
+        if backend.supports_fuzzy and books.count() < MIN_EXACT_RESULTS:
+            books = backend.fuzzy_search(queryset, query)
+            books = books.filter(id__in=books.values('id')[:MAX_FUZZY_RESULTS])
+
+        books = self.order_ranked(books)
+        return self.with_facets(self.paginated_response(books), books)
+
+    @action(detail=False)
+    def suggest(self, request):
+        """Suggest titles and authors similar to a possibly misspelled query"""
+        query = request.query_params.get('q', '')
+        if not query:
+            return Response({"detail": "Search query is required"}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+
+        limit = limit_param(request, default=5, maximum=20)
+        return Response({
+            "query": query,
+            "suggestions": get_search_backend().suggest(query, limit)
+        })
+
+    @action(detail=False)
+    def autocomplete(self, request):
+        """Search-as-you-type over titles and authors, served from memory"""
+        query = request.query_params.get('q', '')
+        if not query:
+            return Response({"detail": "Search query is required"}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+
+        limit = limit_param(request, default=10, maximum=50)
+        autocomplete_index.ensure_fresh()
+        return Response(autocomplete_index.complete(query, limit))
 
     @action(detail=True)
     def similar(self, request, pk=None):
-        """Get similar books based on genre and categories"""
-        book = self.get_object()
-        similar_books = Book.objects.filter(
-            Q(genre=book.genre) |
-            Q(categories__in=book.categories.all())
-        ).exclude(id=book.id).distinct()[:5]
+        """Get similar books, precomputed by recommender training"""
+        similar_books = []
+        if pk.isdigit():
+            similar_books = list(
+                self.list_queryset(Book.objects.filter(neighbor_of__book_id=pk))
+                .order_by('neighbor_of__rank')[:SIMILAR_COUNT]
+            )
+        if not similar_books:
+            # Books added since the last training run: same genre or categories
+            book = self.get_object()
+            similar_books = self.list_queryset(Book.objects.all()).filter(
+                Q(genre=book.genre) |
+                Q(categories__in=book.categories.all())
+            ).exclude(id=book.id).distinct()[:SIMILAR_COUNT]
         
         serializer = self.get_serializer(similar_books, many=True)
         return Response(serializer.data)
 
     @action(detail=False)
+    @catalog_cached
     def latest(self, request):
         """Get latest books"""
-        latest_books = Book.objects.order_by('-publication_date')[:10]
+        latest_books = self.list_queryset(Book.objects.all()).order_by('-publication_date')[:10]
         serializer = self.get_serializer(latest_books, many=True)
         return Response(serializer.data)
 
     @action(detail=False)
+    @catalog_cached
     def top_rated(self, request):
         """Get top-rated books"""
         min_ratings = int(request.query_params.get('min_ratings', 3))
-        top_books = Book.objects.filter(
+        top_books = self.list_queryset(Book.objects.all()).filter(
             total_ratings__gte=min_ratings
         ).order_by('-average_rating')[:10]
         
         serializer = self.get_serializer(top_books, many=True)
         return Response(serializer.data)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def bulk(self, request):
+        """Create, update and restock many books in one transaction, with per-item results"""
+        serializer = BookBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(BulkBookWriter(**serializer.validated_data).run())
@@ -0,0 +1,183 @@
+import json
+from base64 import b64decode, b64encode
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination that seeks on every ordering column, not an offset
+
+    The ordering comes from the queryset's explicit order_by() (set by the
+    view or by OrderingFilter), falling back to the view's ``ordering`` and
+    then the model's Meta.ordering, and always ends with ``id`` so it is
+    total. The cursor stores the ordering values of the last (or first) row
+    of the page, and the next page is fetched with a row-wise comparison
+    against them, so page 1000 costs the same index range scan as page 1.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        self.base_url = request.build_absolute_uri()
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['reverse'])
+        ordering = [self.flip(field) for field in self.ordering] if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(self.seek(queryset.model, ordering, cursor['values']))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        self.has_next = has_more if not reverse else bool(cursor)
+        self.has_previous = bool(cursor) if not reverse else has_more
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, queryset, view):
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        if not ordering:
+            ordering = list(getattr(view, 'ordering', None) or queryset.model._meta.ordering or [])
+        ordering = [field.replace('pk', 'id') if field.lstrip('-') == 'pk' else field
+                    for field in ordering if field != '?']
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering.append('id')
+        return ordering
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def is_nullable(model, path):
+        """Whether an ordering path (possibly spanning relations) can hold NULL"""
+        try:
+            for name in path.split('__'):
+                field = model._meta.get_field(name)
+                if field.null:
+                    return True
+                model = field.related_model
+        except FieldDoesNotExist:
+            # Annotations such as search ranks
+            return False
+        return False
+
+    def seek(self, model, ordering, values):
+        """Rows strictly after values in ordering
+
+        PostgreSQL sorts NULLs last ascending and first descending, so a NULL
+        compares greater than any value in either reading direction.
+        """
+        condition = Q(pk__in=[])
+        for field, value in reversed(list(zip(ordering, values))):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            nullable = self.is_nullable(model, name)
+
+            if value is None:
+                after = Q(**{f'{name}__isnull': False}) if descending else Q(pk__in=[])
+                equal = Q(**{f'{name}__isnull': True})
+            else:
+                after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+                if nullable and not descending:
+                    after |= Q(**{f'{name}__isnull': True})
+                equal = Q(**{name: value})
+            condition = after | (equal & condition)
+        return condition
+
+    def item_values(self, item):
+        values = []
+        for field in self.ordering:
+            value = item
+            for name in field.lstrip('-').split('__'):
+                value = getattr(value, name) if value is not None else None
+            values.append(getattr(value, 'pk', value))
+        return values
+
+    def encode_cursor(self, item, reverse):
+        payload = json.dumps(
+            {'v': self.item_values(item), 'r': reverse}, cls=DjangoJSONEncoder
+        )
+        cursor = b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(b64decode(encoded.encode()).decode())
+            values, reverse = payload['v'], bool(payload['r'])
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+class PaginatedActionMixin:
+    """Run querysets built by custom @action views through the default paginator"""
+
+    def paginated_response(self, queryset, serializer_class=None, **kwargs):
+        if serializer_class is None:
+            serialize = self.get_serializer
+        else:
+            serialize = serializer_class
+            kwargs['context'] = self.get_serializer_context()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = serialize(page, many=True, **kwargs)
+            return self.get_paginated_response(serializer.data)
+        serializer = serialize(queryset, many=True, **kwargs)
+        return Response(serializer.data)
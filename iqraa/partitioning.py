@@ -0,0 +1,212 @@
+import re
+from datetime import date, timezone as dt_timezone
+from django.db import connection, transaction
+from django.utils import timezone
+
+# Tables range-partitioned by month on a timestamp column. Partitions are named
+# {table}_pYYYYMM and cover UTC calendar months; {table}_default catches rows
+# outside every partition until manage_partitions gives their month its own.
+# keep_if marks rows that hold a partition back from being detached. Review
+# partitions are never detached: book review summaries and rating counters
+# count every review, and rebuilding them would drop the detached ratings.
+PARTITIONED_TABLES = {
+    'orders': {'column': 'date_ordered', 'keep_if': "status IN ('PENDING', 'BORROWED')",
+               'detachable': True},
+    'reviews': {'column': 'date_reviewed', 'keep_if': None, 'detachable': False},
+}
+MONTHS_AHEAD = 3
+PARTITION_NAME = re.compile(r'^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$')
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+def current_month():
+    return month_start(timezone.now().astimezone(dt_timezone.utc))
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+def _bounds(month):
+    return f"FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{add_months(month, 1):%Y-%m-%d} 00:00:00+00')"
+
+def _months_between(first, last):
+    month = first
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+def partitions(cursor, table):
+    """Month -> name of the table's monthly partitions, oldest first"""
+    cursor.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+    """, [table])
+    months = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match and match['table'] == table:
+            months[date(int(match['year']), int(match['month']), 1)] = name
+    return dict(sorted(months.items()))
+
+def _months_with_rows(cursor, relation, column):
+    cursor.execute(f"""
+        SELECT DISTINCT date_trunc('month', {column} AT TIME ZONE 'UTC')::date
+        FROM {relation} ORDER BY 1
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+def _rebuild(cursor, table, partition_by=None):
+    """Recreate table in place, partitioned by partition_by or as a plain table
+
+    Columns, defaults, the id identity and its sequence position, foreign
+    keys and indexes (under their names) are saved for _finish_rebuild,
+    which copies the rows over from the previous table, renamed aside, once
+    the caller has added any partitions.
+    """
+    cursor.execute("""
+        SELECT indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s
+    """, [table, f'{table}_pkey'])
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f' AND conparentid = 0
+    """, [table])
+    foreign_keys = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+
+    old = f'{table}_old'
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    cursor.execute(f"""
+        CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY
+                              INCLUDING CONSTRAINTS INCLUDING STORAGE)
+        {f'PARTITION BY RANGE ({partition_by})' if partition_by else ''}
+    """)
+    return old, (indexes, foreign_keys, sequence)
+
+def _finish_rebuild(cursor, table, old, saved, key):
+    indexes, foreign_keys, sequence = saved
+    cursor.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {old}')
+    last_id = cursor.fetchone()[0]
+    cursor.execute(f'DROP TABLE {old}')
+
+    # The identity got a new sequence; give it the old one's name and position
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    cursor.execute(f'ALTER SEQUENCE {cursor.fetchone()[0]} RENAME TO {sequence.split(".")[-1]}')
+    cursor.execute('SELECT setval(%s, %s, %s)', [sequence, max(last_id, 1), last_id > 0])
+
+    cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({key})')
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+    for definition in indexes:
+        cursor.execute(definition)
+
+def partition_table(table, months_ahead=MONTHS_AHEAD, using=connection):
+    """Convert table into one range-partitioned by month on its configured column
+
+    The table is rebuilt under the same name with a partition for every
+    month its rows fall in, through months_ahead past the current month,
+    plus the default partition. The primary key becomes (id, column), as
+    PostgreSQL requires the partition key in unique constraints, so foreign
+    keys pointing at the table must be dropped first.
+    """
+    column = PARTITIONED_TABLES[table]['column']
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return
+        months = _months_with_rows(cursor, table, column)
+        old, saved = _rebuild(cursor, table, partition_by=column)
+        current = current_month()
+        for month in _months_between(min([current, *months]), add_months(current, months_ahead)):
+            cursor.execute(f'CREATE TABLE {partition_name(table, month)} PARTITION OF {table} '
+                           f'FOR VALUES {_bounds(month)}')
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+        _finish_rebuild(cursor, table, old, saved, key=f'id, {column}')
+
+def unpartition_table(table, using=connection):
+    """Reverse partition_table, folding every attached partition back into a plain table"""
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        if not is_partitioned(cursor, table):
+            return
+        old, saved = _rebuild(cursor, table)
+        _finish_rebuild(cursor, table, old, saved, key='id')
+
+def ensure_partitions(table, months_ahead=MONTHS_AHEAD, using=connection):
+    """Create the partitions missing up to months_ahead past the current month
+
+    Months with rows parked in the default partition (e.g. imported history)
+    also get their own partition, and the rows are moved into it. Returns
+    the names of the partitions created.
+    """
+    column = PARTITIONED_TABLES[table]['column']
+    default = f'{table}_default'
+    created = []
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        existing = partitions(cursor, table)
+        current = current_month()
+        parked = _months_with_rows(cursor, default, column)
+        wanted = set(_months_between(current, add_months(current, months_ahead))) | set(parked)
+        for month in sorted(wanted - set(existing)):
+            name = partition_name(table, month)
+            if month in parked:
+                # Attaching checks the default partition holds no rows for the month,
+                # so they move into the new table before it is attached
+                cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                cursor.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {default}
+                        WHERE {column} >= %s AND {column} < %s
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                """, [f'{month} 00:00:00+00', f'{add_months(month, 1)} 00:00:00+00'])
+                cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {_bounds(month)}')
+            else:
+                cursor.execute(f'CREATE TABLE {name} PARTITION OF {table} FOR VALUES {_bounds(month)}')
+            created.append(name)
+    return created
+
+def detach_partitions(table, retain_months, archive_schema=None, drop=False, using=connection):
+    """Detach the partitions ending more than retain_months before the current month
+
+    Detached partitions stay behind as plain tables, are moved into
+    archive_schema if given, or dropped. Partitions still holding rows that
+    match the table's keep_if condition are left attached. Returns
+    (detached, kept) lists of partition names. Raises ValueError for tables
+    whose partitions cannot be detached.
+    """
+    if not PARTITIONED_TABLES[table]['detachable']:
+        raise ValueError(f'{table} partitions cannot be detached')
+    keep_if = PARTITIONED_TABLES[table]['keep_if']
+    cutoff = add_months(current_month(), -retain_months)
+    detached, kept = [], []
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        if archive_schema:
+            cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {archive_schema}')
+        for month, name in partitions(cursor, table).items():
+            if month >= cutoff:
+                break
+            if keep_if:
+                cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {name} WHERE {keep_if})')
+                if cursor.fetchone()[0]:
+                    kept.append(name)
+                    continue
+            cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            if drop:
+                cursor.execute(f'DROP TABLE {name}')
+            elif archive_schema:
+                cursor.execute(f'ALTER TABLE {name} SET SCHEMA {archive_schema}')
+            detached.append(name)
+    return detached, kept
@@ -0,0 +1,58 @@
+from django.core.exceptions import FieldDoesNotExist
+
+def split_param(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+class DynamicFieldsMixin:
+    """Sparse fieldsets for ModelSerializers
+
+    ``?fields=id,title`` keeps only the listed fields. A serializer created
+    with ``compact=True`` renders only ``Meta.compact_fields``, and
+    ``?expand=`` adds fields back (``?expand=*`` renders everything) or swaps
+    a compact nested serializer for the full one listed in
+    ``Meta.expandable_fields``. Only the top-level serializer reads the query
+    string; nested serializers keep their declared representation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        self.compact = kwargs.pop('compact', False)
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+        if request is not None:
+            if fields is None:
+                fields = split_param(request.query_params.get('fields'))
+            if expand is None:
+                expand = split_param(request.query_params.get('expand'))
+        self.requested_fields = set(fields or ())
+        self.expanded_fields = set(expand or ())
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand_all = '*' in self.expanded_fields
+
+        for name, (serializer_class, options) in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in fields and (expand_all or name in self.expanded_fields):
+                fields[name] = serializer_class(**options)
+
+        if self.requested_fields:
+            keep = self.requested_fields
+        elif self.compact and not expand_all:
+            keep = set(getattr(self.Meta, 'compact_fields', fields)) | self.expanded_fields
+        else:
+            return fields
+        return {name: field for name, field in fields.items() if name in keep}
+
+def only_serialized_fields(queryset, serializer):
+    """Defer the model columns a serializer will not render"""
+    columns = {'id'}
+    for field in serializer.fields.values():
+        try:
+            model_field = queryset.model._meta.get_field(field.source.split('.')[0])
+        except FieldDoesNotExist:
+            continue
+        if model_field.concrete and not model_field.many_to_many:
+            columns.add(model_field.name)
+    return queryset.only(*columns)
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'django_filters',
@@ -97,8 +98,39 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'iqraa.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
 }
 
+# Book search backend: books.search.PostgresSearchBackend (full-text + trigram) or
+# books.search.InvertedIndexSearchBackend (in-process BM25, any database)
+BOOK_SEARCH_BACKEND = os.getenv('BOOK_SEARCH_BACKEND', 'books.search.PostgresSearchBackend')
+BOOK_SEARCH_INDEX_PATH = os.getenv('BOOK_SEARCH_INDEX_PATH', '')
+
+# Caches. The catalog response cache keeps a per-process local tier and, when
+# CATALOG_CACHE_URL points at Redis, a shared tier that also holds the catalog
+# versions so every process sees invalidations immediately; without it the
+# versions are read from database sequences on each cached request.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+CATALOG_CACHE_URL = os.getenv('CATALOG_CACHE_URL', '')
+if CATALOG_CACHE_URL:
+    CACHES['catalog_shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CATALOG_CACHE_URL,
+    }
+# Seconds a cached catalog response lives in each tier
+CATALOG_CACHE_LOCAL_TIMEOUT = int(os.getenv('CATALOG_CACHE_LOCAL_TIMEOUT', 30))
+CATALOG_CACHE_SHARED_TIMEOUT = int(os.getenv('CATALOG_CACHE_SHARED_TIMEOUT', 600))
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
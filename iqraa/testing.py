@@ -0,0 +1,111 @@
+import json
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+def plan_nodes(plan):
+    """A plan node and all of its descendants"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+def seed_users_and_books(users, books):
+    """Bulk insert users and books with generate_series; returns their id lists"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO users (password, is_superuser, username, first_name, last_name, email,
+                               is_staff, is_active, date_joined, profile_picture, bio,
+                               phone_number, favorite_genres, notification_preferences,
+                               last_active, is_verified)
+            SELECT '!', false, 'reader' || g, '', '', '', false, true, now(), '', '', '',
+                   '[]', '{}', now(), false
+            FROM generate_series(1, %s) g
+            RETURNING id
+        """, [users])
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            INSERT INTO books (title, author, genre, isbn, price, stock, summary, cover_image,
+                               language, publisher, edition, is_featured, keywords,
+                               average_rating, total_ratings, rating_sum, catalog_ratings,
+                               catalog_rating_sum, import_hash, updated_at)
+            SELECT 'Book ' || g, 'Author ' || (g %% 50), 'Genre ' || (g %% 12), 'seed-' || g, 10, 5,
+                   '', '', 'EN', '', '', false, '[]', 0, 0, 0, 0, 0, '', now()
+            FROM generate_series(1, %s) g
+            RETURNING id
+        """, [books])
+        book_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('ANALYZE users, books')
+    return user_ids, book_ids
+
+class QueryPlanAssertions:
+    """EXPLAIN-based checks that hot queries stay on their indexes
+
+    Tables must be seeded with enough rows and ANALYZEd for the planner to
+    prefer indexes, as it would in production.
+    """
+
+    def plan_of(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def explained(self, query):
+        """(SQL, plan) of query, given as SQL text or a QuerySet"""
+        if isinstance(query, str):
+            return query, self.plan_of(query)
+        return str(query.query), json.loads(query.explain(format='json'))[0]['Plan']
+
+    def roots(self, names):
+        """Map relation and index names to their partitioned parent's, or themselves"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT relation.relname, root.relname FROM pg_class relation
+                JOIN pg_class root ON root.oid = pg_partition_root(relation.oid)
+                WHERE relation.relname = ANY(%s)
+            """, [list(names)])
+            found = dict(cursor.fetchall())
+        return {name: found.get(name, name) for name in names}
+
+    def captured(self, request, table):
+        """Run request() and return the SQL of every captured query reading table"""
+        with CaptureQueriesContext(connection) as queries:
+            request()
+        statements = [query['sql'] for query in queries.captured_queries
+                      if f'FROM "{table}"' in query['sql']]
+        self.assertTrue(statements, f'No query read {table}')
+        return statements
+
+    def assertIndexPlan(self, query, table, index=None):
+        """No sequential scan of table and no sort, reading through index if given
+
+        query is SQL text or a QuerySet.
+        """
+        sql, plan = self.explained(query)
+        nodes = list(plan_nodes(plan))
+        shown = json.dumps(plan, indent=1)
+
+        # Scans of a partitioned table are of its partitions, through their own indexes
+        roots = self.roots({node[key] for node in nodes for key in ('Relation Name', 'Index Name')
+                            if key in node})
+        scans = [node for node in nodes if roots.get(node.get('Relation Name')) == table]
+        self.assertFalse(
+            [node for node in scans if node['Node Type'] == 'Seq Scan'],
+            f'Sequential scan of {table}:\n{sql}\n{shown}',
+        )
+        self.assertFalse(
+            [node for node in nodes if node['Node Type'] in ('Sort', 'Incremental Sort')],
+            f'Sort in the plan:\n{sql}\n{shown}',
+        )
+        if index:
+            self.assertIn(index, {roots.get(node.get('Index Name')) for node in scans},
+                          f'{index} not used:\n{sql}\n{shown}')
+
+    def assertPrunedTo(self, query, table, partitions):
+        """The plan reads table only from the named partitions"""
+        sql, plan = self.explained(query)
+        scanned = {node['Relation Name'] for node in plan_nodes(plan) if 'Relation Name' in node}
+        roots = self.roots(scanned)
+        self.assertEqual({name for name in scanned if roots[name] == table}, set(partitions),
+                         f'Partitions of {table} read:\n{sql}\n{json.dumps(plan, indent=1)}')
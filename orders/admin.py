@@ -1,10 +1,10 @@
 from django.contrib import admin
-from .models import Order
+from .models import Order, Notification, DailyBookOrderStats, DailyGenreOrderStats
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'book', 'status', 'date_ordered', 'is_borrowed', 'is_purchased', 'return_due_date')
-    list_filter = ('status', 'is_borrowed', 'is_purchased', 'date_ordered')
+    list_display = ('id', 'user', 'book', 'status', 'date_ordered', 'is_borrowed', 'is_purchased', 'return_due_date', 'is_overdue')
+    list_filter = ('status', 'is_borrowed', 'is_purchased', 'is_overdue', 'date_ordered')
     search_fields = ('user__username', 'user__email', 'book__title', 'book__isbn')
     readonly_fields = ('date_ordered',)
     raw_id_fields = ('user', 'book')
@@ -19,6 +19,26 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('is_purchased', 'purchase_date')
         }),
         ('Borrowing Details', {
-            'fields': ('is_borrowed', 'borrow_date', 'return_due_date', 'return_date')
+            'fields': ('is_borrowed', 'borrow_date', 'return_due_date', 'return_date', 'is_overdue')
         })
     )
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'order', 'created_at', 'sent_at')
+    list_filter = ('kind', 'sent_at')
+    raw_id_fields = ('user', 'order')
+    readonly_fields = ('created_at',)
+
+@admin.register(DailyBookOrderStats)
+class DailyBookOrderStatsAdmin(admin.ModelAdmin):
+    list_display = ('day', 'book', 'borrows', 'purchases', 'returns')
+    date_hierarchy = 'day'
+    raw_id_fields = ('book',)
+
+@admin.register(DailyGenreOrderStats)
+class DailyGenreOrderStatsAdmin(admin.ModelAdmin):
+    list_display = ('day', 'genre', 'borrows', 'purchases', 'returns')
+    list_filter = ('genre',)
+    date_hierarchy = 'day'
@@ -0,0 +1,10 @@
+from orders.models import Order
+from orders.views import OrderViewSet
+from iqraa.export import ExportCommand
+
+class Command(ExportCommand):
+    help = 'Stream all orders as CSV or JSON lines'
+    fields = OrderViewSet.export_fields
+
+    def get_queryset(self):
+        return Order.objects.all()
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from iqraa.partitioning import PARTITIONED_TABLES, MONTHS_AHEAD, ensure_partitions, detach_partitions
+
+class Command(BaseCommand):
+    help = ('Create upcoming monthly partitions of the orders and reviews tables, '
+            'and detach, archive or drop old ones')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', choices=sorted(PARTITIONED_TABLES), action='append',
+                            help='Table to manage (repeatable, default: all)')
+        parser.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD,
+                            help='Months past the current one to create partitions for')
+        parser.add_argument('--retain-months', type=int,
+                            help='Detach partitions ending more than this many months before '
+                                 'the current one (default: detach nothing). Review '
+                                 'partitions are always kept')
+        parser.add_argument('--archive-schema',
+                            help='Move detached partitions into this schema')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop detached partitions instead of keeping them')
+
+    def handle(self, *args, **options):
+        if options['months_ahead'] < 0 or (options['retain_months'] or 0) < 0:
+            raise CommandError('--months-ahead and --retain-months cannot be negative')
+        if options['drop'] and options['archive_schema']:
+            raise CommandError('--drop and --archive-schema cannot be combined')
+        if (options['drop'] or options['archive_schema']) and options['retain_months'] is None:
+            raise CommandError('--drop and --archive-schema need --retain-months')
+        kept_tables = [table for table in options['table'] or ()
+                       if not PARTITIONED_TABLES[table]['detachable']]
+        if kept_tables and options['retain_months'] is not None:
+            raise CommandError(f'{", ".join(kept_tables)} partitions cannot be detached')
+
+        for table in options['table'] or sorted(PARTITIONED_TABLES):
+            created = ensure_partitions(table, options['months_ahead'])
+            self.stdout.write(f'{table}: created {", ".join(created) or "no partitions"}')
+
+            if options['retain_months'] is None or not PARTITIONED_TABLES[table]['detachable']:
+                continue
+            detached, kept = detach_partitions(
+                table,
+                options['retain_months'],
+                archive_schema=options['archive_schema'],
+                drop=options['drop'],
+            )
+            fate = ('dropped' if options['drop']
+                    else f'archived to {options["archive_schema"]}' if options['archive_schema']
+                    else 'detached')
+            self.stdout.write(f'{table}: {fate} {", ".join(detached) or "no partitions"}')
+            if kept:
+                self.stdout.write(self.style.WARNING(
+                    f'{table}: kept {", ".join(kept)}, which still hold open rows'
+                ))
+
+        self.stdout.write(self.style.SUCCESS('Partitions are up to date'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from orders.models import DailyOrderStats
+from datetime import date, timedelta
+import time
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily order rollups from the orders table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD, default: --end)')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD, default: yesterday)')
+        parser.add_argument('--all', action='store_true', help='Rebuild every day')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            start = end = None
+        else:
+            try:
+                # By default only the last closed day; today's rows are still being counted
+                end = (date.fromisoformat(options['end']) if options['end']
+                       else timezone.localdate() - timedelta(days=1))
+                start = date.fromisoformat(options['start']) if options['start'] else end
+            except ValueError:
+                raise CommandError('--start and --end must be YYYY-MM-DD dates')
+
+        began = time.perf_counter()
+        written = DailyOrderStats.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt daily order rollups for {f"{start} to {end}" if start else "all days"}: '
+            f'{written} book-day rows in {time.perf_counter() - began:.1f}s'
+        ))
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+import time
+
+# One statement per batch: lock the next due loans in (return_due_date, id) order,
+# flag them and queue their reminders, returning the batch size and last key
+SWEEP_BATCH = """
+    WITH batch AS (
+        SELECT id FROM orders
+        WHERE status = 'BORROWED' AND NOT is_overdue AND return_due_date < %s {after}
+        ORDER BY return_due_date, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ), flagged AS (
+        UPDATE orders SET is_overdue = true
+        FROM batch
+        WHERE orders.id = batch.id
+        RETURNING orders.id, orders.user_id, orders.book_id, orders.return_due_date
+    ), queued AS (
+        INSERT INTO notification_outbox (user_id, order_id, kind, payload, created_at)
+        SELECT flagged.user_id, flagged.id, 'OVERDUE',
+               jsonb_build_object(
+                   'book_id', flagged.book_id,
+                   'title', books.title,
+                   'return_due_date', flagged.return_due_date
+               ),
+               %s
+        FROM flagged
+        JOIN books ON books.id = flagged.book_id
+        ON CONFLICT (order_id, kind) DO NOTHING
+    )
+    SELECT COUNT(*) OVER (), return_due_date, id
+    FROM flagged
+    ORDER BY return_due_date DESC, id DESC
+    LIMIT 1
+"""
+
+class Command(BaseCommand):
+    help = 'Flag borrowed orders past their due date and queue overdue reminders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Orders flagged per transaction')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        start = time.perf_counter()
+        flagged = 0
+        last = None
+
+        # Keyset batches over orders_overdue_sweep_idx, up to the due dates passed at start
+        while True:
+            after = 'AND (return_due_date, id) > (%s, %s)' if last else ''
+            params = [now, *(last or ()), options['batch_size'], now]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(SWEEP_BATCH.format(after=after), params)
+                row = cursor.fetchone()
+            if row is None:
+                break
+            count, *last = row
+            flagged += count
+            self.stdout.write(f'Flagged {flagged} overdue orders')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Swept overdue orders. Flagged and queued reminders: {flagged} '
+            f'({flagged / elapsed if elapsed else 0:.0f} orders/s)'
+        ))
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_keyset_pagination_indexes'),
+        ('orders', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-date_ordered', 'id'], name='orders_date_or_34ab3b_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_import_hash'),
+        ('orders', '0003_overdue_sweep'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyGenreOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('borrows', models.IntegerField(default=0)),
+                ('purchases', models.IntegerField(default=0)),
+                ('returns', models.IntegerField(default=0)),
+                ('genre', models.CharField(max_length=100)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily genre order stats',
+                'db_table': 'order_daily_genre_stats',
+                'constraints': [models.UniqueConstraint(fields=('day', 'genre'), name='order_daily_genre_stats_day_genre')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyBookOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('borrows', models.IntegerField(default=0)),
+                ('purchases', models.IntegerField(default=0)),
+                ('returns', models.IntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_order_stats', to='books.book')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily book order stats',
+                'db_table': 'order_daily_book_stats',
+                'constraints': [models.UniqueConstraint(fields=('day', 'book'), name='order_daily_book_stats_day_book')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_import_hash'),
+        ('orders', '0004_daily_order_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-date_ordered', 'id'], name='orders_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status', '-date_ordered', 'id'], name='orders_user_status_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from iqraa.partitioning import partition_table, unpartition_table
+
+
+def partition_orders(apps, schema_editor):
+    partition_table('orders', using=schema_editor.connection)
+
+
+def unpartition_orders(apps, schema_editor):
+    unpartition_table('orders', using=schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='order',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='orders.order'),
+        ),
+        migrations.RunPython(partition_orders, unpartition_orders),
+    ]
@@ -1,7 +1,11 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Q
 from django.conf import settings
+from django.utils import timezone
+from datetime import datetime, time, timedelta
 
 class Order(models.Model):
+    """A borrow or purchase; the table is partitioned by month on date_ordered (see iqraa.partitioning)"""
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
         ('BORROWED', 'Borrowed'),
@@ -20,6 +24,8 @@ class Order(models.Model):
     return_due_date = models.DateTimeField(null=True, blank=True)
     return_date = models.DateTimeField(null=True, blank=True)
     purchase_date = models.DateTimeField(null=True, blank=True)
+    # Set by the sweep_overdue command once a borrowed order passes its due date
+    is_overdue = models.BooleanField(default=False)
 
     def __str__(self):
         return f"Order for {self.book.title} by {self.user.username}"
@@ -27,3 +33,207 @@ class Order(models.Model):
     class Meta:
         db_table = 'orders'
         ordering = ['-date_ordered']
+        indexes = [
+            models.Index(fields=['-date_ordered', 'id']),
+            # A user's order history, and the same narrowed to one status
+            models.Index(fields=['user', '-date_ordered', 'id'], name='orders_user_recent_idx'),
+            models.Index(fields=['user', 'status', '-date_ordered', 'id'], name='orders_user_status_idx'),
+            # Due dates of open loans only, for the overdue listing
+            models.Index(fields=['return_due_date', 'id'], condition=Q(status='BORROWED'),
+                         name='orders_borrowed_due_idx'),
+            # Loans the sweeper has yet to flag; rows leave it as they are processed
+            models.Index(fields=['return_due_date', 'id'],
+                         condition=Q(status='BORROWED', is_overdue=False),
+                         name='orders_overdue_sweep_idx'),
+        ]
+
+    def transition(self, from_status, **changes):
+        """Apply changes if the order is still in from_status; False if it has moved on
+
+        A conditional UPDATE, so two requests racing on the same order cannot
+        both make the transition. On failure the instance's status is
+        refreshed for the error message.
+        """
+        moved = Order.objects.filter(pk=self.pk, status=from_status).update(**changes)
+        if moved:
+            for name, value in changes.items():
+                setattr(self, name, value)
+        else:
+            self.refresh_from_db(fields=['status'])
+        return bool(moved)
+
+class Notification(models.Model):
+    """Outbox of user notifications, written in the same transaction as the change they announce
+
+    A delivery worker sends pending rows (sent_at is null) and stamps them;
+    the unique (order, kind) pair makes enqueueing idempotent.
+    """
+    KIND_CHOICES = [
+        ('OVERDUE', 'Overdue reminder'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # orders is partitioned, so its (id, date_ordered) key cannot back a database
+    # constraint on order_id alone; Django still cascades deletes
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.CASCADE,
+                              db_constraint=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for user {self.user_id}"
+
+    class Meta:
+        db_table = 'notification_outbox'
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'kind'], name='notification_outbox_order_kind'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at', 'id'], condition=Q(sent_at__isnull=True),
+                         name='notification_outbox_pending'),
+        ]
+
+class DailyOrderStats(models.Model):
+    """Order event counts for one day, maintained as orders change state"""
+    # Order event -> counter column
+    EVENTS = {
+        'borrow': 'borrows',
+        'purchase': 'purchases',
+        'return': 'returns',
+    }
+    COUNTER_FIELDS = list(EVENTS.values())
+
+    day = models.DateField()
+    borrows = models.IntegerField(default=0)
+    purchases = models.IntegerField(default=0)
+    returns = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def record(book_id, event, when=None):
+        """Count one order event in the book and genre rollups of its day
+
+        Both rows are upserted with increments in one statement, inside the
+        caller's transaction so the count commits with the order change.
+        """
+        column = DailyOrderStats.EVENTS[event]
+        counters = ', '.join(DailyOrderStats.COUNTER_FIELDS)
+        values = ', '.join('1' if name == column else '0' for name in DailyOrderStats.COUNTER_FIELDS)
+        book_table = DailyBookOrderStats._meta.db_table
+        genre_table = DailyGenreOrderStats._meta.db_table
+        day = timezone.localdate(when)
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH book_day AS (
+                    INSERT INTO {book_table} (day, book_id, {counters})
+                    VALUES (%s, %s, {values})
+                    ON CONFLICT (day, book_id)
+                    DO UPDATE SET {column} = {book_table}.{column} + 1
+                )
+                INSERT INTO {genre_table} (day, genre, {counters})
+                SELECT %s, genre, {values} FROM books WHERE id = %s
+                ON CONFLICT (day, genre)
+                DO UPDATE SET {column} = {genre_table}.{column} + 1
+            """, [day, book_id, day, book_id])
+
+    @staticmethod
+    def rebuild(start=None, end=None):
+        """Recompute the book and genre rollups for days start..end (inclusive) from orders
+
+        Days outside the range are left alone; without bounds every day is
+        rebuilt. Returns the number of book rollup rows written.
+
+        The rollups are locked against writes for the rebuild, so record()
+        calls for the same days wait and then add to the rebuilt rows rather
+        than racing the delete and re-insert.
+        """
+        book_table = DailyBookOrderStats._meta.db_table
+        genre_table = DailyGenreOrderStats._meta.db_table
+        tz = timezone.get_current_timezone()
+        bounds = [(condition, day) for condition, day in [('>=', start), ('<=', end)] if day]
+        day_params = [day for _, day in bounds]
+
+        def in_range(column):
+            if not bounds:
+                return ''
+            return 'WHERE ' + ' AND '.join(f'{column} {condition} %s' for condition, _ in bounds)
+
+        # Only order events inside the range are read. Events come after the
+        # order was placed, so the end bound also prunes orders partitions.
+        event_bounds = []
+        if start:
+            event_bounds.append(('{column} >= %s', datetime.combine(start, time.min)))
+        if end:
+            next_day = datetime.combine(end + timedelta(days=1), time.min)
+            event_bounds += [('{column} < %s', next_day), ('date_ordered < %s', next_day)]
+        event_params = [timezone.make_aware(moment, tz) for _, moment in event_bounds]
+
+        def events_of(event, column):
+            conditions = [f'{column} IS NOT NULL'] + [
+                condition.format(column=column) for condition, _ in event_bounds
+            ]
+            return (f"SELECT ({column} AT TIME ZONE %s)::date AS day, book_id, '{event}' AS event "
+                    f"FROM orders WHERE {' AND '.join(conditions)}")
+
+        events = ' UNION ALL '.join(
+            events_of(event, column)
+            for event, column in [('borrow', 'borrow_date'), ('purchase', 'purchase_date'),
+                                  ('return', 'return_date')]
+        )
+        counts = ', '.join(
+            f"COUNT(*) FILTER (WHERE event = '{event}')" for event in DailyOrderStats.EVENTS
+        )
+        sums = ', '.join(f'SUM(stats.{name})' for name in DailyOrderStats.COUNTER_FIELDS)
+        counters = ', '.join(DailyOrderStats.COUNTER_FIELDS)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # EXCLUSIVE still lets the analytics endpoint read the rollups
+            cursor.execute(f'LOCK TABLE {book_table}, {genre_table} IN EXCLUSIVE MODE')
+            cursor.execute(f'DELETE FROM {book_table} {in_range("day")}', day_params)
+            cursor.execute(f'DELETE FROM {genre_table} {in_range("day")}', day_params)
+            cursor.execute(f"""
+                INSERT INTO {book_table} (day, book_id, {counters})
+                SELECT day, book_id, {counts}
+                FROM ({events}) AS events
+                GROUP BY day, book_id
+            """, [timezone.get_current_timezone_name(), *event_params] * 3)
+            written = cursor.rowcount
+            cursor.execute(f"""
+                INSERT INTO {genre_table} (day, genre, {counters})
+                SELECT stats.day, books.genre, {sums}
+                FROM {book_table} stats
+                JOIN books ON books.id = stats.book_id
+                {in_range('stats.day')}
+                GROUP BY stats.day, books.genre
+            """, day_params)
+        return written
+
+class DailyBookOrderStats(DailyOrderStats):
+    book = models.ForeignKey('books.Book', on_delete=models.CASCADE, related_name='daily_order_stats')
+
+    class Meta:
+        db_table = 'order_daily_book_stats'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'book'], name='order_daily_book_stats_day_book'),
+        ]
+        verbose_name_plural = 'Daily book order stats'
+
+    def __str__(self):
+        return f"Orders of book {self.book_id} on {self.day}"
+
+class DailyGenreOrderStats(DailyOrderStats):
+    genre = models.CharField(max_length=100)
+
+    class Meta:
+        db_table = 'order_daily_genre_stats'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'genre'], name='order_daily_genre_stats_day_genre'),
+        ]
+        verbose_name_plural = 'Daily genre order stats'
+
+    def __str__(self):
+        return f"Orders of {self.genre or 'unclassified'} books on {self.day}"
@@ -2,10 +2,11 @@ from rest_framework import serializers
 from .models import Order
 from books.serializers import BookSerializer
 from users.serializers import UserSerializer
+from iqraa.serializers import DynamicFieldsMixin
 from django.utils import timezone
 
-class OrderSerializer(serializers.ModelSerializer):
-    book_details = BookSerializer(source='book', read_only=True)
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    book_details = BookSerializer(source='book', read_only=True, compact=True)
     user_details = UserSerializer(source='user', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     
@@ -14,9 +15,16 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'user_details', 'book', 'book_details', 
                  'date_ordered', 'status', 'status_display', 'is_borrowed', 
                  'is_purchased', 'borrow_date', 'return_due_date', 
-                 'return_date', 'purchase_date']
+                 'return_date', 'purchase_date', 'is_overdue']
         read_only_fields = ['date_ordered', 'status', 'borrow_date', 
-                           'return_date', 'purchase_date']
+                           'return_date', 'purchase_date', 'is_overdue']
+        # List payloads: the order's own fields and the compact book, not the full user
+        compact_fields = ['id', 'user', 'book', 'book_details', 'date_ordered', 'status',
+                          'status_display', 'borrow_date', 'return_due_date',
+                          'return_date', 'purchase_date', 'is_overdue']
+        expandable_fields = {
+            'book_details': (BookSerializer, {'source': 'book', 'read_only': True}),
+        }
 
     def validate(self, data):
         if self.instance:
@@ -1,3 +1,438 @@
-from django.test import TestCase
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from books.models import Book, Category
+from iqraa.partitioning import MONTHS_AHEAD, add_months, current_month, partition_name, partitions
+from iqraa.testing import QueryPlanAssertions, seed_users_and_books
+from users.models import CustomUser
+from .models import DailyBookOrderStats, DailyGenreOrderStats, DailyOrderStats, Notification, Order
 
-# Create your tests here.
+class StockReservationStressTest(TransactionTestCase):
+    """Many threads borrowing and buying one title must never oversell it"""
+    THREADS = 16
+    ORDERS = 120
+    STOCK = 40
+    # Requests per second the whole run must sustain; generous, it only catches lock pile-ups
+    MIN_THROUGHPUT = 20
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='secret')
+        self.book = Book.objects.create(
+            title='Popular Title', author='Author', genre='Fiction',
+            isbn='0000000001', price=Decimal('10.00'), stock=self.STOCK,
+        )
+        self.orders = Order.objects.bulk_create(
+            Order(user=self.user, book=self.book) for _ in range(self.ORDERS)
+        )
+
+    def hammer(self, requests):
+        """POST each (order, action) from THREADS threads; returns status codes and req/s"""
+        def worker(chunk):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                return [
+                    (action, client.post(f'/api/orders/{order.pk}/{action}/', secure=True).status_code)
+                    for order, action in chunk
+                ]
+            finally:
+                # Each thread has its own connection
+                connection.close()
+
+        chunks = [requests[i::self.THREADS] for i in range(self.THREADS)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = [result for chunk in pool.map(worker, chunks) for result in chunk]
+        throughput = len(results) / (time.perf_counter() - start)
+        self.assertGreater(throughput, self.MIN_THROUGHPUT, f'{throughput:.0f} req/s')
+        return results
+
+    def assertStockConsistent(self, results):
+        self.book.refresh_from_db()
+        successes = sum(1 for _, code in results if code == 200)
+        out_of_stock = Order.objects.filter(status__in=['BORROWED', 'PURCHASED']).count()
+        self.assertEqual(successes, self.STOCK)
+        self.assertEqual(out_of_stock, self.STOCK)
+        self.assertEqual(self.book.stock, 0)
+        self.assertEqual(sum(1 for _, code in results if code == 400), self.ORDERS - self.STOCK)
+
+    def test_concurrent_borrows_do_not_oversell(self):
+        results = self.hammer([(order, 'borrow') for order in self.orders])
+        self.assertStockConsistent(results)
+
+    def test_concurrent_borrows_and_purchases_do_not_oversell(self):
+        results = self.hammer([
+            (order, 'borrow' if i % 2 else 'purchase') for i, order in enumerate(self.orders)
+        ])
+        self.assertStockConsistent(results)
+
+    def test_racing_on_one_order_takes_one_copy(self):
+        order = self.orders[0]
+        results = self.hammer([(order, 'borrow')] * self.THREADS * 4)
+        self.assertEqual(sum(1 for _, code in results if code == 200), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, self.STOCK - 1)
+
+    def test_returns_restore_stock(self):
+        borrowed = self.orders[:self.STOCK]
+        self.hammer([(order, 'borrow') for order in borrowed])
+        # Returning twice must only put each copy back once
+        self.hammer([(order, 'return_book') for order in borrowed] * 2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, self.STOCK)
+        self.assertEqual(Order.objects.filter(status='RETURNED').count(), self.STOCK)
+
+class OrderQueryCountTest(TestCase):
+    """Order reads cost the same number of queries whatever the page size"""
+    ORDERS = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='reader', password='secret')
+        cls.staff = CustomUser.objects.create_user(username='staff', password='secret', is_staff=True)
+        categories = [Category.objects.create(name=f'Category {i}') for i in range(3)]
+        books = Book.objects.bulk_create(
+            Book(title=f'Book {i}', author='Author', genre='Fiction',
+                 isbn=f'{i:010d}', price=Decimal('10.00'), stock=5)
+            for i in range(20)
+        )
+        for book in books:
+            book.categories.set(categories)
+        overdue = timezone.now() - timedelta(days=1)
+        Order.objects.bulk_create(
+            Order(user=cls.user, book=books[i % len(books)],
+                  status=['PENDING', 'BORROWED', 'PURCHASED'][i % 3],
+                  return_due_date=overdue if i % 3 == 1 else None)
+            for i in range(cls.ORDERS)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url, queries):
+        # One query for the page of orders with their books and users, one for categories
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_list_is_constant_in_page_size(self):
+        for page_size in (1, 10, 50):
+            data = self.get(f'/api/orders/?page_size={page_size}', 2)
+            self.assertEqual(len(data['results']), page_size)
+
+    def test_list_is_compact(self):
+        order = self.get('/api/orders/', 2)['results'][0]
+        self.assertNotIn('user_details', order)
+        self.assertEqual(len(order['book_details']['categories']), 3)
+        self.assertNotIn('summary', order['book_details'])
+
+    def test_expanded_list_is_constant_in_page_size(self):
+        for page_size in (1, 50):
+            data = self.get(f'/api/orders/?page_size={page_size}&expand=user_details,book_details', 2)
+            self.assertEqual(data['results'][0]['user_details']['username'], 'reader')
+            self.assertIn('summary', data['results'][0]['book_details'])
+
+    def test_list_actions_are_constant_in_page_size(self):
+        for action in ('borrowed', 'purchased', 'overdue'):
+            for page_size in (1, 20):
+                data = self.get(f'/api/orders/{action}/?page_size={page_size}', 2)
+                self.assertEqual(len(data['results']), page_size)
+
+    def test_staff_list_is_constant_in_page_size(self):
+        self.client.force_authenticate(self.staff)
+        for page_size in (1, 50):
+            self.get(f'/api/orders/?page_size={page_size}', 2)
+
+    def test_reading_history_is_constant_in_page_size(self):
+        # The user lookup, then the page and its categories
+        for page_size in (1, 10, 50):
+            data = self.get(f'/api/users/{self.user.pk}/reading_history/?page_size={page_size}', 3)
+            self.assertEqual(len(data['results']), page_size)
+            self.assertEqual(data['results'][0]['user_details']['username'], 'reader')
+
+    def test_retrieve(self):
+        order = Order.objects.filter(user=self.user).first()
+        data = self.get(f'/api/orders/{order.pk}/', 2)
+        self.assertEqual(data['user_details']['username'], 'reader')
+
+class OrderQueryPlanTest(QueryPlanAssertions, TestCase):
+    """Order history reads use the composite and partial indexes, never a scan and sort"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # About a thousand orders per user, so a page is a small slice of each history
+        user_ids, book_ids = seed_users_and_books(users=50, books=500)
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO orders (user_id, book_id, date_ordered, status, is_borrowed,
+                                    is_purchased, return_due_date, is_overdue)
+                SELECT users[1 + g %% cardinality(users)], books[1 + g %% cardinality(books)],
+                       now() - g * interval '1 minute',
+                       (ARRAY['PENDING', 'BORROWED', 'PURCHASED', 'RETURNED'])[1 + g %% 4],
+                       g %% 4 = 1, g %% 4 = 2,
+                       CASE WHEN g %% 4 = 1 THEN now() + ((g %% 30) - 15) * interval '1 day' END,
+                       false
+                FROM generate_series(1, 50000) g,
+                     (SELECT %s::bigint[] AS users, %s::bigint[] AS books) ids
+            """, [user_ids, book_ids])
+            cursor.execute('ANALYZE orders')
+        cls.user = CustomUser.objects.get(pk=user_ids[0])
+        cls.staff = CustomUser.objects.create_user(username='staff', password='secret', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def orders_sql(self, url):
+        return self.captured(lambda: self.client.get(url, secure=True), 'orders')
+
+    def test_user_history(self):
+        for sql in self.orders_sql('/api/orders/'):
+            self.assertIndexPlan(sql, 'orders', 'orders_user_recent_idx')
+
+    def test_user_history_next_page(self):
+        next_page = self.client.get('/api/orders/', secure=True).data['next']
+        for sql in self.orders_sql(next_page):
+            self.assertIndexPlan(sql, 'orders', 'orders_user_recent_idx')
+
+    def test_user_orders_by_status(self):
+        for action in ('borrowed', 'purchased'):
+            for sql in self.orders_sql(f'/api/orders/{action}/'):
+                self.assertIndexPlan(sql, 'orders', 'orders_user_status_idx')
+
+    def test_overdue(self):
+        self.client.force_authenticate(self.staff)
+        for sql in self.orders_sql('/api/orders/overdue/'):
+            self.assertIndexPlan(sql, 'orders', 'orders_borrowed_due_idx')
+
+    def test_staff_history(self):
+        self.client.force_authenticate(self.staff)
+        for sql in self.orders_sql('/api/orders/'):
+            self.assertIndexPlan(sql, 'orders')
+
+class OrderPartitionTest(QueryPlanAssertions, TestCase):
+    """Orders are stored in monthly partitions that time-bounded reads prune to"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='secret')
+        self.book = Book.objects.create(
+            title='Title', author='Author', genre='Fiction',
+            isbn='0000000001', price=Decimal('10.00'), stock=5,
+        )
+
+    def order_dated(self, when, status='RETURNED'):
+        order = Order.objects.create(user=self.user, book=self.book, status=status)
+        # Moves the row into the partition of its month
+        Order.objects.filter(pk=order.pk).update(date_ordered=when)
+        return order
+
+    def test_time_bounded_reads_prune(self):
+        month = current_month()
+        start = datetime.combine(month, datetime.min.time(), tzinfo=dt_timezone.utc)
+        self.order_dated(start + timedelta(days=1))
+        self.assertPrunedTo(
+            Order.objects.filter(date_ordered__gte=start, date_ordered__lt=start + timedelta(days=7)),
+            'orders', [partition_name('orders', month)],
+        )
+        # Open-ended ranges also read the default partition, which takes rows past the last month
+        self.assertPrunedTo(
+            Order.objects.filter(date_ordered__gte=start),
+            'orders',
+            [partition_name('orders', add_months(month, ahead)) for ahead in range(MONTHS_AHEAD + 1)]
+            + ['orders_default'],
+        )
+
+    def test_manage_partitions(self):
+        closed = self.order_dated(datetime(2015, 3, 5, tzinfo=dt_timezone.utc))
+        open_loan = self.order_dated(datetime(2015, 4, 5, tzinfo=dt_timezone.utc), status='BORROWED')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM orders_default')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+        call_command('manage_partitions', table=['orders'], retain_months=12, drop=True,
+                     stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            existing = partitions(cursor, 'orders')
+            cursor.execute('SELECT COUNT(*) FROM orders_default')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute('SELECT id FROM orders_p201504')
+            self.assertEqual(cursor.fetchall(), [(open_loan.pk,)])
+        # The closed month was split out of the default partition, then dropped;
+        # the month with an open loan stays attached
+        self.assertNotIn(date(2015, 3, 1), existing)
+        self.assertIn(date(2015, 4, 1), existing)
+        self.assertFalse(Order.objects.filter(pk=closed.pk).exists())
+        self.assertTrue(Order.objects.filter(pk=open_loan.pk).exists())
+
+class SweepOverdueTest(TestCase):
+    """The sweeper flags each overdue loan once and queues one reminder for it"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='secret')
+        self.book = Book.objects.create(
+            title='Title', author='Author', genre='Fiction',
+            isbn='0000000001', price=Decimal('10.00'), stock=5,
+        )
+        now = timezone.now()
+        self.overdue = Order.objects.bulk_create(
+            Order(user=self.user, book=self.book, status='BORROWED', is_borrowed=True,
+                  return_due_date=now - timedelta(days=days))
+            for days in range(1, 6)
+        )
+        self.not_due = Order.objects.create(user=self.user, book=self.book, status='BORROWED',
+                                            return_due_date=now + timedelta(days=1))
+        self.returned = Order.objects.create(user=self.user, book=self.book, status='RETURNED',
+                                             return_due_date=now - timedelta(days=1))
+
+    def sweep(self):
+        out = StringIO()
+        call_command('sweep_overdue', batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_flags_overdue_loans_and_queues_reminders(self):
+        self.assertIn('Flagged and queued reminders: 5', self.sweep())
+        self.assertEqual(set(Order.objects.filter(is_overdue=True)), set(self.overdue))
+        reminders = Notification.objects.filter(kind='OVERDUE', sent_at__isnull=True)
+        self.assertEqual(sorted(reminders.values_list('order_id', flat=True)),
+                         sorted(order.pk for order in self.overdue))
+        reminder = reminders.get(order=self.overdue[0])
+        self.assertEqual(reminder.user, self.user)
+        self.assertEqual(reminder.payload['book_id'], self.book.pk)
+        self.assertEqual(reminder.payload['title'], 'Title')
+
+    def test_sweeping_again_queues_nothing(self):
+        self.sweep()
+        self.assertIn('Flagged and queued reminders: 0', self.sweep())
+        self.assertEqual(Notification.objects.count(), len(self.overdue))
+
+    def test_reminders_are_unique_per_order(self):
+        # A reminder queued before the order was flagged is not duplicated
+        Notification.objects.create(user=self.user, order=self.overdue[0], kind='OVERDUE')
+        self.sweep()
+        self.assertEqual(Notification.objects.filter(order=self.overdue[0]).count(), 1)
+        self.assertEqual(Notification.objects.count(), len(self.overdue))
+
+class DailyOrderStatsTest(TestCase):
+    """Order transitions count into the daily rollups, which rebuild to the same totals"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='secret')
+        self.staff = CustomUser.objects.create_user(username='staff', password='secret', is_staff=True)
+        self.fiction = Book.objects.create(
+            title='Novel', author='Author', genre='Fiction',
+            isbn='0000000001', price=Decimal('10.00'), stock=10,
+        )
+        self.history = Book.objects.create(
+            title='Chronicle', author='Author', genre='History',
+            isbn='0000000002', price=Decimal('10.00'), stock=10,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for book, actions in [(self.fiction, ['borrow', 'return_book']),
+                              (self.fiction, ['borrow']),
+                              (self.fiction, ['purchase']),
+                              (self.history, ['borrow', 'purchase'])]:
+            order = Order.objects.create(user=self.user, book=book)
+            for action in actions:
+                response = self.client.post(f'/api/orders/{order.pk}/{action}/', secure=True)
+                self.assertEqual(response.status_code, 200)
+        self.today = timezone.localdate()
+
+    def counters(self, model, **lookup):
+        row = model.objects.get(day=self.today, **lookup)
+        return row.borrows, row.purchases, row.returns
+
+    def test_transitions_are_counted(self):
+        self.assertEqual(self.counters(DailyBookOrderStats, book=self.fiction), (2, 1, 1))
+        self.assertEqual(self.counters(DailyBookOrderStats, book=self.history), (1, 1, 0))
+        self.assertEqual(self.counters(DailyGenreOrderStats, genre='Fiction'), (2, 1, 1))
+        self.assertEqual(self.counters(DailyGenreOrderStats, genre='History'), (1, 1, 0))
+
+    def test_rejected_transitions_are_not_counted(self):
+        order = Order.objects.create(user=self.user, book=self.history)
+        response = self.client.post(f'/api/orders/{order.pk}/return_book/', secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.counters(DailyBookOrderStats, book=self.history), (1, 1, 0))
+
+    @staticmethod
+    def rows(model, key):
+        return sorted(model.objects.values_list('day', key, *DailyOrderStats.COUNTER_FIELDS))
+
+    def test_rebuild_matches_incremental_counts(self):
+        books = self.rows(DailyBookOrderStats, 'book_id')
+        genres = self.rows(DailyGenreOrderStats, 'genre')
+        # Drift to be repaired, and a day outside the range to be left alone
+        DailyBookOrderStats.objects.update(borrows=99)
+        DailyGenreOrderStats.objects.create(day=date(2015, 3, 5), genre='Fiction', borrows=7)
+
+        out = StringIO()
+        call_command('rollup_orders', start=str(self.today), end=str(self.today), stdout=out)
+        self.assertIn('2 book-day rows', out.getvalue())
+        self.assertEqual(self.rows(DailyBookOrderStats, 'book_id'), books)
+        self.assertEqual(self.rows(DailyGenreOrderStats, 'genre'),
+                         sorted(genres + [(date(2015, 3, 5), 'Fiction', 7, 0, 0)]))
+
+    def test_default_rebuilds_the_last_closed_day(self):
+        midnight = timezone.make_aware(datetime.combine(self.today, datetime.min.time()))
+        for borrowed in (midnight - timedelta(minutes=1), midnight - timedelta(days=1, minutes=1)):
+            order = Order.objects.create(user=self.user, book=self.history)
+            Order.objects.filter(pk=order.pk).update(date_ordered=borrowed - timedelta(hours=1),
+                                                     status='BORROWED', borrow_date=borrowed)
+        # Today's rows are still being counted live, so they are left alone
+        DailyBookOrderStats.objects.filter(day=self.today).update(borrows=99)
+
+        out = StringIO()
+        call_command('rollup_orders', stdout=out)
+        self.assertIn(f'{self.today - timedelta(days=1)} to {self.today - timedelta(days=1)}',
+                      out.getvalue())
+        self.assertEqual(set(DailyBookOrderStats.objects.values_list('day', 'book_id', 'borrows')), {
+            (self.today, self.fiction.pk, 99),
+            (self.today, self.history.pk, 99),
+            (self.today - timedelta(days=1), self.history.pk, 1),
+        })
+
+    def analytics(self, query='', user=None):
+        self.client.force_authenticate(user or self.staff)
+        return self.client.get(f'/api/orders/analytics/{query}', secure=True)
+
+    def test_analytics_is_staff_only(self):
+        self.assertEqual(self.analytics(user=self.user).status_code, 403)
+
+    def test_analytics_by_day(self):
+        response = self.analytics()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['totals'], {'borrows': 3, 'purchases': 2, 'returns': 1})
+        self.assertEqual(response.data['results'],
+                         [{'day': self.today, 'borrows': 3, 'purchases': 2, 'returns': 1}])
+
+    def test_analytics_by_genre_and_book(self):
+        response = self.analytics('?group_by=genre')
+        self.assertEqual([row['genre'] for row in response.data['results']], ['Fiction', 'History'])
+
+        response = self.analytics('?group_by=book&genre=History')
+        self.assertEqual(response.data['results'], [{
+            'book_id': self.history.pk, 'title': 'Chronicle', 'isbn': '0000000002',
+            'borrows': 1, 'purchases': 1, 'returns': 0,
+        }])
+        response = self.analytics(f'?book={self.fiction.pk}')
+        self.assertEqual(response.data['totals'], {'borrows': 2, 'purchases': 1, 'returns': 1})
+
+    def test_analytics_window(self):
+        yesterday = self.today - timedelta(days=1)
+        response = self.analytics(f'?start={yesterday}&end={yesterday}')
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['totals'], {'borrows': 0, 'purchases': 0, 'returns': 0})
+
+    def test_analytics_rejects_bad_parameters(self):
+        for query in ('?start=yesterday', '?group_by=author', '?book=abc'):
+            self.assertEqual(self.analytics(query).status_code, 400, query)
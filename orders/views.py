@@ -2,25 +2,48 @@ from django.shortcuts import render
 from rest_framework import viewsets, status, permissions, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from django.db import transaction
+from django.db.models import Sum
 from django.utils import timezone
-from datetime import timedelta
-from .models import Order
+from datetime import date, timedelta
+from .models import Order, DailyOrderStats, DailyBookOrderStats, DailyGenreOrderStats
 from .serializers import OrderSerializer
 from books.models import Book
+from iqraa.export import ExportMixin
+from iqraa.pagination import PaginatedActionMixin
 
-class OrderViewSet(viewsets.ModelViewSet):
+BORROW_PERIOD = timedelta(days=14)
+# Default analytics window, and the most genres or books returned per query
+ANALYTICS_DAYS = 30
+ANALYTICS_GROUP_LIMIT = 100
+# Actions that return lists of orders and default to the compact projection
+LIST_ACTIONS = {'list', 'borrowed', 'purchased', 'overdue'}
+
+class OrderViewSet(PaginatedActionMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordering = ['-date_ordered', 'id']
+    export_fields = ['id', 'user_id', 'user__username', 'book_id', 'book__isbn', 'status',
+                     'date_ordered', 'borrow_date', 'return_due_date', 'return_date',
+                     'purchase_date']
 
     def get_queryset(self):
         user = self.request.user
+        # Orders render their book (with its categories) and user
+        queryset = Order.objects.select_related('book', 'user').prefetch_related('book__categories')
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in LIST_ACTIONS:
+            kwargs.setdefault('compact', True)
+        return super().get_serializer(*args, **kwargs)
 
     def perform_create(self, serializer):
+        # Advisory only: stock is taken atomically when the order is borrowed or purchased
         book = serializer.validated_data['book']
-        if book.stock <= 0:
+        if not Book.objects.filter(pk=book.pk, stock__gt=0).exists():
             raise serializers.ValidationError({"detail": "Book is out of stock"})
         
         serializer.save(
@@ -29,36 +52,39 @@ class OrderViewSet(viewsets.ModelViewSet):
             status='PENDING'
         )
 
+    def stock_changed_response(self, order):
+        """The order after a transition that changed its book's stock"""
+        # The response embeds the book, whose stock was changed in the database
+        order.book.refresh_from_db(fields=['stock', 'updated_at'])
+        serializer = self.get_serializer(order)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['post'])
     def borrow(self, request, pk=None):
         order = self.get_object()
-        
-        if order.status != 'PENDING':
-            return Response(
-                {"detail": f"Cannot borrow book in {order.status} status"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-            
-        if order.book.stock <= 0:
-            return Response(
-                {"detail": "Book is out of stock"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Update book stock
-        book = order.book
-        book.stock -= 1
-        book.save()
-        
-        # Update order
-        order.status = 'BORROWED'
-        order.is_borrowed = True
-        order.borrow_date = timezone.now()
-        order.return_due_date = timezone.now() + timedelta(days=14)  # 2 weeks borrowing period
-        order.save()
-        
-        serializer = self.get_serializer(order)
-        return Response(serializer.data)
+        now = timezone.now()
+
+        # The order transition and the stock decrement commit or roll back together
+        with transaction.atomic():
+            if not order.transition(
+                'PENDING',
+                status='BORROWED',
+                is_borrowed=True,
+                borrow_date=now,
+                return_due_date=now + BORROW_PERIOD,
+            ):
+                return Response(
+                    {"detail": f"Cannot borrow book in {order.status} status"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not Book.take_stock(order.book_id):
+                transaction.set_rollback(True)
+                return Response(
+                    {"detail": "Book is out of stock"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            DailyOrderStats.record(order.book_id, 'borrow', now)
+        return self.stock_changed_response(order)
 
     @action(detail=True, methods=['post'])
     def purchase(self, request, pk=None):
@@ -70,63 +96,56 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if order.status == 'PENDING' and order.book.stock <= 0:
-            return Response(
-                {"detail": "Book is out of stock"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Update book stock if not already borrowed
-        if order.status == 'PENDING':
-            book = order.book
-            book.stock -= 1
-            book.save()
-
-        # Update order
-        order.status = 'PURCHASED'
-        order.is_purchased = True
-        order.purchase_date = timezone.now()
-        order.save()
-        
-        serializer = self.get_serializer(order)
-        return Response(serializer.data)
+        with transaction.atomic():
+            # A borrowed copy is already out of stock
+            from_status = order.status
+            if not order.transition(
+                from_status,
+                status='PURCHASED',
+                is_purchased=True,
+                purchase_date=timezone.now(),
+            ):
+                return Response(
+                    {"detail": f"Cannot purchase book in {order.status} status"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if from_status == 'PENDING' and not Book.take_stock(order.book_id):
+                transaction.set_rollback(True)
+                return Response(
+                    {"detail": "Book is out of stock"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            DailyOrderStats.record(order.book_id, 'purchase', order.purchase_date)
+        return self.stock_changed_response(order)
 
     @action(detail=True, methods=['post'])
     def return_book(self, request, pk=None):
         order = self.get_object()
         
-        if not order.is_borrowed or order.status != 'BORROWED':
-            return Response(
-                {"detail": "This book is not borrowed"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Update book stock
-        book = order.book
-        book.stock += 1
-        book.save()
-        
-        # Update order
-        order.status = 'RETURNED'
-        order.is_borrowed = False
-        order.return_date = timezone.now()
-        order.save()
-        
-        serializer = self.get_serializer(order)
-        return Response(serializer.data)
+        with transaction.atomic():
+            if not order.is_borrowed or not order.transition(
+                'BORROWED',
+                status='RETURNED',
+                is_borrowed=False,
+                return_date=timezone.now(),
+            ):
+                return Response(
+                    {"detail": "This book is not borrowed"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            Book.return_stock(order.book_id)
+            DailyOrderStats.record(order.book_id, 'return', order.return_date)
+        return self.stock_changed_response(order)
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         order = self.get_object()
         
-        if order.status not in ['PENDING']:
+        if not order.transition('PENDING', status='CANCELLED'):
             return Response(
                 {"detail": f"Cannot cancel order in {order.status} status"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        order.status = 'CANCELLED'
-        order.save()
         
         serializer = self.get_serializer(order)
         return Response(serializer.data)
@@ -134,21 +153,85 @@ class OrderViewSet(viewsets.ModelViewSet):
     @action(detail=False)
     def borrowed(self, request):
         borrowed_orders = self.get_queryset().filter(status='BORROWED')
-        serializer = self.get_serializer(borrowed_orders, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(borrowed_orders)
 
     @action(detail=False)
     def purchased(self, request):
         purchased_orders = self.get_queryset().filter(status='PURCHASED')
-        serializer = self.get_serializer(purchased_orders, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(purchased_orders)
 
     @action(detail=False)
     def overdue(self, request):
         """List all overdue borrowed books"""
+        # Most overdue first, read from the orders_borrowed_due_idx partial index
         overdue_orders = self.get_queryset().filter(
             status='BORROWED',
             return_due_date__lt=timezone.now()
-        )
-        serializer = self.get_serializer(overdue_orders, many=True)
-        return Response(serializer.data)
+        ).order_by('return_due_date', 'id')
+        return self.paginated_response(overdue_orders)
+
+    @action(detail=False, permission_classes=[permissions.IsAdminUser])
+    def analytics(self, request):
+        """Borrow, purchase and return volumes by day, genre or book, read from the daily rollups"""
+        params = request.query_params
+        try:
+            end = date.fromisoformat(params['end']) if params.get('end') else timezone.localdate()
+            start = (date.fromisoformat(params['start']) if params.get('start')
+                     else end - timedelta(days=ANALYTICS_DAYS - 1))
+        except ValueError:
+            return Response(
+                {"detail": "start and end must be YYYY-MM-DD dates"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        group_by = params.get('group_by', 'day')
+        if group_by not in ('day', 'genre', 'book'):
+            return Response(
+                {"detail": "group_by must be day, genre or book"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        book = params.get('book')
+        if book and not book.isdigit():
+            return Response({"detail": "book must be a book id"}, status=status.HTTP_400_BAD_REQUEST)
+        genre = params.get('genre')
+
+        # Per-book questions need the book rollup; the rest read the much smaller genre rollup.
+        # groups maps output names to the lookups grouped on.
+        if group_by == 'book' or book:
+            rows = DailyBookOrderStats.objects.filter(day__range=(start, end))
+            if book:
+                rows = rows.filter(book_id=book)
+            if genre:
+                rows = rows.filter(book__genre=genre)
+            groups = {
+                'day': {'day': 'day'},
+                'genre': {'genre': 'book__genre'},
+                'book': {'book_id': 'book_id', 'title': 'book__title', 'isbn': 'book__isbn'},
+            }[group_by]
+        else:
+            rows = DailyGenreOrderStats.objects.filter(day__range=(start, end))
+            if genre:
+                rows = rows.filter(genre=genre)
+            groups = {'day': {'day': 'day'}, 'genre': {'genre': 'genre'}}[group_by]
+
+        fields = DailyOrderStats.COUNTER_FIELDS
+        totals = rows.aggregate(**{name: Sum(name, default=0) for name in fields})
+        results = rows.values(*groups.values()).annotate(**{f'total_{name}': Sum(name) for name in fields})
+        if group_by == 'day':
+            results = results.order_by('day')
+        else:
+            # Busiest first
+            results = results.annotate(
+                volume=Sum('borrows') + Sum('purchases') + Sum('returns')
+            ).order_by('-volume', *groups.values())[:ANALYTICS_GROUP_LIMIT]
+
+        return Response({
+            "start": start,
+            "end": end,
+            "group_by": group_by,
+            "totals": totals,
+            "results": [
+                {**{name: row[lookup] for name, lookup in groups.items()},
+                 **{name: row[f'total_{name}'] for name in fields}}
+                for row in results
+            ],
+        })
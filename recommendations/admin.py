@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserActivity, Recommendation, RecommendationItem, ModelData
+from .models import UserActivity, Recommendation, RecommendationItem, ModelData, BookNeighbor
 
 @admin.register(UserActivity)
 class UserActivityAdmin(admin.ModelAdmin):
@@ -25,3 +25,10 @@ class ModelDataAdmin(admin.ModelAdmin):
     list_display = ('name', 'version', 'created_at', 'updated_at')
     search_fields = ('name',)
     readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(BookNeighbor)
+class BookNeighborAdmin(admin.ModelAdmin):
+    list_display = ('book', 'rank', 'neighbor', 'score')
+    search_fields = ('book__title',)
+    raw_id_fields = ('book', 'neighbor')
+    ordering = ('book', 'rank')
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from recommendations.ml_model import SentimentAnalyzer
+from reviews.models import Review
+import random
+import time
+
+SAMPLE_COMMENTS = [
+    "Absolutely loved this book, could not put it down!",
+    "The plot was kind of boring and the characters were very dull.",
+    "Not bad at all, but the ending felt rushed.",
+    "I HATED the middle chapters, though the writing is beautiful.",
+    "A wonderful, moving story. Highly recommended :)",
+    "Meh. It was okay I guess??",
+    "Never so disappointed by an author I used to admire.",
+    "Great characters, terrible pacing, decent translation.",
+]
+
+class Command(BaseCommand):
+    help = 'Benchmark sentiment scoring throughput (comments per second)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20000,
+                            help='Number of comments to score')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Process pool size for batch scoring (default: CPU count)')
+        parser.add_argument('--from-db', action='store_true',
+                            help='Score stored review comments instead of synthetic ones')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        if options['from_db']:
+            comments = list(
+                Review.objects.exclude(comment='').values_list('comment', flat=True)[:count]
+            )
+        else:
+            rng = random.Random(42)
+            comments = [
+                ' '.join(rng.sample(SAMPLE_COMMENTS, 3)) for _ in range(count)
+            ]
+        if not comments:
+            self.stdout.write(self.style.ERROR('No comments to score'))
+            return
+
+        analyzer = SentimentAnalyzer(workers=options['workers'])
+        results = [('one-at-a-time', lambda: [analyzer.analyze_sentiment(c) for c in comments])]
+
+        try:
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer
+            nltk_analyzer = SentimentIntensityAnalyzer()
+            results.insert(0, ('nltk one-at-a-time', lambda: [
+                nltk_analyzer.polarity_scores(c)['compound'] for c in comments
+            ]))
+        except LookupError:
+            pass
+
+        serial = SentimentAnalyzer(workers=1)
+        results.append(('analyze_batch (inline)', lambda: serial.analyze_batch(comments)))
+        results.append((f'analyze_batch ({analyzer.workers} workers)',
+                        lambda: analyzer.analyze_batch(comments)))
+
+        self.stdout.write(f'Scoring {len(comments)} comments')
+        for label, run in results:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{label:<32} {elapsed:8.3f}s {len(comments) / elapsed:12.0f} comments/s'
+            )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from recommendations.ml_model import BookRecommender
+from recommendations.models import BookNeighbor
+import time
+
+class Command(BaseCommand):
+    help = 'Retrain the recommender and rebuild the precomputed book neighbor table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbors', type=int, default=BookRecommender.NEIGHBOR_COUNT,
+                            help='Neighbors stored per book')
+
+    def handle(self, *args, **options):
+        recommender = BookRecommender()
+        recommender.NEIGHBOR_COUNT = options['neighbors']
+
+        start = time.perf_counter()
+        recommender.train_model()
+        self.stdout.write(self.style.SUCCESS(
+            f'Trained on {len(recommender.books_df)} books and stored '
+            f'{BookNeighbor.objects.count()} neighbors in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_import_hash'),
+        ('recommendations', '0002_book_neighbors'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user', '-last_viewed', 'id'], name='activities_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(condition=models.Q(('is_favorite', True)), fields=['user', '-last_viewed', 'id'], name='activities_user_favorites_idx'),
+        ),
+    ]
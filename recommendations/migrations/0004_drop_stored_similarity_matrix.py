@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Saved models no longer carry the dense book x book similarity matrix"""
+
+    dependencies = [
+        ('recommendations', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "UPDATE model_data SET data = data - 'similarity_matrix' WHERE data ? 'similarity_matrix'",
+            migrations.RunSQL.noop,
+        ),
+    ]
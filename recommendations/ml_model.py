@@ -1,20 +1,34 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.preprocessing import MinMaxScaler, normalize
+from scipy import sparse
 import pandas as pd
 import numpy as np
 from books.models import Book
 from reviews.models import Review
 from orders.models import Order 
-from .models import ModelData
+from django.utils import timezone
+from datetime import timedelta
+from .models import ModelData, BookNeighbor
+from concurrent.futures import ProcessPoolExecutor
+from nltk.sentiment.vader import VaderConstants
+import nltk
 import json
+import math
+import os
+import re
+import string
+import sys
 
 class BookRecommender:
     MODEL_NAME = 'book_recommender'
+    NEIGHBOR_COUNT = 20  # Neighbors stored per book
+    INTERACTION_WEIGHT = 0.3  # Share of co-interaction similarity in neighbor scores
+    NEIGHBOR_BLOCK = 1000  # Books scored against the catalog at a time
+    INTERACTION_MONTHS = 24  # History of reviews and orders the model learns from
     
     def __init__(self):
         self.vectorizer = TfidfVectorizer(stop_words='english')
-        self.similarity_matrix = None
         self.books_df = None
         self.user_ratings_matrix = None
         
@@ -33,28 +47,30 @@ class BookRecommender:
             'combined_features': f"{book.title} {book.author} {book.genre} {book.summary or ''} {' '.join(book.keywords or [])}"
         } for book in books])
         
-        # Get all user interactions
-        reviews = Review.objects.all()
-        orders = Order.objects.all()
+        # Interactions within the window, which prunes to the recent monthly
+        # partitions of the reviews and orders tables
+        since = timezone.now() - timedelta(days=30 * self.INTERACTION_MONTHS)
+        reviews = Review.objects.filter(date_reviewed__gte=since).values_list('user_id', 'book_id', 'rating')
+        orders = Order.objects.filter(date_ordered__gte=since).values_list('user_id', 'book_id', 'is_purchased')
         
         # Create user-item interaction matrix
         interactions = []
         
         # Add review interactions
-        for review in reviews:
+        for user_id, book_id, rating in reviews.iterator(chunk_size=5000):
             interactions.append({
-                'user_id': review.user.id,
-                'book_id': str(review.book.id),
-                'rating': review.rating,
+                'user_id': user_id,
+                'book_id': str(book_id),
+                'rating': rating,
                 'interaction_type': 'review'
             })
             
         # Add order interactions
-        for order in orders:
-            rating = 5 if order.is_purchased else 4
+        for user_id, book_id, is_purchased in orders.iterator(chunk_size=5000):
+            rating = 5 if is_purchased else 4
             interactions.append({
-                'user_id': order.user.id,
-                'book_id': str(order.book.id),
+                'user_id': user_id,
+                'book_id': str(book_id),
                 'rating': rating,
                 'interaction_type': 'order'
             })
@@ -74,7 +90,12 @@ class BookRecommender:
         return self.books_df
         
     def train_model(self):
-        """Train both content-based and collaborative filtering models"""
+        """Train both content-based and collaborative filtering models
+
+        Book-to-book similarity is only ever materialized NEIGHBOR_BLOCK rows
+        at a time (see compute_neighbors); what is kept of it is each book's
+        top neighbors in the BookNeighbor table.
+        """
         self.prepare_data()
         
         if len(self.books_df) == 0:
@@ -82,23 +103,73 @@ class BookRecommender:
             
         # Content-based filtering
         tfidf_matrix = self.vectorizer.fit_transform(self.books_df['combined_features'])
-        self.similarity_matrix = cosine_similarity(tfidf_matrix)
+        BookNeighbor.replace_all(self.compute_neighbors(tfidf_matrix))
         
         # Save model data to database
         model_data = {
             'vectorizer': {
                 'vocabulary': self.vectorizer.vocabulary_,
                 'idf': self.vectorizer.idf_.tolist(),
-                'stop_words': list(self.vectorizer.stop_words_)
+                'stop_words': list(getattr(self.vectorizer, 'stop_words_', ()))
             },
-            'similarity_matrix': self.similarity_matrix.tolist(),
             'books_data': self.books_df.to_dict(),
             'user_ratings': self.user_ratings_matrix.to_dict() if not self.user_ratings_matrix.empty else {}
         }
         
         ModelData.save_model_data(self.MODEL_NAME, model_data)
-        return self.similarity_matrix
     
+    def interaction_matrix(self):
+        """Books x users ratings aligned with books_df, rows L2-normalized, or None"""
+        if self.user_ratings_matrix is None or self.user_ratings_matrix.empty:
+            return None
+        positions = {book_id: i for i, book_id in enumerate(self.books_df['id'])}
+        ratings = self.user_ratings_matrix
+        book_rows = np.array([positions.get(book_id, -1) for book_id in ratings.columns])
+        user_idx, column_idx = np.nonzero(ratings.values)
+        known = book_rows[column_idx] >= 0
+        matrix = sparse.csr_matrix(
+            (ratings.values[user_idx[known], column_idx[known]],
+             (book_rows[column_idx[known]], user_idx[known])),
+            shape=(len(self.books_df), len(ratings.index)),
+        )
+        return normalize(matrix)
+
+    def compute_neighbors(self, tfidf_matrix):
+        """Yield (book_id, neighbor_id, score, rank) for each book's top neighbors
+
+        Scores blend TF-IDF content similarity with item-item cosine similarity
+        over user ratings (books read by the same people). Books are scored in
+        blocks so memory stays at NEIGHBOR_BLOCK x catalog size.
+        """
+        count = len(self.books_df)
+        k = min(self.NEIGHBOR_COUNT, count - 1)
+        if k <= 0:
+            return
+        book_ids = self.books_df['id'].astype(int).to_numpy()
+        content = normalize(tfidf_matrix).tocsr()
+        interactions = self.interaction_matrix()
+
+        for start in range(0, count, self.NEIGHBOR_BLOCK):
+            end = min(start + self.NEIGHBOR_BLOCK, count)
+            scores = (content[start:end] @ content.T).toarray()
+            if interactions is not None:
+                scores *= 1 - self.INTERACTION_WEIGHT
+                scores += self.INTERACTION_WEIGHT * (interactions[start:end] @ interactions.T).toarray()
+            scores[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            for row in range(end - start):
+                rank = 0
+                for neighbor, score in zip(top[row], top_scores[row]):
+                    if score > 0:
+                        yield int(book_ids[start + row]), int(book_ids[neighbor]), float(score), rank
+                        rank += 1
+
     def load_model(self):
         """Load model data from database"""
         model_data = ModelData.get_latest_model_data(self.MODEL_NAME)
@@ -113,9 +184,6 @@ class BookRecommender:
         self.vectorizer.idf_ = np.array(vectorizer_data['idf'])
         self.vectorizer.stop_words_ = set(vectorizer_data['stop_words'])
         
-        # Load similarity matrix
-        self.similarity_matrix = np.array(model_data.data['similarity_matrix'])
-        
         # Load books data
         self.books_df = pd.DataFrame.from_dict(model_data.data['books_data'])
         
@@ -127,15 +195,20 @@ class BookRecommender:
     
     def get_recommendations(self, book_id, num_recommendations=5, user_id=None):
         """Get recommendations using hybrid approach"""
-        if self.similarity_matrix is None:
+        if self.books_df is None:
             self.load_model()
             
+        if not (self.books_df['id'] == book_id).any():
+            raise ValueError("Book ID not found")
+
         try:
-            # Content-based recommendations
-            book_idx = self.books_df[self.books_df['id'] == book_id].index[0]
-            content_scores = list(enumerate(self.similarity_matrix[book_idx]))
-            content_scores = sorted(content_scores, key=lambda x: x[1], reverse=True)
-            content_recs = [self.books_df.iloc[idx]['id'] for idx, _ in content_scores[1:num_recommendations*2]]
+            # Content-based recommendations: the precomputed nearest neighbors
+            content_recs = [
+                str(neighbor_id) for neighbor_id in
+                BookNeighbor.objects.filter(book_id=int(book_id))
+                .order_by('rank')
+                .values_list('neighbor_id', flat=True)[:num_recommendations * 2 - 1]
+            ]
             
             # Collaborative filtering recommendations if we have user data
             if user_id and not self.user_ratings_matrix.empty:
@@ -190,4 +263,238 @@ class BookRecommender:
             return content_recs[:num_recommendations]
             
         except IndexError:
-            raise ValueError("Book ID not found")
\ No newline at end of file
+            raise ValueError("Book ID not found")
+
+
+# Sentiment analysis
+#
+# The analyzer reproduces the compound score of NLTK's SentimentIntensityAnalyzer,
+# quirks included (see SentimentParityTest), but keeps everything that does not
+# depend on the input text in module-level state, so the lexicon is parsed
+# once per process instead of once per analyzer or per comment.
+
+VADER_LEXICON = 'sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt'
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+
+_VADER = VaderConstants()
+_PUNC_LIST = frozenset(_VADER.PUNC_LIST)
+_PUNCT = re.escape(string.punctuation)
+_AFFIX_RE = re.compile(r'^([%s]*)(.*?)([%s]*)$' % (_PUNCT, _PUNCT), re.DOTALL)
+_PUNCT_RE = re.compile(r'[%s]' % _PUNCT)
+_NEGATIONS = frozenset(_VADER.NEGATE)
+_BOOSTERS = dict(_VADER.BOOSTER_DICT)
+_IDIOMS = dict(_VADER.SPECIAL_CASE_IDIOMS)
+_LEXICON = None
+
+
+def load_lexicon():
+    """Return the word -> valence table, parsing it on first use in this process"""
+    global _LEXICON
+    if _LEXICON is None:
+        try:
+            raw = nltk.data.load(VADER_LEXICON)
+        except LookupError:
+            nltk.download('vader_lexicon', quiet=True)
+            raw = nltk.data.load(VADER_LEXICON)
+        lexicon = {}
+        for line in raw.splitlines():
+            parts = line.split('\t', 2)
+            if len(parts) >= 2:
+                lexicon[sys.intern(parts[0])] = float(parts[1])
+        _LEXICON = lexicon
+    return _LEXICON
+
+
+def _tokenize(text):
+    """Split text on whitespace into words and emoticons, as NLTK's SentiText does
+
+    Single characters are dropped. A word is only stripped of punctuation
+    when exactly one PUNC_LIST entry is attached to one side of it, so
+    "good!" becomes "good" but "good!!!!!" and "(good)" stay as they are
+    and miss the lexicon.
+    """
+    tokens = []
+    for token in text.split():
+        if len(token) < 2:
+            continue
+        before, word, after = _AFFIX_RE.match(token).groups()
+        affix = before if not after else after if not before else None
+        if affix in _PUNC_LIST and len(word) > 1 and not _PUNCT_RE.search(word):
+            token = word
+        tokens.append(token)
+    return tokens
+
+
+def _is_negated(word):
+    word = word.lower()
+    return word in _NEGATIONS or "n't" in word
+
+
+def _never_valence(words, i, distance, valence):
+    """Negation by the word distance places before words[i], and the "never so" boosts
+
+    Mirrors NLTK's _never_check, including its case-sensitive "never"
+    and the 1.25 boost whenever the previous word is "so" or "this".
+    """
+    if distance == 1:
+        never = False
+    elif distance == 2:
+        never = words[i - 2] == 'never' and words[i - 1] in ('so', 'this')
+    else:
+        never = (words[i - 3] == 'never' and words[i - 2] in ('so', 'this')
+                 or words[i - 1] in ('so', 'this'))
+    if never:
+        return valence * (1.5 if distance == 2 else 1.25)
+    if _is_negated(words[i - distance]):
+        return valence * _VADER.N_SCALAR
+    return valence
+
+
+def _idiom_valence(words, i, valence):
+    """Apply idiom overrides and "kind of"-style dampeners around words[i]"""
+    before = (
+        f'{words[i - 1]} {words[i]}',
+        f'{words[i - 2]} {words[i - 1]} {words[i]}',
+        f'{words[i - 2]} {words[i - 1]}',
+        f'{words[i - 3]} {words[i - 2]} {words[i - 1]}',
+        f'{words[i - 3]} {words[i - 2]}',
+    )
+    for sequence in before:
+        if sequence in _IDIOMS:
+            valence = _IDIOMS[sequence]
+            break
+    if i + 1 < len(words) and f'{words[i]} {words[i + 1]}' in _IDIOMS:
+        valence = _IDIOMS[f'{words[i]} {words[i + 1]}']
+    if i + 2 < len(words) and f'{words[i]} {words[i + 1]} {words[i + 2]}' in _IDIOMS:
+        valence = _IDIOMS[f'{words[i]} {words[i + 1]} {words[i + 2]}']
+    if before[4] in _BOOSTERS or before[2] in _BOOSTERS:
+        valence += _VADER.B_DECR
+    return valence
+
+
+def score_text(text):
+    """Return the VADER compound sentiment of a single text in [-1, 1]"""
+    if not text:
+        return 0.0
+    lexicon = _LEXICON if _LEXICON is not None else load_lexicon()
+    tokens = _tokenize(text)
+    if not tokens:
+        return 0.0
+    lowered = [token.lower() for token in tokens]
+    upper_count = sum(1 for token in tokens if token.isupper())
+    is_cap_diff = 0 < upper_count < len(tokens)
+    # NLTK scores a repeated token in the context of its first occurrence
+    first_index = {}
+    for position, token in enumerate(tokens):
+        first_index.setdefault(token, position)
+
+    sentiments = []
+    for token in tokens:
+        i = first_index[token]
+        word = lowered[i]
+        valence = lexicon.get(word)
+        if valence is None or word in _BOOSTERS or (
+                word == 'kind' and i + 1 < len(lowered) and lowered[i + 1] == 'of'):
+            sentiments.append(0.0)
+            continue
+
+        if is_cap_diff and tokens[i].isupper():
+            valence += _VADER.C_INCR if valence > 0 else -_VADER.C_INCR
+
+        # Boosters and negations within the three preceding words
+        for distance in range(1, 4):
+            if i < distance:
+                break
+            previous = lowered[i - distance]
+            if previous in lexicon:
+                continue
+            scalar = _BOOSTERS.get(previous, 0.0)
+            if scalar:
+                if valence < 0:
+                    scalar = -scalar
+                if is_cap_diff and tokens[i - distance].isupper():
+                    scalar += _VADER.C_INCR if valence > 0 else -_VADER.C_INCR
+                if distance == 2:
+                    scalar *= 0.95
+                elif distance == 3:
+                    scalar *= 0.9
+                valence += scalar
+            valence = _never_valence(tokens, i, distance, valence)
+            if distance == 3:
+                valence = _idiom_valence(tokens, i, valence)
+
+        if i > 0 and lowered[i - 1] == 'least' and 'least' not in lexicon and (
+                i < 2 or lowered[i - 2] not in ('at', 'very')):
+            valence *= _VADER.N_SCALAR
+
+        sentiments.append(valence)
+
+    # Sentiment after "but" dominates the clause before it
+    if 'but' in lowered:
+        pivot = lowered.index('but')
+        sentiments = [
+            value * 0.5 if idx < pivot else value * 1.5 if idx > pivot else value
+            for idx, value in enumerate(sentiments)
+        ]
+
+    total = sum(sentiments)
+    if total:
+        emphasis = min(text.count('!'), 4) * 0.292
+        question_marks = text.count('?')
+        if question_marks > 1:
+            emphasis += question_marks * 0.18 if question_marks <= 3 else 0.96
+        total += emphasis if total > 0 else -emphasis
+    return round(total / math.sqrt(total * total + 15), 4)
+
+
+def _score_chunk(texts):
+    return [score_text(text) for text in texts]
+
+
+class SentimentAnalyzer:
+    """Batch VADER sentiment scoring for review comments"""
+    POOL_THRESHOLD = 5000
+    CHUNK_SIZE = 2000
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        load_lexicon()
+
+    def analyze_sentiment(self, text):
+        """Get the compound sentiment score of a single comment"""
+        return score_text(text)
+
+    def create_pool(self):
+        """Create a process pool whose workers load the lexicon once at start-up"""
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=load_lexicon)
+
+    def analyze_batch(self, texts, pool=None):
+        """Get compound sentiment scores for many comments, in input order
+
+        Batches of at least POOL_THRESHOLD comments are split into chunks and
+        scored in a process pool; smaller batches are scored inline since the
+        pool start-up would cost more than it saves. Callers scoring many
+        batches can pass a long-lived pool from create_pool().
+        """
+        texts = list(texts)
+        if pool is None:
+            if len(texts) < self.POOL_THRESHOLD or self.workers < 2:
+                return _score_chunk(texts)
+            with self.create_pool() as own_pool:
+                return self.analyze_batch(texts, pool=own_pool)
+
+        chunks = [texts[i:i + self.CHUNK_SIZE] for i in range(0, len(texts), self.CHUNK_SIZE)]
+        scores = []
+        for chunk_scores in pool.map(_score_chunk, chunks):
+            scores.extend(chunk_scores)
+        return scores
+
+    @staticmethod
+    def interpret(score):
+        """Map a compound score onto positive/neutral/negative"""
+        if score >= POSITIVE_THRESHOLD:
+            return 'positive'
+        if score <= NEGATIVE_THRESHOLD:
+            return 'negative'
+        return 'neutral'
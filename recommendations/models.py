@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.conf import settings
 import json
 
@@ -14,6 +15,12 @@ class UserActivity(models.Model):
         db_table = 'user_activities'
         unique_together = ('user', 'book')
         verbose_name_plural = 'User activities'
+        indexes = [
+            # A user's activity, most recently viewed first, and their favorites alone
+            models.Index(fields=['user', '-last_viewed', 'id'], name='activities_user_recent_idx'),
+            models.Index(fields=['user', '-last_viewed', 'id'], condition=Q(is_favorite=True),
+                         name='activities_user_favorites_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s activity on {self.book.title}"
@@ -105,3 +112,33 @@ class ModelData(models.Model):
     def get_latest_model_data(cls, name):
         """Get the latest version of model data"""
         return cls.objects.filter(name=name).order_by('-version').first()
+
+class BookNeighbor(models.Model):
+    """Precomputed most-similar books, rewritten by each recommender training run"""
+    book = models.ForeignKey('books.Book', on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey('books.Book', on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()  # Blended content and co-interaction similarity
+    rank = models.PositiveSmallIntegerField()  # 0 is the most similar
+
+    class Meta:
+        db_table = 'book_neighbors'
+        constraints = [
+            # Also the (book_id, rank) index that similar() reads with a range scan
+            models.UniqueConstraint(fields=['book', 'rank'], name='book_neighbors_book_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.neighbor_id} is neighbor #{self.rank} of {self.book_id}"
+
+    @classmethod
+    def replace_all(cls, rows, batch_size=5000):
+        """Swap in a new neighbor table from (book_id, neighbor_id, score, rank) rows"""
+        with transaction.atomic():
+            cls.objects.all().delete()
+            batch = []
+            for book_id, neighbor_id, score, rank in rows:
+                batch.append(cls(book_id=book_id, neighbor_id=neighbor_id, score=score, rank=rank))
+                if len(batch) >= batch_size:
+                    cls.objects.bulk_create(batch)
+                    batch = []
+            cls.objects.bulk_create(batch)
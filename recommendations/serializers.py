@@ -2,32 +2,39 @@ from rest_framework import serializers
 from .models import Recommendation, RecommendationItem, UserActivity
 from books.serializers import BookSerializer
 from users.serializers import UserSerializer
+from iqraa.serializers import DynamicFieldsMixin
 
-class UserActivitySerializer(serializers.ModelSerializer):
-    book_details = BookSerializer(source='book', read_only=True)
+class UserActivitySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    book_details = BookSerializer(source='book', read_only=True, compact=True)
     
     class Meta:
         model = UserActivity
         fields = ['id', 'user', 'book', 'book_details', 'view_count', 
                  'last_viewed', 'is_favorite', 'interaction_score']
         read_only_fields = ['view_count', 'last_viewed', 'interaction_score']
+        expandable_fields = {
+            'book_details': (BookSerializer, {'source': 'book', 'read_only': True}),
+        }
 
-class RecommendationItemSerializer(serializers.ModelSerializer):
-    book_details = BookSerializer(source='book', read_only=True)
+class RecommendationItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    book_details = BookSerializer(source='book', read_only=True, compact=True)
     
     class Meta:
         model = RecommendationItem
         fields = ['id', 'book', 'book_details', 'relevance_score', 
                  'position', 'reason']
+        expandable_fields = {
+            'book_details': (BookSerializer, {'source': 'book', 'read_only': True}),
+        }
 
-class RecommendationSerializer(serializers.ModelSerializer):
+class RecommendationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user_details = UserSerializer(source='user', read_only=True)
     items = RecommendationItemSerializer(
         source='recommendationitem_set',
         many=True,
         read_only=True
     )
-    source_book_details = BookSerializer(source='source_book', read_only=True)
+    source_book_details = BookSerializer(source='source_book', read_only=True, compact=True)
     
     class Meta:
         model = Recommendation
@@ -35,6 +42,14 @@ class RecommendationSerializer(serializers.ModelSerializer):
                  'date_generated', 'recommendation_type', 
                  'is_active', 'source_book', 'source_book_details']
         read_only_fields = ['date_generated']
+        expandable_fields = {
+            # ?expand=items renders full book details inside every item
+            'items': (RecommendationItemSerializer, {
+                'source': 'recommendationitem_set', 'many': True,
+                'read_only': True, 'expand': ['book_details'],
+            }),
+            'source_book_details': (BookSerializer, {'source': 'source_book', 'read_only': True}),
+        }
 
     def create(self, validated_data):
         items_data = self.context.get('items', [])
@@ -1,3 +1,112 @@
-from django.test import TestCase
+from decimal import Decimal
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+from books.models import Book
+from iqraa.testing import QueryPlanAssertions, seed_users_and_books
+from users.models import CustomUser
+from .ml_model import BookRecommender, SentimentAnalyzer, score_text
+from .models import BookNeighbor, ModelData, UserActivity
 
-# Create your tests here.
+class UserActivityQueryPlanTest(QueryPlanAssertions, TestCase):
+    """Recent-activity and favorite lookups read the user's index range in order"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user_ids, book_ids = seed_users_and_books(users=50, books=1000)
+        with connection.cursor() as cursor:
+            # Every user has looked at every book; one in ten is a favorite
+            cursor.execute("""
+                INSERT INTO user_activities (user_id, book_id, view_count, last_viewed,
+                                             is_favorite, interaction_score)
+                SELECT user_id, book_id, 1, now() - (user_id * 1000 + book_id) * interval '1 second',
+                       book_id %% 10 = 0, 0
+                FROM unnest(%s::bigint[]) user_id, unnest(%s::bigint[]) book_id
+            """, [user_ids, book_ids])
+            cursor.execute('ANALYZE user_activities')
+        cls.user = CustomUser.objects.get(pk=user_ids[0])
+
+    def test_activity_list(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        statements = self.captured(
+            lambda: client.get('/api/user-activities/', secure=True), 'user_activities'
+        )
+        for sql in statements:
+            self.assertIndexPlan(sql, 'user_activities', 'activities_user_recent_idx')
+
+    def test_last_viewed(self):
+        # RecommendationViewSet.generate
+        last_activity = UserActivity.objects.filter(user=self.user).order_by('-last_viewed', 'id')[:1]
+        self.assertIndexPlan(last_activity, 'user_activities', 'activities_user_recent_idx')
+
+    def test_recent_favorites(self):
+        # RecommendationViewSet.similar_to_favorites
+        favorites = UserActivity.objects.filter(
+            user=self.user, is_favorite=True
+        ).select_related('book').order_by('-last_viewed', 'id')[:3]
+        self.assertIndexPlan(favorites, 'user_activities', 'activities_user_favorites_idx')
+
+class SentimentParityTest(SimpleTestCase):
+    """score_text reproduces NLTK's SentimentIntensityAnalyzer compound scores"""
+    # Compound scores from nltk.sentiment.vader.SentimentIntensityAnalyzer (NLTK 3.10)
+    EXPECTED = [
+        ('Never so disappointed by an author I used to admire.', 0.7069),
+        ('Good!!!!!', 0.0),
+        ('ok?? ok??? ok????', 0.6553),
+        ('A wonderful, moving story.', 0.5719),
+        ('The plot was not good.', -0.3412),
+        ("I didn't hate it, but the ending was terrible.", -0.4855),
+        ('The characters are VERY good but the pacing is slow.', 0.3534),
+        ('This book is the bomb!', 0.6476),
+        ('It was kind of boring.', -0.3804),
+        ('At least it was short, the least enjoyable read this year.', -0.3412),
+        ('Never this happy with a purchase :)', 0.0005),
+        ('Hardly a masterpiece, barely readable.', 0.5868),
+        ('Yeah right, a classic.', 0.296),
+        ('great great great GREAT', 0.9592),
+        ('Absolutely brilliant!!! Could not put it down.', 0.7157),
+        ('(good) read', 0.0),
+        ('', 0.0),
+    ]
+
+    def test_sentiment_parity(self):
+        for text, expected in self.EXPECTED:
+            with self.subTest(text=text):
+                self.assertEqual(score_text(text), expected)
+
+    def test_batch_matches_single(self):
+        texts = [text for text, _ in self.EXPECTED]
+        self.assertEqual(SentimentAnalyzer(workers=1).analyze_batch(texts),
+                         [expected for _, expected in self.EXPECTED])
+
+class BookRecommenderTest(TestCase):
+    """Training stores neighbors, not a dense similarity matrix"""
+
+    def setUp(self):
+        self.dragons = [
+            Book.objects.create(title=title, author='Ann Smith', genre='Fantasy',
+                                isbn=f'{number:010d}', price=Decimal('10.00'),
+                                summary='Dragons and their riders')
+            for number, title in enumerate(['Dragon Tales', 'Dragon Riders', 'Dragon Eggs'], 1)
+        ]
+        self.other = Book.objects.create(title='Tax Law', author='Bo Jones', genre='Law',
+                                         isbn='0000000004', price=Decimal('10.00'))
+
+    def test_train_and_recommend(self):
+        recommender = BookRecommender()
+        recommender.NEIGHBOR_BLOCK = 2
+        recommender.train_model()
+        self.assertNotIn('similarity_matrix',
+                         ModelData.get_latest_model_data(BookRecommender.MODEL_NAME).data)
+
+        first = self.dragons[0]
+        neighbors = list(BookNeighbor.objects.filter(book=first).order_by('rank')
+                         .values_list('neighbor_id', flat=True))
+        self.assertEqual(set(neighbors), {book.pk for book in self.dragons[1:]})
+
+        loaded = BookRecommender()
+        self.assertEqual(loaded.get_recommendations(str(first.pk), num_recommendations=2),
+                         [str(book_id) for book_id in neighbors])
+        with self.assertRaises(ValueError):
+            loaded.get_recommendations('0')
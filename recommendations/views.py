@@ -12,14 +12,18 @@ from books.models import Book
 from reviews.models import Review
 from orders.models import Order
 from .ml_model import BookRecommender
+from iqraa.pagination import PaginatedActionMixin
 import os
 
 class UserActivityViewSet(viewsets.ModelViewSet):
     serializer_class = UserActivitySerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordering = ['-last_viewed', 'id']
 
     def get_queryset(self):
-        return UserActivity.objects.filter(user=self.request.user)
+        return (UserActivity.objects.filter(user=self.request.user)
+                .select_related('book')
+                .prefetch_related('book__categories'))
 
     @action(detail=True, methods=['post'])
     def toggle_favorite(self, request, pk=None):
@@ -36,7 +40,7 @@ class UserActivityViewSet(viewsets.ModelViewSet):
         activity.save()
         return Response({'status': 'view recorded'})
 
-class RecommendationViewSet(viewsets.ModelViewSet):
+class RecommendationViewSet(PaginatedActionMixin, viewsets.ModelViewSet):
     serializer_class = RecommendationSerializer
     permission_classes = [permissions.IsAuthenticated]
     _recommender = None
@@ -52,6 +56,9 @@ class RecommendationViewSet(viewsets.ModelViewSet):
         return Recommendation.objects.filter(
             user=self.request.user,
             is_active=True
+        ).select_related('user', 'source_book').prefetch_related(
+            'source_book__categories',
+            'recommendationitem_set__book__categories',
         )
 
     def create_recommendation(self, books, recommendation_type, source_book=None):
@@ -123,7 +130,7 @@ class RecommendationViewSet(viewsets.ModelViewSet):
         # Get user's recent activity
         last_activity = UserActivity.objects.filter(
             user=request.user
-        ).order_by('-last_viewed').first()
+        ).order_by('-last_viewed', 'id').first()
         
         if last_activity:
             # Generate recommendations based on last viewed book
@@ -210,10 +217,11 @@ class RecommendationViewSet(viewsets.ModelViewSet):
     @action(detail=False)
     def similar_to_favorites(self, request):
         """Get recommendations based on user's favorite books"""
-        favorites = UserActivity.objects.filter(
+        # The three most recently viewed favorites, from activities_user_favorites_idx
+        favorites = list(UserActivity.objects.filter(
             user=request.user,
             is_favorite=True
-        )
+        ).select_related('book').order_by('-last_viewed', 'id')[:3])
         
         if not favorites:
             return Response(
@@ -224,7 +232,7 @@ class RecommendationViewSet(viewsets.ModelViewSet):
         recommended_books = []
         seen_books = set()
         
-        for favorite in favorites[:3]:
+        for favorite in favorites:
             similar_ids = self.recommender.get_recommendations(
                 str(favorite.book.id),
                 num_recommendations=3,
@@ -242,7 +250,7 @@ class RecommendationViewSet(viewsets.ModelViewSet):
         recommendation = self.create_recommendation(
             recommended_books,
             'SIMILAR',
-            favorites.first().book
+            favorites[0].book
         )
         
         serializer = self.get_serializer(recommendation)
@@ -286,6 +294,4 @@ class RecommendationViewSet(viewsets.ModelViewSet):
         self.similar_to_favorites(request)
         
         # Return all active recommendations
-        recommendations = self.get_queryset()
-        serializer = self.get_serializer(recommendations, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(self.get_queryset())
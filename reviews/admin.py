@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Review
+from .models import Review, BookReviewSummary
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
@@ -19,3 +19,11 @@ class ReviewAdmin(admin.ModelAdmin):
             'fields': ('comment', 'date_reviewed')
         })
     )
+
+@admin.register(BookReviewSummary)
+class BookReviewSummaryAdmin(admin.ModelAdmin):
+    list_display = ('book', 'review_count', 'average_rating', 'sentiment_count', 'average_sentiment')
+    search_fields = ('book__title', 'book__isbn')
+    raw_id_fields = ('book',)
+    readonly_fields = BookReviewSummary.COUNTER_FIELDS
+    list_per_page = 20
@@ -0,0 +1,10 @@
+from reviews.models import Review
+from reviews.views import ReviewViewSet
+from iqraa.export import ExportCommand
+
+class Command(ExportCommand):
+    help = 'Stream all reviews as CSV or JSON lines'
+    fields = ReviewViewSet.export_fields
+
+    def get_queryset(self):
+        return Review.objects.all()
@@ -1,89 +1,157 @@
 from django.core.management.base import BaseCommand
-import csv
-from reviews.models import Review
-from books.models import Book
 from django.contrib.auth import get_user_model
-from datetime import datetime
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from reviews.models import Review, BookReviewSummary
+from books.models import Book
+from recommendations.ml_model import SentimentAnalyzer
+from iqraa.partitioning import ensure_partitions
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime, timezone as dt_timezone
+import csv
 import os
+import time
 
 User = get_user_model()
+DEFAULT_USERNAME = 'default_user'
 
 class Command(BaseCommand):
-    help = 'Import reviews from CSV file'
+    help = 'Import reviews from the Amazon book reviews CSV export, in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default='bookstore_data.csv',
+                            help='CSV file to import')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows parsed and inserted per batch')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Sentiment scoring processes (default: CPU count)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Run the whole import in one transaction and roll it back')
 
-    def handle(self, *args, **kwargs):
-        csv_path = 'bookstore_data.csv'
+    def handle(self, *args, **options):
+        csv_path = options['file']
         if not os.path.exists(csv_path):
             self.stdout.write(self.style.ERROR(f'CSV file not found at {csv_path}'))
             return
 
-        reviews_created = 0
-        reviews_skipped = 0
+        self.created = self.skipped = 0
+        start = time.perf_counter()
 
-        # Make sure we have at least one user in the system
-        default_user, created = User.objects.get_or_create(
-            username='default_user',
-            defaults={
-                'email': 'default@example.com',
-                'is_active': True
-            }
-        )
+        # Each batch commits on its own, so a long import holds no locks or snapshot
+        # for its whole run, and an interrupted one is resumed by running it again
+        # (reviews already stored are skipped). Only a dry run needs one transaction.
+        with transaction.atomic() if options['dry_run'] else nullcontext():
+            # One query for the whole catalog instead of a lookup per row
+            self.book_ids = dict(Book.objects.values_list('isbn', 'id').iterator(chunk_size=10000))
+            analyzer = SentimentAnalyzer(workers=options['workers'])
+            with analyzer.create_pool() as self.pool:
+                self.analyzer = analyzer
+                with open(csv_path, 'r', encoding='utf-8', newline='') as file:
+                    batch = []
+                    for row in csv.DictReader(file):
+                        review = self.parse_row(row)
+                        if review is None:
+                            self.skipped += 1
+                            continue
+                        batch.append(review)
+                        if len(batch) >= options['batch_size']:
+                            self.insert(batch, start)
+                            batch = []
+                    self.insert(batch, start)
 
-        with open(csv_path, 'r', encoding='utf-8') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                try:
-                    # Skip if no review text or book ID
-                    if not row.get('review/text') or not row.get('Id'):
-                        reviews_skipped += 1
-                        continue
-
-                    # Try to get the book
-                    try:
-                        book = Book.objects.get(isbn=row['Id'])
-                    except Book.DoesNotExist:
-                        reviews_skipped += 1
-                        continue
-
-                    # Convert review time from timestamp
-                    try:
-                        review_time = datetime.fromtimestamp(float(row['review/time']))
-                    except (ValueError, TypeError):
-                        review_time = datetime.now()
-
-                    # Convert score
-                    try:
-                        score = int(float(row['review/score']))
-                    except (ValueError, TypeError):
-                        score = 3  # Default score if invalid
-
-                    # Create the review
-                    review = Review.objects.create(
-                        user=default_user,
-                        book=book,
-                        profile_name=row.get('profileName', 'Anonymous'),
-                        helpfulness=row.get('review/helpfulness', ''),
-                        score=score,
-                        time=review_time,
-                        summary=row.get('review/summary', '')[:255],  # Truncate if too long
-                        text=row.get('review/text', '')
-                    )
-
-                    reviews_created += 1
-
-                    # Update book's rating
-                    book.update_rating(score)
-
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'Error importing review for book {row.get("Id", "Unknown")}: {str(e)}'
-                        )
-                    )
-                    reviews_skipped += 1
+            # Historical reviews land in the default partition; give their months partitions
+            ensure_partitions('reviews')
 
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'Successfully imported reviews. Created: {reviews_created}, Skipped: {reviews_skipped}'
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Dry run, nothing written. Would have imported" if options["dry_run"] else "Successfully imported"} '
+            f'reviews. Created: {self.created}, Skipped: {self.skipped} '
+            f'({(self.created + self.skipped) / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+
+    def parse_row(self, row):
+        """Map a CSV row to review values, or None if it can't be imported"""
+        book_id = self.book_ids.get((row.get('Id') or '').strip())
+        comment = (row.get('review/text') or row.get('review/summary') or '').strip()
+        if book_id is None or not comment:
+            return None
+        try:
+            rating = min(max(int(float(row['review/score'])), 1), 5)
+        except (KeyError, ValueError, TypeError):
+            rating = 3
+        try:
+            date_reviewed = datetime.fromtimestamp(float(row['review/time']), tz=dt_timezone.utc)
+        except (KeyError, ValueError, TypeError, OverflowError):
+            date_reviewed = timezone.now()
+        return {
+            'username': (row.get('User_id') or '').strip()[:150] or DEFAULT_USERNAME,
+            'book_id': book_id,
+            'rating': rating,
+            'comment': comment,
+            'date_reviewed': date_reviewed,
+        }
+
+    def resolve_users(self, usernames):
+        """Map usernames to ids, creating missing reviewer accounts in one insert"""
+        users = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        missing = [username for username in usernames if username not in users]
+        if missing:
+            User.objects.bulk_create(
+                [User(username=username, password=make_password(None)) for username in missing],
+                ignore_conflicts=True,
             )
-        )
\ No newline at end of file
+            users.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        return users
+
+    def insert(self, batch, start):
+        if not batch:
+            return
+        users = self.resolve_users({review['username'] for review in batch})
+
+        # One review per user and book, across this batch and what is already stored
+        pairs = {(users[review['username']], review['book_id']) for review in batch}
+        existing = set(Review.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            book_id__in={book_id for _, book_id in pairs},
+        ).values_list('user_id', 'book_id'))
+
+        reviews = []
+        for review in batch:
+            pair = (users[review['username']], review['book_id'])
+            if pair in existing:
+                self.skipped += 1
+                continue
+            existing.add(pair)
+            reviews.append(Review(
+                user_id=pair[0],
+                book_id=review['book_id'],
+                rating=review['rating'],
+                comment=review['comment'],
+                date_reviewed=review['date_reviewed'],
+            ))
+
+        scores = self.analyzer.analyze_batch((review.comment for review in reviews), pool=self.pool)
+        # book id -> (review count, rating sum)
+        rating_totals = defaultdict(lambda: (0, 0))
+        for review, score in zip(reviews, scores):
+            review.sentiment = score
+            count, total = rating_totals[review.book_id]
+            rating_totals[review.book_id] = (count + 1, total + review.rating)
+
+        with transaction.atomic():
+            Review.objects.bulk_create(reviews, batch_size=1000)
+            # bulk_create bypasses Review.save, so fold the batch into the aggregates here
+            BookReviewSummary.record_bulk(reviews)
+            Book.add_ratings_bulk(rating_totals)
+
+        self.created += len(reviews)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'Imported {self.created} reviews, '
+            f'{(self.created + self.skipped) / elapsed if elapsed else 0:.0f} rows/s'
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from reviews.models import BookReviewSummary
+import time
+
+class Command(BaseCommand):
+    help = ("Rebuild review summaries from the reviews table in grouped queries and set "
+            "every book's rating counters to its catalog ratings plus its reviews "
+            "(after imports, or to repair drift)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, action='append', dest='books',
+                            help='Only recompute this book id (repeatable)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        summaries = BookReviewSummary.rebuild(options['books'])
+        changed = BookReviewSummary.sync_book_ratings(options['books'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {summaries} review summaries and updated {changed} books '
+            f'in {time.perf_counter() - start:.1f}s'
+        ))
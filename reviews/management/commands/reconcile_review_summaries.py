@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from reviews.models import BookReviewSummary
+
+class Command(BaseCommand):
+    help = 'Recompute per-book review summaries from the reviews table and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, action='append', dest='books',
+                            help='Only reconcile this book id (repeatable)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted summaries without writing them')
+
+    def handle(self, *args, **options):
+        book_ids = options['books']
+        fresh = {summary.book_id: summary for summary in BookReviewSummary.compute(book_ids)}
+
+        stored = BookReviewSummary.objects.all()
+        if book_ids:
+            stored = stored.filter(book_id__in=book_ids)
+        stored = {summary.book_id: summary for summary in stored}
+
+        drifted = []
+        for book_id in fresh.keys() | stored.keys():
+            expected = fresh.get(book_id) or BookReviewSummary(book_id=book_id)
+            actual = stored.get(book_id) or BookReviewSummary(book_id=book_id)
+            if any(
+                abs(getattr(expected, field) - getattr(actual, field)) > 1e-6
+                for field in BookReviewSummary.COUNTER_FIELDS
+            ):
+                drifted.append(book_id)
+
+        for book_id in sorted(drifted):
+            self.stdout.write(f'Summary for book {book_id} has drifted')
+
+        if drifted and not options['dry_run']:
+            BookReviewSummary.rebuild(drifted)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Checked {len(fresh.keys() | stored.keys())} summaries. '
+                f'Drifted: {len(drifted)}{" (not repaired, dry run)" if options["dry_run"] else ""}'
+            )
+        )
@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from reviews.models import Review, BookReviewSummary
+from recommendations.ml_model import SentimentAnalyzer
+import json
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Rescore the stored sentiment of every review (resumable, rate limited)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Reviews read, scored and written per chunk')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Scoring processes (default: CPU count)')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Maximum reviews per second written back (0 = unlimited)')
+        parser.add_argument('--checkpoint', default='rescore_sentiment.checkpoint.json',
+                            help='File recording the last rescored review id')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start from the first review')
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Only score reviews that have no stored sentiment')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        rate = options['rate']
+        checkpoint_path = options['checkpoint']
+
+        last_id = 0
+        processed = 0
+        if not options['restart'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as file:
+                checkpoint = json.load(file)
+            last_id = checkpoint['last_id']
+            processed = checkpoint['processed']
+            self.stdout.write(f'Resuming after review {last_id} ({processed} already rescored)')
+
+        queryset = Review.objects.all()
+        if options['only_missing']:
+            queryset = queryset.filter(sentiment__isnull=True)
+
+        analyzer = SentimentAnalyzer(workers=options['workers'])
+        started = time.monotonic()
+        session_processed = 0
+
+        with analyzer.create_pool() as pool:
+            while True:
+                # Keyset pagination on the primary key keeps every chunk an index range scan
+                rows = list(
+                    queryset.filter(id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', 'comment', 'sentiment')[:chunk_size]
+                )
+                if not rows:
+                    break
+
+                scores = analyzer.analyze_batch((comment for _, comment, _ in rows), pool=pool)
+                # Only rows whose score changes are written, and they get a new
+                # updated_at so ETags and Last-Modified built from it change too
+                now = timezone.now()
+                reviews = []
+                for (review_id, comment, sentiment), score in zip(rows, scores):
+                    score = score if comment else None
+                    if score != sentiment:
+                        reviews.append(Review(id=review_id, sentiment=score, updated_at=now))
+                with transaction.atomic():
+                    Review.objects.bulk_update(reviews, ['sentiment', 'updated_at'], batch_size=1000)
+
+                last_id = rows[-1][0]
+                processed += len(rows)
+                session_processed += len(rows)
+                self.save_checkpoint(checkpoint_path, last_id, processed)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Rescored {processed} reviews (up to id {last_id}), '
+                    f'{session_processed / elapsed if elapsed else 0:.0f} reviews/s'
+                )
+
+                if rate:
+                    # Sleep off any time we are ahead of the allowed write rate
+                    ahead = session_processed / rate - elapsed
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        # bulk_update bypasses Review.save, so refresh the summaries' sentiment buckets
+        BookReviewSummary.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rescored reviews. Total: {processed}')
+        )
+
+    def save_checkpoint(self, path, last_id, processed):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'last_id': last_id, 'processed': processed}, file)
+        os.replace(tmp_path, path)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='sentiment',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
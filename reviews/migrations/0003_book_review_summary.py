@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+POPULATE_SUMMARIES = """
+INSERT INTO book_review_summaries (
+    book_id, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5,
+    sentiment_count, sentiment_sum, sentiment_positive, sentiment_neutral, sentiment_negative
+)
+SELECT
+    book_id,
+    COUNT(*),
+    SUM(rating),
+    COUNT(*) FILTER (WHERE rating = 1),
+    COUNT(*) FILTER (WHERE rating = 2),
+    COUNT(*) FILTER (WHERE rating = 3),
+    COUNT(*) FILTER (WHERE rating = 4),
+    COUNT(*) FILTER (WHERE rating = 5),
+    COUNT(sentiment),
+    COALESCE(SUM(sentiment), 0),
+    COUNT(*) FILTER (WHERE sentiment >= 0.05),
+    COUNT(*) FILTER (WHERE sentiment > -0.05 AND sentiment < 0.05),
+    COUNT(*) FILTER (WHERE sentiment <= -0.05)
+FROM reviews
+GROUP BY book_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_alter_book_author_alter_book_title'),
+        ('reviews', '0002_review_sentiment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookReviewSummary',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_summary', serialize=False, to='books.book')),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_1', models.IntegerField(default=0)),
+                ('rating_2', models.IntegerField(default=0)),
+                ('rating_3', models.IntegerField(default=0)),
+                ('rating_4', models.IntegerField(default=0)),
+                ('rating_5', models.IntegerField(default=0)),
+                ('sentiment_count', models.IntegerField(default=0)),
+                ('sentiment_sum', models.FloatField(default=0)),
+                ('sentiment_positive', models.IntegerField(default=0)),
+                ('sentiment_neutral', models.IntegerField(default=0)),
+                ('sentiment_negative', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'book review summaries',
+                'db_table': 'book_review_summaries',
+            },
+        ),
+        migrations.RunSQL(POPULATE_SUMMARIES, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_keyset_pagination_indexes'),
+        ('reviews', '0003_book_review_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['-date_reviewed', 'id'], name='reviews_date_re_e6f9c6_idx'),
+        ),
+    ]
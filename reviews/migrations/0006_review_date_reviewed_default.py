@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='review',
+            name='date_reviewed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_import_hash'),
+        ('reviews', '0006_review_date_reviewed_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', '-date_reviewed', 'id'], name='reviews_book_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', '-date_reviewed', 'id'], name='reviews_user_recent_idx'),
+        ),
+    ]
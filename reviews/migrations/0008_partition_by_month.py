@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:24
+
+from django.db import migrations
+from iqraa.partitioning import partition_table, unpartition_table
+
+
+def partition_reviews(apps, schema_editor):
+    partition_table('reviews', using=schema_editor.connection)
+
+
+def unpartition_reviews(apps, schema_editor):
+    unpartition_table('reviews', using=schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_reviews, unpartition_reviews),
+    ]
@@ -1,18 +1,242 @@
-from django.db import models
+from collections import defaultdict
+from django.db import connection, models, transaction
+from django.db.models import Count, F, Q, Sum
 from django.conf import settings
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
+from books.models import Book
+from books.cache import RATINGS, bump_catalog_version
 
 class Review(models.Model):
+    """The table is partitioned by month on date_reviewed (see iqraa.partitioning)"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     book = models.ForeignKey('books.Book', on_delete=models.CASCADE)
     rating = models.IntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     comment = models.TextField(blank=True)
-    date_reviewed = models.DateTimeField(auto_now_add=True)
+    sentiment = models.FloatField(null=True, blank=True)  # VADER compound score of the comment
+    date_reviewed = models.DateTimeField(default=timezone.now)  # Set explicitly by imports
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Review for {self.book.title} by {self.user.username}"
 
     class Meta:
         db_table = 'reviews'
+        indexes = [
+            models.Index(fields=['-date_reviewed', 'id']),
+            # Reviews of a book and reviews by a user, newest first
+            models.Index(fields=['book', '-date_reviewed', 'id'], name='reviews_book_recent_idx'),
+            models.Index(fields=['user', '-date_reviewed', 'id'], name='reviews_user_recent_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save the review and apply the change to its book's review summary"""
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                # Locked so concurrent edits of the review take their turns
+                # instead of both subtracting the same old values
+                previous = (Review.objects.select_for_update().filter(pk=self.pk)
+                            .values('book_id', 'rating', 'sentiment').first())
+            super().save(*args, **kwargs)
+            if previous:
+                BookReviewSummary.record(
+                    previous['book_id'], previous['rating'], previous['sentiment'], sign=-1
+                )
+            BookReviewSummary.record(self.book_id, self.rating, self.sentiment)
+
+            # Comment-only edits leave the book's rating counters alone
+            if not previous or (previous['book_id'], previous['rating']) != (self.book_id, self.rating):
+                if previous:
+                    Book.add_ratings(previous['book_id'], -1, -previous['rating'])
+                Book.add_ratings(self.book_id, 1, self.rating)
+
+class BookReviewSummary(models.Model):
+    """Per-book review aggregates, maintained incrementally as reviews change"""
+    book = models.OneToOneField(
+        'books.Book',
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='review_summary'
+    )
+    review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+    sentiment_count = models.IntegerField(default=0)  # Reviews with a scored comment
+    sentiment_sum = models.FloatField(default=0)
+    sentiment_positive = models.IntegerField(default=0)
+    sentiment_neutral = models.IntegerField(default=0)
+    sentiment_negative = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = [
+        'review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4',
+        'rating_5', 'sentiment_count', 'sentiment_sum', 'sentiment_positive',
+        'sentiment_neutral', 'sentiment_negative',
+    ]
+
+    class Meta:
+        db_table = 'book_review_summaries'
+        verbose_name_plural = 'book review summaries'
+
+    def __str__(self):
+        return f"Review summary for book {self.book_id}"
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.review_count if self.review_count else 0
+
+    @property
+    def average_sentiment(self):
+        return self.sentiment_sum / self.sentiment_count if self.sentiment_count else 0
+
+    @property
+    def rating_distribution(self):
+        return {str(score): getattr(self, f'rating_{score}') for score in range(1, 6)}
+
+    @property
+    def sentiment_distribution(self):
+        return {
+            "positive": self.sentiment_positive,
+            "neutral": self.sentiment_neutral,
+            "negative": self.sentiment_negative,
+        }
+
+    @classmethod
+    def record(cls, book_id, rating, sentiment, sign=1):
+        """Add (sign=1) or remove (sign=-1) one review's contribution with atomic increments"""
+        from recommendations.ml_model import SentimentAnalyzer
+
+        changes = {
+            'review_count': F('review_count') + sign,
+            'rating_sum': F('rating_sum') + sign * rating,
+            f'rating_{rating}': F(f'rating_{rating}') + sign,
+        }
+        if sentiment is not None:
+            bucket = f'sentiment_{SentimentAnalyzer.interpret(sentiment)}'
+            changes['sentiment_count'] = F('sentiment_count') + sign
+            changes['sentiment_sum'] = F('sentiment_sum') + sign * sentiment
+            changes[bucket] = F(bucket) + sign
+
+        with transaction.atomic():
+            if sign > 0:
+                cls.objects.get_or_create(book_id=book_id)
+            cls.objects.filter(book_id=book_id).update(**changes)
+
+    @classmethod
+    def record_bulk(cls, reviews):
+        """record() for many new reviews: one upsert adding each book's totals to its summary"""
+        from recommendations.ml_model import SentimentAnalyzer
+
+        totals = defaultdict(lambda: dict.fromkeys(cls.COUNTER_FIELDS, 0))
+        for review in reviews:
+            book = totals[review.book_id]
+            book['review_count'] += 1
+            book['rating_sum'] += review.rating
+            book[f'rating_{review.rating}'] += 1
+            if review.sentiment is not None:
+                book['sentiment_count'] += 1
+                book['sentiment_sum'] += review.sentiment
+                book[f'sentiment_{SentimentAnalyzer.interpret(review.sentiment)}'] += 1
+        if not totals:
+            return
+
+        columns = ['book_id', *cls.COUNTER_FIELDS]
+        types = ['bigint' if column == 'book_id' else 'float8' if column == 'sentiment_sum'
+                 else 'integer' for column in columns]
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO book_review_summaries ({', '.join(columns)})
+                SELECT * FROM unnest({', '.join(f'%s::{type}[]' for type in types)})
+                ON CONFLICT (book_id) DO UPDATE SET {', '.join(
+                    f'{field} = book_review_summaries.{field} + EXCLUDED.{field}'
+                    for field in cls.COUNTER_FIELDS
+                )}
+            """, [list(totals)] + [
+                [book[field] for book in totals.values()] for field in cls.COUNTER_FIELDS
+            ])
+
+    @classmethod
+    def compute(cls, book_ids=None):
+        """Aggregate fresh summaries from the reviews table in one grouped query"""
+        from recommendations.ml_model import POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD
+
+        reviews = Review.objects.all()
+        if book_ids is not None:
+            reviews = reviews.filter(book_id__in=book_ids)
+        scored = Q(sentiment__isnull=False)
+        rows = reviews.values('book_id').annotate(
+            review_count=Count('id'),
+            rating_sum=Sum('rating'),
+            sentiment_count=Count('id', filter=scored),
+            sentiment_sum=Sum('sentiment', filter=scored, default=0.0),
+            sentiment_positive=Count('id', filter=Q(sentiment__gte=POSITIVE_THRESHOLD)),
+            sentiment_neutral=Count('id', filter=Q(
+                sentiment__gt=NEGATIVE_THRESHOLD, sentiment__lt=POSITIVE_THRESHOLD
+            )),
+            sentiment_negative=Count('id', filter=Q(sentiment__lte=NEGATIVE_THRESHOLD)),
+            **{
+                f'rating_{score}': Count('id', filter=Q(rating=score))
+                for score in range(1, 6)
+            }
+        ).order_by()
+        return [cls(**row) for row in rows]
+
+    @classmethod
+    def rebuild(cls, book_ids=None):
+        """Recompute summaries from scratch and upsert them; returns the number of rows written"""
+        summaries = cls.compute(book_ids)
+        with transaction.atomic():
+            stale = cls.objects.all()
+            if book_ids is not None:
+                stale = stale.filter(book_id__in=book_ids)
+            stale.exclude(book_id__in=[summary.book_id for summary in summaries]).delete()
+            cls.objects.bulk_create(
+                summaries,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['book'],
+                update_fields=cls.COUNTER_FIELDS,
+            )
+        return len(summaries)
+
+    @classmethod
+    def sync_book_ratings(cls, book_ids=None):
+        """Set books' rating counters to their catalog baseline plus their review summary
+
+        Returns the number of books changed. Books without reviews go back
+        to exactly their imported catalog ratings.
+        """
+        sql = """
+            UPDATE books SET
+                total_ratings = agg.total_ratings,
+                rating_sum = agg.rating_sum,
+                average_rating = CASE WHEN agg.total_ratings > 0
+                                      THEN agg.rating_sum / agg.total_ratings ELSE 0 END,
+                updated_at = now()
+            FROM (
+                SELECT book.id AS book_id,
+                       book.catalog_ratings + COALESCE(summary.review_count, 0) AS total_ratings,
+                       book.catalog_rating_sum + COALESCE(summary.rating_sum, 0) AS rating_sum
+                FROM books book
+                LEFT JOIN book_review_summaries summary ON summary.book_id = book.id
+            ) AS agg
+            WHERE books.id = agg.book_id
+              AND (books.total_ratings, books.rating_sum)
+                  IS DISTINCT FROM (agg.total_ratings, agg.rating_sum)
+        """
+        params = []
+        if book_ids is not None:
+            sql += ' AND books.id = ANY(%s)'
+            params.append(list(book_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            changed = cursor.rowcount
+        if changed:
+            bump_catalog_version(RATINGS)
+        return changed
@@ -2,12 +2,16 @@ from rest_framework import serializers
 from .models import Review
 from books.serializers import BookSerializer
 from users.serializers import UserSerializer
+from iqraa.serializers import DynamicFieldsMixin
 
-class ReviewSerializer(serializers.ModelSerializer):
-    book_details = BookSerializer(source='book', read_only=True)
+class ReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    book_details = BookSerializer(source='book', read_only=True, compact=True)
     user_details = UserSerializer(source='user', read_only=True)
     
     class Meta:
         model = Review
-        fields = ['id', 'user', 'user_details', 'book', 'book_details', 'rating', 'comment', 'date_reviewed']
-        read_only_fields = ['date_reviewed']
\ No newline at end of file
+        fields = ['id', 'user', 'user_details', 'book', 'book_details', 'rating', 'comment', 'sentiment', 'date_reviewed']
+        read_only_fields = ['user', 'date_reviewed', 'sentiment']
+        expandable_fields = {
+            'book_details': (BookSerializer, {'source': 'book', 'read_only': True}),
+        }
\ No newline at end of file
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Review, BookReviewSummary
+from books.models import Book
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_summary(sender, instance, **kwargs):
+    """Deletes (including cascades from books and users) run inside the collector's transaction"""
+    BookReviewSummary.record(instance.book_id, instance.rating, instance.sentiment, sign=-1)
+    Book.add_ratings(instance.book_id, -1, -instance.rating)
@@ -1,3 +1,432 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from books.models import Book, Category
+from recommendations.ml_model import score_text
+from iqraa.partitioning import detach_partitions
+from iqraa.testing import QueryPlanAssertions, seed_users_and_books
+from users.models import CustomUser
+from .models import BookReviewSummary, Review
 
-# Create your tests here.
+class ReviewQueryPlanTest(QueryPlanAssertions, TestCase):
+    """Per-book and per-user review lists read their composite indexes in order"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user_ids, book_ids = seed_users_and_books(users=50, books=50)
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO reviews (user_id, book_id, rating, comment, sentiment,
+                                     date_reviewed, updated_at)
+                SELECT users[1 + g %% cardinality(users)],
+                       books[1 + (g / cardinality(users)) %% cardinality(books)],
+                       1 + g %% 5, 'Review ' || g, 0, now() - g * interval '1 minute', now()
+                FROM generate_series(1, 50000) g,
+                     (SELECT %s::bigint[] AS users, %s::bigint[] AS books) ids
+            """, [user_ids, book_ids])
+            cursor.execute('ANALYZE reviews')
+        cls.user = CustomUser.objects.get(pk=user_ids[0])
+        cls.book_id = book_ids[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def reviews_sql(self, url):
+        return self.captured(lambda: self.client.get(url, secure=True), 'reviews')
+
+    def test_book_reviews(self):
+        # Both the validator query and the page query
+        for sql in self.reviews_sql(f'/api/reviews/?book={self.book_id}'):
+            self.assertIndexPlan(sql, 'reviews', 'reviews_book_recent_idx')
+
+    def test_my_reviews(self):
+        for sql in self.reviews_sql('/api/reviews/my_reviews/'):
+            self.assertIndexPlan(sql, 'reviews', 'reviews_user_recent_idx')
+
+    def test_user_review_history(self):
+        for sql in self.reviews_sql(f'/api/users/{self.user.pk}/review_history/'):
+            self.assertIndexPlan(sql, 'reviews', 'reviews_user_recent_idx')
+
+class ReviewQueryCountTest(TestCase):
+    """Review lists load their books, categories and users up front"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='reader', password='secret')
+        category = Category.objects.create(name='Fantasy')
+        for number in range(1, 41):
+            book = Book.objects.create(title=f'Book {number}', author='Author', genre='Fiction',
+                                       isbn=f'{number:010d}', price=Decimal('10.00'))
+            book.categories.add(category)
+            Review.objects.create(user=cls.user, book=book, rating=number % 5 + 1)
+
+    def test_recent_is_constant_in_limit(self):
+        client = APIClient()
+        for limit in (5, 40):
+            # The reviews with their books and users, then the categories
+            with self.assertNumQueries(2):
+                response = client.get(f'/api/reviews/recent/?limit={limit}', secure=True)
+            self.assertEqual(len(response.data), limit)
+            self.assertEqual(response.data[0]['book_details']['categories'][0]['name'], 'Fantasy')
+
+class ReviewSentimentFilterTest(TestCase):
+    """?sentiment= buckets reviews by their stored score"""
+
+    def setUp(self):
+        self.client = APIClient()
+        book = Book.objects.create(title='Title', author='Author', genre='Fiction',
+                                   isbn='0000000001', price=Decimal('10.00'))
+        self.reviews = {}
+        for name, sentiment in [('positive', 0.6), ('negative', -0.5), ('neutral', 0.0),
+                                ('unscored', None)]:
+            user = CustomUser.objects.create_user(username=name, password='secret')
+            self.reviews[name] = Review.objects.create(
+                user=user, book=book, rating=3, comment='' if sentiment is None else name,
+                sentiment=sentiment,
+            ).pk
+
+    def filtered(self, sentiment):
+        response = self.client.get(f'/api/reviews/?sentiment={sentiment}', secure=True)
+        return {review['id'] for review in response.data['results']}
+
+    def test_buckets(self):
+        self.assertEqual(self.filtered('positive'), {self.reviews['positive']})
+        self.assertEqual(self.filtered('negative'), {self.reviews['negative']})
+        # Reviews without a scored comment count as neutral
+        self.assertEqual(self.filtered('neutral'), {self.reviews['neutral'], self.reviews['unscored']})
+
+class RescoreSentimentTest(TestCase):
+    """rescore_sentiment rewrites changed scores and their validators"""
+
+    def setUp(self):
+        book = Book.objects.create(title='Title', author='Author', genre='Fiction',
+                                   isbn='0000000001', price=Decimal('10.00'))
+        self.stale, self.current = [
+            Review.objects.create(
+                user=CustomUser.objects.create_user(username=name, password='secret'),
+                book=book, rating=4, comment='A wonderful, moving story',
+                sentiment=score_text('A wonderful, moving story'),
+            )
+            for name in ('stale', 'current')
+        ]
+        Review.objects.filter(pk=self.stale.pk).update(sentiment=-0.9)
+        self.stale.refresh_from_db()
+        self.current.refresh_from_db()
+
+    def test_rescore(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        call_command('rescore_sentiment', workers=1, stdout=StringIO(),
+                     checkpoint=os.path.join(directory, 'checkpoint.json'))
+
+        stale = Review.objects.get(pk=self.stale.pk)
+        current = Review.objects.get(pk=self.current.pk)
+        self.assertAlmostEqual(stale.sentiment, score_text('A wonderful, moving story'))
+        self.assertGreater(stale.updated_at, self.stale.updated_at)
+        self.assertEqual(current.updated_at, self.current.updated_at)
+
+class RecomputeRatingsTest(TestCase):
+    """Repaired counters are the catalog baseline plus the reviews"""
+
+    def setUp(self):
+        self.reviewed, self.unreviewed = [
+            Book.objects.create(title=f'Book {number}', author='Author', genre='Fiction',
+                                isbn=f'{number:010d}', price=Decimal('10.00'),
+                                average_rating=4.0, total_ratings=100, rating_sum=400.0,
+                                catalog_ratings=100, catalog_rating_sum=400.0)
+            for number in (1, 2)
+        ]
+        for name, rating in [('first', 5), ('second', 2)]:
+            Review.objects.create(user=CustomUser.objects.create_user(username=name, password='secret'),
+                                  book=self.reviewed, rating=rating, comment='')
+
+    def counters(self, book):
+        book.refresh_from_db()
+        return book.total_ratings, book.rating_sum, round(book.average_rating, 4)
+
+    def test_review_counters_add_to_catalog_ratings(self):
+        self.assertEqual(self.counters(self.reviewed), (102, 407.0, round(407 / 102, 4)))
+
+    def test_repair_keeps_catalog_ratings(self):
+        Book.objects.update(total_ratings=0, rating_sum=0, average_rating=0)
+        call_command('recompute_ratings', stdout=StringIO())
+        self.assertEqual(self.counters(self.reviewed), (102, 407.0, round(407 / 102, 4)))
+        self.assertEqual(self.counters(self.unreviewed), (100, 400.0, 4.0))
+
+class BookReviewSummaryTest(TestCase):
+    """Review saves, edits and deletes keep the book summaries equal to a fresh aggregate"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='secret')
+        self.books = [
+            Book.objects.create(title=f'Book {number}', author='Author', genre='Fiction',
+                                isbn=f'{number:010d}', price=Decimal('10.00'))
+            for number in (1, 2)
+        ]
+
+    def assertSummariesFresh(self):
+        fields = ['book_id', *BookReviewSummary.COUNTER_FIELDS]
+        stored = sorted(BookReviewSummary.objects.values_list(*fields))
+        fresh = sorted(tuple(getattr(summary, field) for field in fields)
+                       for summary in BookReviewSummary.compute())
+        # Books whose reviews are all gone keep a zeroed row
+        stored = [row for row in stored if row[1]]
+        self.assertEqual(stored, fresh)
+
+    def summary(self, book):
+        return BookReviewSummary.objects.get(book=book)
+
+    def test_create_update_delete(self):
+        first, second = self.books
+        positive = Review.objects.create(user=self.user, book=first, rating=5, sentiment=0.8)
+        negative = Review.objects.create(user=self.user, book=first, rating=2, sentiment=-0.6)
+        Review.objects.create(user=self.user, book=second, rating=3)
+        self.assertSummariesFresh()
+        summary = self.summary(first)
+        self.assertEqual((summary.review_count, summary.rating_sum), (2, 7))
+        self.assertEqual(summary.rating_distribution, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1})
+        self.assertEqual(summary.sentiment_distribution,
+                         {'positive': 1, 'neutral': 0, 'negative': 1})
+
+        # A new rating and score move the review between buckets
+        negative.rating = 4
+        negative.sentiment = 0.0
+        negative.save()
+        self.assertSummariesFresh()
+        self.assertEqual(self.summary(first).sentiment_distribution,
+                         {'positive': 1, 'neutral': 1, 'negative': 0})
+
+        # Moving a review to another book takes it out of the first summary
+        positive.book = second
+        positive.save()
+        self.assertSummariesFresh()
+        self.assertEqual(self.summary(second).review_count, 2)
+
+        positive.delete()
+        negative.delete()
+        self.assertSummariesFresh()
+        self.assertEqual(self.summary(first).review_count, 0)
+        self.assertEqual(self.summary(second).rating_sum, 3)
+
+    def test_stats_read_the_summaries(self):
+        for rating in (5, 4, 4):
+            Review.objects.create(user=self.user, book=self.books[0], rating=rating)
+        Review.objects.create(user=self.user, book=self.books[1], rating=1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(f'/api/reviews/stats/?book={self.books[0].pk}', secure=True)
+        self.assertEqual(response.data['total_reviews'], 3)
+        self.assertEqual(response.data['average_rating'], 4.33)
+        response = client.get('/api/reviews/stats/', secure=True)
+        self.assertEqual(response.data['total_reviews'], 4)
+        self.assertEqual(response.data['rating_distribution'],
+                         {'1': 1, '2': 0, '3': 0, '4': 2, '5': 1})
+
+    def test_reconcile_repairs_drift(self):
+        Review.objects.create(user=self.user, book=self.books[0], rating=5)
+        Review.objects.create(user=self.user, book=self.books[1], rating=3)
+        BookReviewSummary.objects.filter(book=self.books[0]).update(review_count=9, rating_5=0)
+
+        output = StringIO()
+        call_command('reconcile_review_summaries', dry_run=True, stdout=output)
+        self.assertIn(f'Summary for book {self.books[0].pk} has drifted', output.getvalue())
+        self.assertEqual(self.summary(self.books[0]).review_count, 9)
+
+        output = StringIO()
+        call_command('reconcile_review_summaries', stdout=output)
+        self.assertIn('Checked 2 summaries. Drifted: 1', output.getvalue())
+        self.assertSummariesFresh()
+        self.assertEqual(self.summary(self.books[0]).rating_5, 1)
+
+class ImportReviewsTest(TestCase):
+    """import_reviews commits batch by batch and keeps aggregates in step"""
+    HEADER = 'Id,User_id,review/score,review/time,review/text\n'
+    ROWS = [
+        '0000000001,A1,5,1262304000,Loved every page',
+        '0000000001,A2,2,1262304000,Dull and far too long',
+        '0000000002,A1,4,1262304000,A fine read',
+        '0000000001,A1,1,1262304000,Duplicate review of the same book',
+        '9999999999,A3,5,1262304000,Unknown book',
+    ]
+
+    def setUp(self):
+        self.books = [
+            Book.objects.create(title=f'Book {number}', author='Author', genre='Fiction',
+                                isbn=f'{number:010d}', price=Decimal('10.00'))
+            for number in (1, 2)
+        ]
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'reviews.csv')
+        with open(self.path, 'w') as file:
+            file.write(self.HEADER + ''.join(f'{row}\n' for row in self.ROWS))
+
+    def run_import(self, **options):
+        output = StringIO()
+        call_command('import_reviews', file=self.path, workers=1, batch_size=2,
+                     stdout=output, **options)
+        return output.getvalue()
+
+    @staticmethod
+    def counters(summaries):
+        return sorted((summary.book_id, summary.review_count, summary.rating_sum,
+                       summary.sentiment_count) for summary in summaries)
+
+    def test_import(self):
+        self.assertIn('Created: 3, Skipped: 2', self.run_import())
+        first = Book.objects.get(pk=self.books[0].pk)
+        self.assertEqual((first.total_ratings, first.rating_sum), (2, 7.0))
+        summary = BookReviewSummary.objects.get(book=first)
+        self.assertEqual((summary.review_count, summary.rating_5, summary.rating_2), (2, 1, 1))
+        self.assertEqual(summary.sentiment_count, 2)
+        self.assertEqual(self.counters(BookReviewSummary.objects.all()),
+                         self.counters(BookReviewSummary.compute()))
+
+        # Running it again (e.g. after an interruption) adds nothing
+        self.assertIn('Created: 0, Skipped: 5', self.run_import())
+        self.assertEqual(Review.objects.count(), 3)
+        first.refresh_from_db()
+        self.assertEqual(first.total_ratings, 2)
+
+    def test_batches_commit_separately(self):
+        with patch.object(Book, 'add_ratings_bulk', side_effect=[None, RuntimeError('boom')]):
+            with self.assertRaises(RuntimeError):
+                self.run_import()
+        self.assertEqual(Review.objects.count(), 2)
+        self.assertEqual(BookReviewSummary.objects.get(book=self.books[0]).review_count, 2)
+
+    def test_dry_run(self):
+        self.assertIn('Would have imported reviews. Created: 3', self.run_import(dry_run=True))
+        self.assertFalse(Review.objects.exists())
+        self.assertFalse(BookReviewSummary.objects.exists())
+
+class ReviewConditionalGetTest(TestCase):
+    """Review validators cover the review and the book it embeds"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.book = Book.objects.create(title='Title', author='Author', genre='Fiction',
+                                        isbn='0000000001', price=Decimal('10.00'))
+        self.review = Review.objects.create(
+            user=CustomUser.objects.create_user(username='reader', password='secret'),
+            book=self.book, rating=4, comment='Good', sentiment=-0.5,
+        )
+        self.url = f'/api/reviews/{self.review.pk}/'
+
+    def get(self, **headers):
+        return self.client.get(self.url, secure=True, headers=headers)
+
+    def test_validators(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+
+        self.book.title = 'New Title'
+        self.book.save()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.review.user.first_name = 'Renamed'
+        self.review.user.save()
+        response = self.get(if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user_details']['first_name'], 'Renamed')
+
+        # Rescoring changes the sentiment in the representation, so the validator too
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        call_command('rescore_sentiment', workers=1, stdout=StringIO(),
+                     checkpoint=os.path.join(directory, 'checkpoint.json'))
+        response = self.get(if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.data['sentiment'], score_text('Good'))
+
+    def test_list_validators_follow_the_reviewer(self):
+        url = f'/api/reviews/?book={self.book.pk}'
+        etag = self.client.get(url, secure=True)['ETag']
+        self.assertEqual(self.client.get(url, secure=True, headers={'if_none_match': etag}).status_code, 304)
+
+        self.review.user.username = 'renamed'
+        self.review.user.save()
+        response = self.client.get(url, secure=True, headers={'if_none_match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['user_details']['username'], 'renamed')
+
+class ReviewPartitionTest(TestCase):
+    """Retention never detaches review partitions, so ratings survive repairs"""
+
+    def setUp(self):
+        self.book = Book.objects.create(title='Title', author='Author', genre='Fiction',
+                                        isbn='0000000001', price=Decimal('10.00'))
+        user = CustomUser.objects.create_user(username='reader', password='secret')
+        for rating, when in [(5, datetime(2015, 3, 5, tzinfo=dt_timezone.utc)), (3, None)]:
+            review = Review.objects.create(user=user, book=self.book, rating=rating)
+            if when:
+                Review.objects.filter(pk=review.pk).update(date_reviewed=when)
+
+    def ratings(self):
+        self.book.refresh_from_db()
+        return self.book.total_ratings, self.book.average_rating
+
+    def test_retention_keeps_reviews(self):
+        before = self.ratings()
+        call_command('manage_partitions', retain_months=12, drop=True, stdout=StringIO())
+        self.assertEqual(Review.objects.count(), 2)
+
+        call_command('recompute_ratings', stdout=StringIO())
+        self.assertEqual(self.ratings(), before)
+        self.assertEqual(before, (2, 4.0))
+
+    def test_review_retention_is_refused(self):
+        with self.assertRaises(CommandError):
+            call_command('manage_partitions', table=['reviews'], retain_months=12,
+                         stdout=StringIO())
+        with self.assertRaises(ValueError):
+            detach_partitions('reviews', 12)
+
+class ConcurrentReviewEditTest(TransactionTestCase):
+    """Concurrent edits of one review leave its book summary equal to a fresh aggregate"""
+    THREADS = 8
+
+    def setUp(self):
+        self.book = Book.objects.create(title='Title', author='Author', genre='Fiction',
+                                        isbn='0000000001', price=Decimal('10.00'))
+        self.review = Review.objects.create(
+            user=CustomUser.objects.create_user(username='reader', password='secret'),
+            book=self.book, rating=1,
+        )
+
+    def test_concurrent_edits(self):
+        barrier = threading.Barrier(self.THREADS)
+
+        def edit(rating):
+            try:
+                review = Review.objects.get(pk=self.review.pk)
+                review.rating = rating
+                barrier.wait()
+                review.save()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            list(pool.map(edit, [2 + thread % 4 for thread in range(self.THREADS)]))
+
+        summary = BookReviewSummary.objects.get(book=self.book)
+        fresh, = BookReviewSummary.compute()
+        fields = BookReviewSummary.COUNTER_FIELDS
+        self.assertEqual([getattr(summary, field) for field in fields],
+                         [getattr(fresh, field) for field in fields])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_ratings, self.book.rating_sum),
+                         (1, Review.objects.get().rating))
@@ -1,19 +1,28 @@
 from django.shortcuts import render
-from rest_framework import viewsets, status, permissions, filters
+from rest_framework import viewsets, status, permissions, filters, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
-from django.db.models import Avg
-from .models import Review
+from django.db.models import Count, Q, Sum
+from .models import Review, BookReviewSummary
 from .serializers import ReviewSerializer
-from recommendations.ml_model import SentimentAnalyzer
+from recommendations.ml_model import SentimentAnalyzer, POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD
+from iqraa.conditional import ConditionalGetMixin
+from iqraa.export import ExportMixin
+from iqraa.pagination import PaginatedActionMixin
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ConditionalGetMixin, PaginatedActionMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['comment']
     ordering_fields = ['date_reviewed', 'rating']
+    ordering = ['-date_reviewed', 'id']
+    # Reviews embed their book and reviewer, so their timestamps are part of the
+    # validator; last_active is the user's auto_now timestamp
+    validator_fields = ['updated_at', 'book__updated_at', 'user__last_active']
+    export_fields = ['id', 'user_id', 'user__username', 'book_id', 'book__isbn', 'rating',
+                     'sentiment', 'date_reviewed', 'updated_at', 'comment']
     _sentiment_analyzer = None
 
     @property
@@ -23,7 +32,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return self._sentiment_analyzer
 
     def get_queryset(self):
-        queryset = Review.objects.all()
+        queryset = Review.objects.select_related('book', 'user').prefetch_related('book__categories')
         
         # Filter by book
         book_id = self.request.query_params.get('book', None)
@@ -51,19 +60,19 @@ class ReviewViewSet(viewsets.ModelViewSet):
         # Filter by sentiment
         sentiment = self.request.query_params.get('sentiment', None)
         if sentiment:
-            # This is a more expensive operation as we need to analyze each review
-            filtered_reviews = []
-            for review in queryset:
-                sent_score = self.sentiment_analyzer.analyze_sentiment(review.comment)
-                if sentiment == 'positive' and sent_score >= 0.05:
-                    filtered_reviews.append(review.id)
-                elif sentiment == 'negative' and sent_score <= -0.05:
-                    filtered_reviews.append(review.id)
-                elif sentiment == 'neutral' and -0.05 < sent_score < 0.05:
-                    filtered_reviews.append(review.id)
-            queryset = queryset.filter(id__in=filtered_reviews)
+            # Scores are stored on save and by the rescore_sentiment command
+            if sentiment == 'positive':
+                queryset = queryset.filter(sentiment__gte=POSITIVE_THRESHOLD)
+            elif sentiment == 'negative':
+                queryset = queryset.filter(sentiment__lte=NEGATIVE_THRESHOLD)
+            elif sentiment == 'neutral':
+                # Reviews without a comment (or not scored yet) count as neutral
+                queryset = queryset.filter(
+                    Q(sentiment__gt=NEGATIVE_THRESHOLD, sentiment__lt=POSITIVE_THRESHOLD) |
+                    Q(sentiment__isnull=True)
+                )
             
-        return queryset.order_by('-date_reviewed')
+        return queryset.order_by('-date_reviewed', 'id')
 
     def perform_create(self, serializer):
         # Check if user has already reviewed this book
@@ -79,29 +88,40 @@ class ReviewViewSet(viewsets.ModelViewSet):
             
         serializer.save(
             user=self.request.user,
-            date_reviewed=timezone.now()
+            date_reviewed=timezone.now(),
+            sentiment=self.score_comment(serializer)
         )
 
     def perform_update(self, serializer):
         # Only allow updating rating and comment
-        serializer.save(date_reviewed=timezone.now())
+        serializer.save(
+            date_reviewed=timezone.now(),
+            sentiment=self.score_comment(serializer)
+        )
+
+    def score_comment(self, serializer):
+        """Score the comment being saved, keeping the stored score if it is unchanged"""
+        comment = serializer.validated_data.get('comment')
+        if comment is None:
+            return serializer.instance.sentiment if serializer.instance else None
+        return self.sentiment_analyzer.analyze_sentiment(comment) if comment else None
 
     @action(detail=False)
     def my_reviews(self, request):
         """Get all reviews by the current user"""
-        reviews = Review.objects.filter(user=request.user)
-        page = self.paginate_queryset(reviews)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(reviews, many=True)
-        return Response(serializer.data)
+        reviews = (Review.objects.filter(user=request.user)
+                   .select_related('book', 'user')
+                   .prefetch_related('book__categories')
+                   .order_by('-date_reviewed', 'id'))
+        return self.paginated_response(reviews)
 
     @action(detail=False)
     def recent(self, request):
         """Get recent reviews with optional limit parameter"""
         limit = int(request.query_params.get('limit', 10))
-        reviews = Review.objects.all().order_by('-date_reviewed')[:limit]
+        reviews = (Review.objects.select_related('book', 'user')
+                   .prefetch_related('book__categories')
+                   .order_by('-date_reviewed', 'id')[:limit])
         serializer = self.get_serializer(reviews, many=True)
         return Response(serializer.data)
 
@@ -110,9 +130,10 @@ class ReviewViewSet(viewsets.ModelViewSet):
         """Get top-rated reviews"""
         min_rating = int(request.query_params.get('min_rating', 4))
         reviews = (Review.objects.filter(rating__gte=min_rating)
-                  .order_by('-rating', '-date_reviewed'))
-        serializer = self.get_serializer(reviews, many=True)
-        return Response(serializer.data)
+                  .select_related('book', 'user')
+                  .prefetch_related('book__categories')
+                  .order_by('-rating', '-date_reviewed', 'id'))
+        return self.paginated_response(reviews)
 
     @action(detail=True, methods=['get'])
     def sentiment(self, request, pk=None):
@@ -125,12 +146,12 @@ class ReviewViewSet(viewsets.ModelViewSet):
                 "interpretation": "neutral"
             })
             
-        sentiment = self.sentiment_analyzer.analyze_sentiment(review.comment)
+        sentiment = review.sentiment
+        if sentiment is None:
+            sentiment = self.sentiment_analyzer.analyze_sentiment(review.comment)
         return Response({
             "sentiment": sentiment,
-            "interpretation": "positive" if sentiment >= 0.05 
-                            else "negative" if sentiment <= -0.05 
-                            else "neutral",
+            "interpretation": SentimentAnalyzer.interpret(sentiment),
             "review_id": review.id,
             "book_title": review.book.title
         })
@@ -145,8 +166,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
             
-        reviews = Review.objects.filter(book_id=book_id)
-        if not reviews:
+        summary = BookReviewSummary.objects.filter(book_id=book_id).first()
+        if summary is None or not summary.review_count:
             return Response({
                 "detail": "No reviews found for this book",
                 "sentiment_stats": {
@@ -157,31 +178,15 @@ class ReviewViewSet(viewsets.ModelViewSet):
                 }
             })
             
-        sentiments = []
-        stats = {"positive": 0, "neutral": 0, "negative": 0}
-        
-        for review in reviews:
-            if review.comment:
-                sentiment = self.sentiment_analyzer.analyze_sentiment(review.comment)
-                sentiments.append(sentiment)
-                if sentiment >= 0.05:
-                    stats["positive"] += 1
-                elif sentiment <= -0.05:
-                    stats["negative"] += 1
-                else:
-                    stats["neutral"] += 1
-        
-        avg_sentiment = sum(sentiments) / len(sentiments) if sentiments else 0
+        avg_sentiment = summary.average_sentiment
         
         return Response({
             "book_id": book_id,
-            "total_reviews": len(reviews),
-            "reviews_with_comments": len(sentiments),
+            "total_reviews": summary.review_count,
+            "reviews_with_comments": summary.sentiment_count,
             "average_sentiment": round(avg_sentiment, 2),
-            "sentiment_stats": stats,
-            "interpretation": "positive" if avg_sentiment >= 0.05 
-                            else "negative" if avg_sentiment <= -0.05 
-                            else "neutral"
+            "sentiment_stats": summary.sentiment_distribution,
+            "interpretation": SentimentAnalyzer.interpret(avg_sentiment)
         })
 
     @action(detail=False, methods=['get'])
@@ -190,30 +195,28 @@ class ReviewViewSet(viewsets.ModelViewSet):
         book_id = request.query_params.get('book', None)
         user_id = request.query_params.get('user', None)
         
-        queryset = Review.objects
-        if book_id:
-            queryset = queryset.filter(book_id=book_id)
         if user_id:
-            queryset = queryset.filter(user_id=user_id)
-            
-        stats = queryset.aggregate(
-            total_reviews=models.Count('id'),
-            average_rating=models.Avg('rating'),
-            rating_1=models.Count('id', filter=models.Q(rating=1)),
-            rating_2=models.Count('id', filter=models.Q(rating=2)),
-            rating_3=models.Count('id', filter=models.Q(rating=3)),
-            rating_4=models.Count('id', filter=models.Q(rating=4)),
-            rating_5=models.Count('id', filter=models.Q(rating=5))
-        )
+            # Per-user statistics are not summarised, aggregate the user's reviews
+            queryset = Review.objects.filter(user_id=user_id)
+            if book_id:
+                queryset = queryset.filter(book_id=book_id)
+            stats = queryset.aggregate(
+                review_count=Count('id'),
+                rating_sum=Sum('rating', default=0),
+                **{f'rating_{score}': Count('id', filter=Q(rating=score)) for score in range(1, 6)}
+            )
+            summary = BookReviewSummary(**stats)
+        elif book_id:
+            summary = (BookReviewSummary.objects.filter(book_id=book_id).first()
+                       or BookReviewSummary())
+        else:
+            totals = BookReviewSummary.objects.aggregate(
+                **{field: Sum(field, default=0) for field in BookReviewSummary.COUNTER_FIELDS}
+            )
+            summary = BookReviewSummary(**totals)
         
         return Response({
-            "total_reviews": stats['total_reviews'],
-            "average_rating": round(stats['average_rating'], 2) if stats['average_rating'] else 0,
-            "rating_distribution": {
-                "1": stats['rating_1'],
-                "2": stats['rating_2'],
-                "3": stats['rating_3'],
-                "4": stats['rating_4'],
-                "5": stats['rating_5']
-            }
+            "total_reviews": summary.review_count,
+            "average_rating": round(summary.average_rating, 2),
+            "rating_distribution": summary.rating_distribution
         })
@@ -9,8 +9,9 @@ from .serializers import UserSerializer
 from books.models import Book
 from reviews.models import Review
 from orders.models import Order
+from iqraa.pagination import PaginatedActionMixin
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(PaginatedActionMixin, viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     filter_backends = [filters.SearchFilter]
@@ -91,10 +92,13 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        orders = Order.objects.filter(user=user)
+        # Orders render their book (with its categories) and user, as in OrderViewSet
+        orders = (Order.objects.filter(user=user)
+                  .select_related('book', 'user')
+                  .prefetch_related('book__categories')
+                  .order_by('-date_ordered', 'id'))
         from orders.serializers import OrderSerializer
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(orders, OrderSerializer)
 
     @action(detail=True, methods=['get'])
     def review_history(self, request, pk=None):
@@ -106,10 +110,12 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        reviews = Review.objects.filter(user=user)
+        reviews = (Review.objects.filter(user=user)
+                   .select_related('book', 'user')
+                   .prefetch_related('book__categories')
+                   .order_by('-date_reviewed', 'id'))
         from reviews.serializers import ReviewSerializer
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(reviews, ReviewSerializer)
 
     @action(detail=True, methods=['post'])
     def update_preferences(self, request, pk=None):